@@ -39,6 +39,12 @@ datasets = ConfigObject('datasets',None)
 #                               comparing values (use 0 for discrete types
 #                               or to require integer directions)
 #
+# hourly datasets may also have the following parameters :
+#
+# daily_reducers : tuple of names of the reducers used to resample hourly data
+#                  to days (see rccpy.timeseries.resample), e.g. ('sum',) for
+#                  precipitation. Datasets without it use ('mean',)
+#
 # generated datasets have the following paramaters :
 #
 # dependencies : tuple of names of datasets used to generate data
@@ -91,6 +97,7 @@ datasets.lwet = {
         'tsvar_type'  : (float, N.inf, 'minutes', 'lwet', 'minutes'),
         'units'       : (int, 'minutes', float, 'minutes'),
         'value_type'  : ('discrete', 0, 60., 0),
+        'daily_reducers' : ('sum',),
         }
 
 # hourly precipitation (pcpn) - we use maximum daily precip for lack of
@@ -102,6 +109,7 @@ datasets.pcpn = {
         'tsvar_type'  : (float, N.inf, 'in*100',  'prcp', 'inch'),
         'units'       : (int, 'in*100', float, 'inch'),
         'value_type'  : ('linear', 0, 26., 3),
+        'daily_reducers' : ('sum',),
         }
 
 # relative humidity (rhum)
@@ -123,6 +131,7 @@ datasets.srad = {
         'tsvar_type'  : (float, N.inf, 'langley*100', 'srad', 'langley'),
         'units'       : (int, 'langley*100', float, 'langley'),
         'value_type'  : ('linear', 0, N.inf, 2),
+        'daily_reducers' : ('sum',),
         }
 
 # temperature of soil at depth of 4 inches depth (st4i)
@@ -133,6 +142,7 @@ datasets.st4i = {
         'tsvar_type'  : (float, N.inf, 'F*10', 'st4i', 'F'),
         'units'       : (int, 'F', float, 'degF'),
         'value_type'  : ('linear', -50., 130., 1),
+        'daily_reducers' : ('mean','min','max'),
         }
 
 # temperature of soil at depth of 8 inches depth (st8i)
@@ -143,6 +153,7 @@ datasets.st8i = {
         'tsvar_type'  : (float, N.inf, 'F*10', 'st8i', 'F'),
         'units'       : (int, 'F', float, 'degF'),
         'value_type'  : ('linear', -50., 130., 1),
+        'daily_reducers' : ('mean','min','max'),
         }
 
 # temperature (temp)
@@ -154,6 +165,7 @@ datasets.temp = {
         'tsvar_type'  : (float, N.inf, 'F*10', 'temp', 'F'),
         'units'       : (int, 'F', float, 'degF'),
         'value_type'  : ('linear', -50., 130., 1),
+        'daily_reducers' : ('mean','min','max'),
         }
 
 # wind direction (wdir)
@@ -164,6 +176,7 @@ datasets.wdir = {
         'tsvar_type'  : (float, N.inf, 'degrees', 'wdir', 'degrees'),
         'units'       : (int, 'degrees', float, 'degrees'),
         'value_type'  : ('direction', 0, 360, 0),
+        'daily_reducers' : ('vector_mean',),
         }
 
 # wind speed (wspd)
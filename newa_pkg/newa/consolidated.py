@@ -0,0 +1,316 @@
+""" Network-wide hourly data store.
+
+All stations share a single hour axis. Each element is stored as a
+stations x hours array that is chunked for reads of many stations over a
+short window of hours. A 'ucanid' dataset maps rows to stations.
+
+The store is built and updated from the per-station hourly data files.
+Values are copied exactly as they are stored in the station files, so the
+same serialization rules apply to both.
+"""
+
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+import numpy as N
+
+from rccpy.hdf5.manager import HDF5DataFileManager
+from rccpy.timeseries.resample import resampleArray
+from rccpy.timeseries.timezones import gmtOffsets, shiftRows
+from rccpy.utils.timeutils import asDatetime, dateAsTuple
+
+from newa.manager import getDailyReducers, getSerialCriteria
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# (stations, hours) ... one week of hours for 64 stations per chunk
+CONSOLIDATED_CHUNKS = (64, 168)
+MISSING = -32768
+
+def hoursBetween(first_hour, last_hour):
+    delta = asDatetime(last_hour) - asDatetime(first_hour)
+    return (delta.days * 24) + (delta.seconds / 3600)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class ConsolidatedDataFileManager(HDF5DataFileManager):
+
+    def __init__(self, filepath=None, mode='r'):
+        self.row_map = None
+        HDF5DataFileManager.__init__(self, filepath, mode)
+
+    def closeFile(self):
+        self.row_map = None
+        HDF5DataFileManager.closeFile(self)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def initialize(self, first_hour):
+        """ Sets the first hour of the shared hour axis in a new file.
+        """
+        self.assertFileWritable()
+        if 'ucanid' in self.listDatasets():
+            raise IOError, 'Consolidated data file is already initialized.'
+        first_hour = dateAsTuple(first_hour, True)
+        self.setFileAttributes(first_hour=first_hour, last_hour=first_hour,
+                               frequency='hour', interval=1)
+        self.createExtensibleDataset('ucanid', (0,), (None,), '<i4', -1,
+                                     { 'description' : 'UCAN id for row', },
+                                     chunk_size=(1024,), compression=None)
+
+    def firstHour(self):
+        return tuple(self.getFileAttribute('first_hour'))
+
+    def hourIndex(self, hour):
+        return hoursBetween(self.firstHour(), hour)
+
+    def timeAtIndex(self, index):
+        hour = asDatetime(self.firstHour()) + relativedelta(hours=int(index))
+        return hour.timetuple()[:4]
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def listElements(self):
+        return tuple([name for name in self.listGroups() if '.' not in name])
+
+    def listStations(self):
+        return self.getData('ucanid')
+
+    def rowMap(self):
+        if self.row_map is None:
+            ucanids = self.getData('ucanid')
+            self.row_map = dict(zip(ucanids.tolist(), range(len(ucanids))))
+        return self.row_map
+
+    def stationRow(self, ucanid):
+        return self.rowMap().get(int(ucanid), None)
+
+    def addStation(self, ucanid):
+        """ Adds a row for the station to every element and returns the
+        index of the row.
+        """
+        row = self.stationRow(ucanid)
+        if row is not None: return row
+
+        row = len(self.rowMap())
+        self.appendData('ucanid', N.array([ucanid,], dtype='<i4'))
+        for element in self.listElements():
+            self._resize(element, num_rows=row+1)
+            self._resizeLastHourIndex(element, row+1)
+        self.row_map[int(ucanid)] = row
+        return row
+
+    def addElement(self, element, attrs):
+        """ Creates the stations x hours dataset for an element. attrs must
+        contain the units of the data in the station files.
+        """
+        num_rows = len(self.rowMap())
+        group_attrs = { 'units' : attrs['units'],
+                        'missing' : attrs.get('missing', MISSING),
+                        'frequency' : 'hour', 'interval' : 1,
+                        'first_hour' : self.firstHour(),
+                        'last_hour' : self.firstHour(),
+                      }
+        for attr_name in ('description', 'value_type'):
+            if attr_name in attrs: group_attrs[attr_name] = attrs[attr_name]
+        self.createGroup(element, group_attrs)
+        self.createExtensibleDataset('%s.value' % element, (num_rows, 0),
+                                     (None, None), 'i2', MISSING,
+                                     group_attrs, CONSOLIDATED_CHUNKS)
+        self.createExtensibleDataset('%s.last_index' % element, (num_rows,),
+                                     (None,), '<i4', -1,
+                  { 'description' : 'index of last hour copied from station' },
+                                     chunk_size=(1024,), compression=None)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def nextStationHour(self, ucanid, element):
+        """ Returns the first hour that has not been copied for the station,
+        or None when nothing has been copied for the element yet.
+        """
+        if element not in self.listElements(): return None
+        row = self.stationRow(ucanid)
+        if row is None: return None
+        last_index = self.getDataset('%s.last_index' % element)
+        if row >= len(last_index) or last_index[row] < 0: return None
+        return self.timeAtIndex(int(last_index[row]) + 1)
+
+    def updateStation(self, ucanid, element, data, first_hour, attrs=None):
+        """ Copies station data into the store. Only hours that are later
+        than the last hour previously copied for the station are written,
+        and hours before the start of the shared hour axis are ignored.
+        Returns the number of hours written.
+        """
+        self.assertFileWritable()
+        if element not in self.listElements():
+            if attrs is None:
+                errmsg = "'%s' element is not in consolidated data file."
+                raise KeyError, errmsg % element
+            self.addElement(element, attrs)
+        row = self.addStation(ucanid)
+
+        start = self.hourIndex(first_hour)
+        last_index = self.getDataset('%s.last_index' % element)
+        skip = max(0, (int(last_index[row]) + 1) - start)
+        if skip >= len(data): return 0
+        if skip > 0:
+            data = data[skip:]
+            start += skip
+        end = start + len(data)
+
+        self._resize(element, num_hours=end)
+        self.getDataset('%s.value' % element)[row, start:end] = data
+        last_index[row] = end - 1
+
+        last_hour = self.timeAtIndex(end-1)
+        if last_hour > tuple(self.getGroupAttribute(element, 'last_hour')):
+            self.setGroupAttribute(element, 'last_hour', last_hour)
+            self.setDatasetAttribute('%s.value' % element, 'last_hour',
+                                     last_hour)
+        if last_hour > tuple(self.getFileAttribute('last_hour')):
+            self.setFileAttribute('last_hour', last_hour)
+        return len(data)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def getWindow(self, element, start_hour, end_hour, ucanids=None,
+                        include_attributes=False):
+        """ Returns (ucanids, data) where data is a stations x hours array for
+        the hours between start_hour and end_hour inclusive. Rows for all
+        stations are returned when ucanids is None. Hours that are not in
+        the store are filled with the missing value.
+        """
+        dataset = self.getDataset('%s.value' % element)
+        start = self.hourIndex(start_hour)
+        end = self.hourIndex(end_hour) + 1
+        if end <= start:
+            errmsg = 'End hour %s is before start hour %s'
+            raise ValueError, errmsg % (str(end_hour), str(start_hour))
+
+        all_ucanids = self.getData('ucanid')
+        if ucanids is None:
+            rows = N.arange(len(all_ucanids))
+        else:
+            row_map = self.rowMap()
+            rows = [ row_map.get(int(ucanid), -1) for ucanid in ucanids ]
+            rows = N.array(rows, dtype=int)
+
+        data = N.empty((len(rows), end-start), dtype=dataset.dtype)
+        data.fill(MISSING)
+        first = max(start, 0)
+        last = min(end, dataset.shape[1])
+        valid = N.where(rows >= 0)[0]
+        if last > first and len(valid) > 0:
+            if ucanids is None:
+                data[:, first-start:last-start] = dataset[:, first:last]
+            else:
+                # h5py requires increasing row indexes
+                order = N.argsort(rows[valid])
+                sorted_rows = rows[valid][order]
+                unique_rows, inverse = N.unique(sorted_rows,
+                                                return_inverse=True)
+                block = dataset[list(unique_rows), first:last]
+                data[valid[order], first-start:last-start] = block[inverse]
+
+        if ucanids is None: ucanids = all_ucanids
+        else: ucanids = N.array(ucanids)
+        if include_attributes:
+            attrs = dict(self.getDatasetAttributes('%s.value' % element))
+            attrs['first_hour'] = dateAsTuple(start_hour, True)
+            attrs['last_hour'] = dateAsTuple(end_hour, True)
+            return ucanids, data, attrs
+        return ucanids, data
+
+    def getSerialWindow(self, element, start_hour, end_hour, ucanids=None,
+                              include_attributes=False):
+        """ Same as getWindow, but data is serialized using the element
+        configuration.
+        """
+        ucanids, data, attrs = self.getWindow(element, start_hour, end_hour,
+                                              ucanids, True)
+        serial_attrs = getSerialCriteria(element)
+        if serial_attrs is not None:
+            data, attrs = self._serialize(data, attrs, serial_attrs)
+        if include_attributes: return ucanids, data, attrs
+        return ucanids, data
+
+    def getUtcWindow(self, element, start_hour, end_hour, gmt, ucanids=None):
+        """ Same as getWindow, except start_hour and end_hour are UTC. The
+        store is in each station's local standard time, so every row is
+        shifted by the station's gmt offset. gmt is either a sequence of
+        offsets in the same order as ucanids (or as listStations() when
+        ucanids is None) or a dictionary of offsets by ucanid. Stations with
+        unknown offsets are missing.
+        """
+        if ucanids is None: row_ucanids = self.listStations()
+        else: row_ucanids = ucanids
+        if isinstance(gmt, dict):
+            gmt = [ gmt.get(int(ucanid), MISSING) for ucanid in row_ucanids ]
+        offsets, valid = gmtOffsets(gmt)
+        if len(offsets) != len(row_ucanids):
+            errmsg = '%d gmt offsets for %d stations'
+            raise ValueError, errmsg % (len(offsets), len(row_ucanids))
+        if valid.any():
+            first = int(offsets[valid].min())
+            last = int(offsets[valid].max())
+        else: first = last = 0
+
+        # local time window that covers the UTC window at every station
+        start_hour = asDatetime(start_hour)
+        end_hour = asDatetime(end_hour)
+        ucanids, data = self.getWindow(element,
+                                       start_hour + relativedelta(hours=first),
+                                       end_hour + relativedelta(hours=last),
+                                       ucanids)
+        num_hours = hoursBetween(start_hour, end_hour) + 1
+        data = shiftRows(data, offsets - first, MISSING, num_hours)
+        data[~valid] = MISSING
+        return ucanids, data
+
+    def getDailyWindow(self, element, start_day, end_day, ucanids=None,
+                             reducers=None, day_start_hour=0, min_coverage=0.):
+        """ Returns (ucanids, days) where days is a dictionary with a
+        stations x days array of serialized data for each reducer. All
+        stations and days are resampled at once. Days start at
+        day_start_hour and are labeled with the date they end on, so with
+        day_start_hour=8 the data for start_day begins at 8 AM on the
+        previous date. reducers defaults to the element's daily_reducers.
+        """
+        if reducers is None: reducers = getDailyReducers(element)
+        elif isinstance(reducers, basestring): reducers = (reducers,)
+        shift = (24 - int(day_start_hour)) % 24
+        start_day = asDatetime(start_day)
+        start_hour = datetime(start_day.year, start_day.month, start_day.day)
+        start_hour -= relativedelta(hours=shift)
+        end_day = asDatetime(end_day)
+        end_hour = datetime(end_day.year, end_day.month, end_day.day, 23)
+        end_hour -= relativedelta(hours=shift)
+
+        ucanids, data, attrs = self.getSerialWindow(element, start_hour,
+                                                    end_hour, ucanids, True)
+        missing = attrs.get('missing', None)
+        if missing is None: fill = N.nan
+        else: fill = missing
+        days = { }
+        for reducer in reducers:
+            days[reducer] = resampleArray(data, 'hour', start_hour, 1, missing,
+                                          'day', reducer, day_start_hour,
+                                          min_coverage, 1, fill)[1]
+        return ucanids, days
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _resize(self, element, num_rows=None, num_hours=None):
+        dataset = self.getDataset('%s.value' % element)
+        rows, hours = dataset.shape
+        if num_rows is None: num_rows = rows
+        if num_hours is None or num_hours < hours: num_hours = hours
+        if (num_rows, num_hours) != (rows, hours):
+            self._clearColumnCache()
+            dataset.resize((num_rows, num_hours))
+
+    def _resizeLastHourIndex(self, element, num_rows):
+        dataset = self.getDataset('%s.last_index' % element)
+        if dataset.shape[0] < num_rows:
+            self.resizeDataset('%s.last_index' % element, num_rows)
+
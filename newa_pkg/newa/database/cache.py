@@ -0,0 +1,266 @@
+""" Process-wide, column oriented cache of the station index file.
+
+Each column of the index is read from disk once and kept as a NumPy array.
+Selection and sorting are done on the arrays and the results are returned
+as light-weight row views that only convert values when they are accessed.
+A cached index is discarded as soon as the modification time or size of
+the index file changes.
+"""
+
+import os
+
+import numpy as N
+
+from rccpy.hdf5.manager import HDF5DataFileManager
+from rccpy.hdf5.query import compileCriteria
+from rccpy.utils.data import safeDataKey, safevalue
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class StationRow(object):
+    """ Read-mostly dictionary view of a single station in the index.
+    Values that are assigned to the view and keys that are deleted from it
+    are kept in the view and do not modify the cached columns.
+    """
+    __slots__ = ('_columns','_deleted','_index','_names','_updates')
+
+    def __init__(self, columns, names, index):
+        self._columns = columns
+        self._index = index
+        self._names = names
+        self._updates = None
+        self._deleted = None
+
+    def __contains__(self, key):
+        if self._updates is not None and key in self._updates: return True
+        if self._deleted is not None and key in self._deleted: return False
+        return key in self._names
+
+    def __getitem__(self, key):
+        if self._updates is not None and key in self._updates:
+            return self._updates[key]
+        if key not in self: raise KeyError, key
+        return safevalue(self._columns[key][self._index])
+
+    def __setitem__(self, key, value):
+        if self._updates is None: self._updates = { }
+        self._updates[key] = value
+        if self._deleted is not None: self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self: raise KeyError, key
+        if self._updates is not None: self._updates.pop(key, None)
+        if key in self._names:
+            if self._deleted is None: self._deleted = set()
+            self._deleted.add(key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(self.asDict())
+
+    def asDict(self):
+        station = { }
+        for key in self.keys():
+            station[key] = self[key]
+        return station
+    copy = asDict
+
+    def get(self, key, default=None):
+        if key in self: return self[key]
+        return default
+
+    def has_key(self, key):
+        return key in self
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def keys(self):
+        keys = [ key for key in self._names
+                 if self._deleted is None or key not in self._deleted ]
+        if self._updates is not None:
+            for key in self._updates:
+                if key not in keys: keys.append(key)
+        return keys
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default: return default[0]
+            raise KeyError, key
+        value = self[key]
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self: self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class StationRows(object):
+    """ Sequence of StationRow views on a subset of the cached index.
+    """
+
+    def __init__(self, columns, names, indexes):
+        self._columns = columns
+        self.names = tuple(names)
+        self.indexes = indexes
+        self._rows = { }
+
+    def __getitem__(self, indx):
+        if isinstance(indx, slice):
+            return StationRows(self._columns, self.names, self.indexes[indx])
+        if indx < 0: indx += len(self.indexes)
+        row = self._rows.get(indx, None)
+        if row is None:
+            row = StationRow(self._columns, self.names, self.indexes[indx])
+            # keep the row so that values assigned to it are not lost
+            self._rows[indx] = row
+        return row
+
+    def __iter__(self):
+        for indx in range(len(self.indexes)):
+            yield self[indx]
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def asDicts(self):
+        return [row.asDict() for row in self]
+
+    def column(self, name):
+        """ Returns the values of a column for the selected stations.
+        """
+        return self._columns[name][self.indexes]
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class StationIndexCache(object):
+
+    def __init__(self, index_filepath):
+        self.filepath = os.path.abspath(index_filepath)
+        self._reset()
+
+    def _reset(self):
+        self.columns = { }
+        self.dataset_names = None
+        self.num_stations = None
+        self.signature = None
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def fileSignature(self):
+        if not os.path.exists(self.filepath):
+            raise IOError, 'File not found : %s' % self.filepath
+        info = os.stat(self.filepath)
+        return (info.st_mtime, info.st_size)
+
+    def validate(self):
+        """ Discards all cached columns if the index file has changed since
+        they were read.
+        """
+        signature = self.fileSignature()
+        if signature != self.signature:
+            self._reset()
+            self.signature = signature
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def column(self, name):
+        if name not in self.columns: self.load((name,))
+        return self.columns[name]
+
+    def listDatasets(self):
+        self.validate()
+        if self.dataset_names is None: self.load(())
+        return self.dataset_names
+
+    def load(self, column_names):
+        """ Reads any of the columns that are not already cached.
+        """
+        self.validate()
+        missing = [name for name in column_names if name not in self.columns]
+        if missing or self.dataset_names is None:
+            manager = HDF5DataFileManager(self.filepath, 'r')
+            try:
+                if self.dataset_names is None:
+                    self.dataset_names = tuple(manager.listDatasets())
+                for name in missing:
+                    self.columns[name] = manager.getData(name)
+            finally:
+                manager.closeFile()
+            for name in missing:
+                if self.num_stations is None:
+                    self.num_stations = len(self.columns[name])
+        return self.columns
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def select(self, criteria=None):
+        """ Returns the indexes of stations that satisfy criteria.
+        """
+        if criteria:
+            query = compileCriteria(criteria)
+            if len(query) > 0:
+                self.load(query.keys())
+                return query.indexes(self.column)
+        if self.num_stations is None:
+            self.load((self.listDatasets()[0],))
+        return N.arange(self.num_stations)
+
+    def sort(self, indexes, sort_by):
+        """ Returns indexes reordered by the values in the sort_by columns.
+        """
+        if isinstance(sort_by, basestring):
+            sort_keys = [key.strip() for key in sort_by.split(',')]
+        else: sort_keys = list(sort_by)
+        if len(indexes) < 2 or not sort_keys: return indexes
+
+        self.load(sort_keys)
+        keys = [self.columns[key][indexes] for key in sort_keys]
+        if any([key.dtype.kind == 'O' for key in keys]):
+            # object columns (variable length strings) cannot be lexsorted
+            order = sorted(range(len(indexes)),
+                           key=lambda i: tuple([key[i] for key in keys]))
+            return indexes[N.array(order, dtype=int)]
+        # lexsort uses the last key as the primary sort key
+        keys.reverse()
+        return indexes[N.lexsort(keys)]
+
+    def stations(self, column_names, criteria=None, sort_by=None):
+        """ Returns a StationRows view of the selected stations.
+        """
+        column_names = [safeDataKey(name) for name in column_names]
+        indexes = self.select(criteria)
+        if sort_by is not None: indexes = self.sort(indexes, sort_by)
+        return StationRows(self.load(column_names), column_names, indexes)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+STATION_INDEX_CACHES = { }
+
+def stationIndexCache(index_filepath):
+    """ Returns the process-wide cache for the index file.
+    """
+    key = os.path.abspath(index_filepath)
+    cache = STATION_INDEX_CACHES.get(key, None)
+    if cache is None:
+        cache = StationIndexCache(key)
+        STATION_INDEX_CACHES[key] = cache
+    return cache
+
+def clearStationIndexCaches():
+    STATION_INDEX_CACHES.clear()
+
@@ -0,0 +1,316 @@
+""" Persistent SQLite catalog of station data files.
+
+The catalog keeps the file attributes, element groups, period of record
+and modification time of every station file in a directory, so station
+searches are done with indexed SQL instead of opening every file. Only
+files that are new or have changed since the last refresh are reopened.
+"""
+
+import os
+
+import numpy as N
+
+from rccpy.base.sqlite import SqliteDatabaseManager
+from rccpy.hdf5.query import compileCriteria, FUNCTIONS
+from rccpy.utils.timeutils import dateAsTuple
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+FILES_TABLE = 'station_files'
+COLUMNS_TABLE = 'catalog_columns'
+
+# columns maintained by the catalog itself, not copied from file attributes
+FILE_COLUMNS = ( ('filepath', 'TEXT'), ('directory', 'TEXT'),
+                 ('file_type', 'TEXT'), ('mtime', 'REAL'),
+                 ('size', 'INTEGER'), ('elements', 'TEXT') )
+FILE_COLUMN_NAMES = tuple([column[0] for column in FILE_COLUMNS])
+
+# attribute columns that get an index when they are first added
+INDEXED_COLUMNS = ('ucanid', 'sid', 'state', 'county', 'network', 'lat', 'lon',
+                   'first_hour', 'last_hour')
+
+SQL_KINDS = { 'int' : 'INTEGER', 'float' : 'REAL', 'text' : 'TEXT',
+              'ints' : 'TEXT', 'floats' : 'TEXT', 'hour' : 'INTEGER',
+              'day' : 'INTEGER', 'month' : 'INTEGER' }
+
+# date attributes (e.g. first_hour, last_hour) are stored as a numeric key,
+# year*1000000 + month*10000 + day*100 + hour for hours, so that range
+# criteria compare them in time order
+DATE_PREFIXES = ('first', 'last', 'earliest', 'latest')
+DATE_KINDS = { 'hour' : 4, 'day' : 3, 'month' : 2 }
+DATE_KIND_FOR_SIZE = { 4 : 'hour', 3 : 'day', 2 : 'month' }
+
+SQL_OPERATORS = { '==' : '=', 'eq' : '=', '!=' : '!=', 'ne' : '!=',
+                  '<' : '<', 'lt' : '<', '<=' : '<=', 'le' : '<=',
+                  '>' : '>', 'gt' : '>', '>=' : '>=', 'ge' : '>=' }
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def isDateAttribute(name):
+    return name.split('_')[0] in DATE_PREFIXES
+
+def dateKey(value, kind):
+    """ Returns the numeric key for a date tuple, list, string or integer
+    date in a date column of kind 'hour', 'day' or 'month'.
+    """
+    if isinstance(value, (tuple,list,N.ndarray)):
+        parts = [ int(part) for part in value ]
+    else: parts = list(dateAsTuple(value, kind == 'hour'))
+    size = DATE_KINDS[kind]
+    key = 0
+    for part in (parts + [0,] * size)[:size]: key = (key * 100) + part
+    return key
+
+def dateFromKey(key, kind):
+    parts = [ ]
+    for indx in range(DATE_KINDS[kind] - 1):
+        key, part = divmod(key, 100)
+        parts.insert(0, int(part))
+    return (int(key),) + tuple(parts)
+
+def encodeAttribute(value, name=None):
+    """ Returns (kind, value) where value can be stored in SQLite. Date
+    attributes are stored as a numeric key, other sequences are stored as
+    comma separated text.
+    """
+    if hasattr(value, 'dtype') and value.shape == (): value = value.item()
+    if isinstance(value, bool): return 'int', int(value)
+    if isinstance(value, (int,long)): return 'int', value
+    if isinstance(value, float):
+        if N.isnan(value): return 'float', None
+        return 'float', value
+    if isinstance(value, basestring): return 'text', value
+    if isinstance(value, (tuple,list,N.ndarray)):
+        values = list(value)
+        if all([isinstance(item, (int,long,N.integer)) for item in values]):
+            kind = DATE_KIND_FOR_SIZE.get(len(values), None)
+            if kind is not None and name is not None and isDateAttribute(name):
+                return kind, dateKey(values, kind)
+            return 'ints', ','.join(['%d' % item for item in values])
+        if all([isinstance(item, (int,long,float,N.number))
+                for item in values]):
+            return 'floats', ','.join([repr(float(item)) for item in values])
+    return 'text', str(value)
+
+def decodeAttribute(kind, value):
+    if value is None:
+        if kind == 'float': return N.nan
+        return None
+    if kind in DATE_KINDS: return dateFromKey(value, kind)
+    if kind == 'ints':
+        if not value: return ()
+        return tuple([int(item) for item in value.split(',')])
+    if kind == 'floats':
+        if not value: return ()
+        return tuple([float(item) for item in value.split(',')])
+    if kind == 'text' and isinstance(value, unicode): return str(value)
+    return value
+
+def quoteName(name):
+    return '"%s"' % name.replace('"','""')
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class StationFileCatalog(SqliteDatabaseManager):
+
+    def __init__(self, database_filepath, auto_commit_rate=100):
+        SqliteDatabaseManager.__init__(self, database_filepath,
+                                       auto_commit_rate)
+        self.column_kinds = None
+        if self.tableExists(FILES_TABLE): self._upgradeTables()
+        else: self._createTables()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def attributeColumns(self):
+        """ Returns a dictionary of attribute column names and the kind of
+        value stored in each one.
+        """
+        if self.column_kinds is None:
+            sql = 'SELECT name, kind FROM %s' % COLUMNS_TABLE
+            self.column_kinds = dict([(str(name), str(kind))
+                                      for name, kind in self.fetch(sql)])
+        return self.column_kinds
+
+    def listColumnNames(self):
+        return FILE_COLUMN_NAMES + tuple(sorted(self.attributeColumns()))
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def refreshDirectory(self, directory_path, file_type, ManagerClass):
+        """ Brings the catalog up to date with the '*_<file_type>.h5' files in
+        a directory. Only new files and files whose modification time or
+        size has changed are opened. Returns the number of files that were
+        read and the number that were dropped from the catalog.
+        """
+        directory_path = os.path.normpath(os.path.abspath(directory_path))
+        file_suffix = '_%s.h5' % file_type
+        sql = 'SELECT filepath, mtime, size FROM %s WHERE directory=?'
+        cataloged = { }
+        for filepath, mtime, size in self.execute(sql % FILES_TABLE,
+                                                  (directory_path,)).fetchall():
+            cataloged[str(filepath)] = (mtime, size)
+
+        num_read = 0
+        found = set()
+        for name in os.listdir(directory_path):
+            if not name.endswith(file_suffix): continue
+            filepath = os.path.join(directory_path, name)
+            info = os.stat(filepath)
+            found.add(filepath)
+            if cataloged.get(filepath, None) == (info.st_mtime, info.st_size):
+                continue
+            self.updateFile(filepath, file_type, ManagerClass, info)
+            num_read += 1
+
+        dropped = [filepath for filepath in cataloged if filepath not in found]
+        for filepath in dropped:
+            self.execute('DELETE FROM %s WHERE filepath=?' % FILES_TABLE,
+                         (filepath,))
+        self.commit()
+        return num_read, len(dropped)
+
+    def updateFile(self, filepath, file_type, ManagerClass, info=None):
+        """ Reads the attributes of a single file into the catalog.
+        """
+        filepath = os.path.normpath(os.path.abspath(filepath))
+        if info is None: info = os.stat(filepath)
+
+        manager = ManagerClass(filepath, 'r')
+        try:
+            attrs = manager.getFileAttributes()
+            if 'hour' in file_type: elements = ','.join(manager.listGroups())
+            else: elements = None
+        finally:
+            manager.closeFile()
+
+        record = { 'filepath' : filepath,
+                   'directory' : os.path.dirname(filepath),
+                   'file_type' : file_type, 'mtime' : info.st_mtime,
+                   'size' : info.st_size, 'elements' : elements, }
+        for name, value in attrs.items():
+            if name in FILE_COLUMN_NAMES: continue
+            kind, value = encodeAttribute(value, name)
+            self._addColumn(name, kind)
+            record[name] = value
+
+        names = record.keys()
+        sql = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)'
+        sql = sql % (FILES_TABLE, ','.join([quoteName(name) for name in names]),
+                     ','.join(['?'] * len(names)))
+        self.execute(sql, [record[name] for name in names])
+        self.num_pending_transactions += 1
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def getStations(self, directory_path, file_type, columns=None,
+                          criteria=None, sort_by=None):
+        """ Returns a list of station dictionaries for cataloged files in
+        the directory that satisfy criteria (same formats as the station
+        index queries). Criteria on columns that are not in the catalog
+        are ignored.
+        """
+        kinds = self.attributeColumns()
+        if columns is None:
+            columns = list(sorted(kinds.keys()))
+            if 'hour' in file_type: columns.append('elements')
+        else:
+            columns = [ name for name in columns
+                        if name in kinds or name in FILE_COLUMN_NAMES ]
+        if not columns: return [ ]
+
+        where = ['directory=?', 'file_type=?']
+        values = [os.path.normpath(os.path.abspath(directory_path)), file_type]
+        if criteria:
+            for predicate in compileCriteria(criteria).predicates:
+                if predicate.key not in kinds and \
+                   predicate.key not in FILE_COLUMN_NAMES: continue
+                clause, clause_values = self._predicateToSql(predicate)
+                where.append(clause)
+                values.extend(clause_values)
+
+        sql = 'SELECT %s FROM %s WHERE %s' % \
+              (','.join([quoteName(name) for name in columns]), FILES_TABLE,
+               ' AND '.join(['(%s)' % clause for clause in where]))
+        if sort_by is not None:
+            if isinstance(sort_by, basestring):
+                sort_by = [key.strip() for key in sort_by.split(',')]
+            sort_by = [ key for key in sort_by
+                        if key in kinds or key in FILE_COLUMN_NAMES ]
+            if sort_by:
+                sql += ' ORDER BY %s' % ','.join([quoteName(key)
+                                                  for key in sort_by])
+
+        stations = [ ]
+        for row in self.execute(sql, values).fetchall():
+            station = { }
+            for name, value in zip(columns, row):
+                station[name] = decodeAttribute(kinds.get(name,'text'), value)
+            stations.append(station)
+        return stations
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _addColumn(self, name, kind):
+        kinds = self.attributeColumns()
+        if name in kinds: return
+        sql = 'ALTER TABLE %s ADD COLUMN %s %s'
+        self.execute(sql % (FILES_TABLE, quoteName(name), SQL_KINDS[kind]))
+        self.execute('INSERT INTO %s VALUES (?,?)' % COLUMNS_TABLE,
+                     (name, kind))
+        if name in INDEXED_COLUMNS:
+            sql = 'CREATE INDEX IF NOT EXISTS %s ON %s(%s)'
+            self.execute(sql % (quoteName('%s_%s' % (FILES_TABLE, name)),
+                                FILES_TABLE, quoteName(name)))
+        kinds[name] = kind
+
+    def _createTables(self):
+        columns = [ ('filepath', 'TEXT PRIMARY KEY'), ] + list(FILE_COLUMNS[1:])
+        self.createTable(FILES_TABLE, columns)
+        self.createTable(COLUMNS_TABLE,
+                         (('name', 'TEXT PRIMARY KEY'), ('kind', 'TEXT')))
+        sql = 'CREATE INDEX IF NOT EXISTS %s ON %s(directory, file_type)'
+        self.execute(sql % ('%s_directory' % FILES_TABLE, FILES_TABLE))
+        self.commit()
+
+    def _upgradeTables(self):
+        """ Catalogs created before date attributes were stored as numeric
+        keys are rebuilt, the files are read again on the next refresh.
+        """
+        for name, kind in self.attributeColumns().items():
+            if kind == 'ints' and isDateAttribute(name): break
+        else: return
+        self.execute('DROP TABLE %s' % FILES_TABLE)
+        self.execute('DROP TABLE %s' % COLUMNS_TABLE)
+        self.commit()
+        self.column_kinds = None
+        self._createTables()
+
+    def _predicateToSql(self, predicate):
+        column = quoteName(predicate.key)
+        column_kind = self.attributeColumns().get(predicate.key, None)
+        if column_kind in DATE_KINDS:
+            asSql = lambda value: dateKey(value, column_kind)
+        else: asSql = lambda value: value
+        kind = predicate.kind
+        if kind == 'equals':
+            return '%s = ?' % column, [asSql(predicate.value),]
+        if kind == 'member':
+            marks = ','.join(['?'] * len(predicate.values))
+            return '%s IN (%s)' % (column, marks), map(asSql, predicate.values)
+        if kind == 'compare':
+            op = SQL_OPERATORS[predicate.op]
+            return '%s %s ?' % (column, op), [asSql(predicate.value),]
+        if kind == 'range':
+            return '%s BETWEEN ? AND ?' % column, [asSql(predicate.low),
+                                                   asSql(predicate.high)]
+        if kind == 'function':
+            # NaN values are stored as NULL
+            if predicate.function is FUNCTIONS['N.isnan']:
+                return '%s IS NULL' % column, [ ]
+            if predicate.function is FUNCTIONS['N.isinf']:
+                return '%s IN (?,?)' % column, [float('inf'), float('-inf')]
+            return '%s NOT IN (?,?)' % column, [float('inf'), float('-inf')]
+        errmsg = 'Unsupported predicate for catalog query : %s'
+        raise ValueError, errmsg % repr(predicate)
+
@@ -6,7 +6,9 @@ from datetime import datetime
 import numpy as N
 
 from rccpy.hdf5.manager import HDF5DataFileManager
+from rccpy.hdf5.pool import HDF5FileManagerPool
 from newa.manager import ObsnetDataFileManager
+from newa.consolidated import ConsolidatedDataFileManager
 from rccpy.timeseries.generators import dateArrayGenerator
 generateHoursArray = dateArrayGenerator('hour')
 
@@ -30,6 +32,8 @@ RAW_DATA_ELEMENTS = tuple([key for key in CONFIG.elements.keys()
 from newa.elements import PRECIP_ELEMENTS, TEMPERATURE_ELEMENTS
 from newa.datasets import VALUE_TYPES, DESCRIPTIONS, HOURLY_DATA_TYPES
 from newa.database.index import INDEX
+from newa.database.cache import stationIndexCache
+from newa.database.catalog import StationFileCatalog
 from rccpy.utils.timeseries import VALID_FREQUENCIES
 from rccpy.utils.timeutils import MONTHS
 
@@ -89,6 +93,7 @@ class ObsnetDataFactory(object):
             self.config.ManagerClass.hours = ObsnetDataFileManager
             self.config.ManagerClass.day = ObsnetDataFileManager
             self.config.ManagerClass.days = ObsnetDataFileManager
+            self.config.ManagerClass.network = ConsolidatedDataFileManager
 
         if 'station_filename_tmpl' not in config_keys:
             self.config['station_filename_tmpl'] = '%d_%s.h5'
@@ -101,10 +106,24 @@ class ObsnetDataFactory(object):
             self.config.debug = False
         self.debug = self.config.debug
 
+        # number of file managers kept open for reuse, 0 = no pooling
+        if 'file_pool_size' not in config_keys:
+            self.config.file_pool_size = 0
+        if self.config.file_pool_size > 0:
+            self.file_pool = HDF5FileManagerPool(self.config.file_pool_size)
+        else: self.file_pool = None
+
+        self.file_catalog = None
+
+        # keep memory mapped .npy copies of station value datasets
+        if 'use_sidecars' not in config_keys:
+            self.config.use_sidecars = False
+
     # * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 
     def argsToStationData(self, args, options, metadata='all', filepath=None,
-                                search_keys=SEARCH_KEYS, sort_by=None):
+                                search_keys=SEARCH_KEYS, sort_by=None,
+                                as_dicts=True):
         criteria = self._validCriteria(options, search_keys)
 
         num_args = len(args)
@@ -117,7 +136,8 @@ class ObsnetDataFactory(object):
                                      for arg in args]
             # request for range of stations from index file
             elif ':' in args[0]:
-                stations = self.getStations(metadata, criteria)
+                stations = self.getStations(metadata, criteria,
+                                            as_dicts=as_dicts)
                 # request for range of stations
                 stations = self._rangeOfStations(stations, args)
             # request for stations from source other than index file
@@ -135,7 +155,8 @@ class ObsnetDataFactory(object):
                     stations = self._rangeOfStations(stations, args[1:])
 
         else:
-            stations = self.getStations(metadata, criteria, filepath)
+            stations = self.getStations(metadata, criteria, filepath,
+                                        as_dicts=as_dicts)
 
         if sort_by is not None and len(stations) > 1:
             stations = self._sortStations(stations,sort_by)
@@ -198,20 +219,57 @@ class ObsnetDataFactory(object):
     def getFileManager(self, file_key_or_path, mode='r'):
         filepath = self.getFilepath(file_key_or_path)
         if filepath is None:
-            raise ValueError, errmsg % file_key_or_path
+            errmsg = 'Unable to resolve file path for %s'
+            raise ValueError, errmsg % str(file_key_or_path)
 
+        ManagerClass = self.getManagerClass(file_key_or_path)
         if os.path.exists(filepath):
-            if mode == 'w':
-                return self.getManagerClass(file_key_or_path)(filepath, 'a')
-            else: return self.getManagerClass(file_key_or_path)(filepath, mode)
+            if mode == 'w': mode = 'a'
+            if self.file_pool is not None:
+                manager = self.file_pool.getManager(filepath, mode,
+                                                    ManagerClass)
+            else: manager = ManagerClass(filepath, mode)
+            if self.config.use_sidecars and hasattr(manager,'enableSidecars'):
+                manager.enableSidecars()
+            return manager
         else:
             if mode == 'r': raise IOError, 'File not found : %s' % filepath
             dirpath, filename = os.path.split(filepath)
             if not os.path.exists(dirpath): os.makedirs(dirpath)
-            manager = self.getManagerClass(file_key_or_path)(filepath, 'w')
+            if self.file_pool is not None:
+                # a stale manager may still be pooled for a deleted file
+                self.file_pool.closeManager(filepath)
+            manager = ManagerClass(filepath, 'w')
             manager.setFileAttribute('created', manager._timestamp())
+            if self.config.use_sidecars and hasattr(manager,'enableSidecars'):
+                manager.enableSidecars()
+            if self.file_pool is not None:
+                self.file_pool.addManager(manager, 'a')
             return manager
 
+    def releaseFileManager(self, manager):
+        """ Call when done with a manager returned by getFileManager. Pooled
+        managers are flushed and kept open for reuse, all others are closed.
+        """
+        if self.file_pool is None or not self.file_pool.releaseManager(manager):
+            manager.closeFile()
+
+    def closeAllFileManagers(self):
+        if self.file_pool is not None: self.file_pool.closeAll()
+
+    def enableFilePool(self, max_open=16):
+        """ Start reusing open file managers. Any managers already in the
+        pool are closed first.
+        """
+        self.closeAllFileManagers()
+        self.config.file_pool_size = max_open
+        if max_open > 0: self.file_pool = HDF5FileManagerPool(max_open)
+        else: self.file_pool = None
+
+    def filePoolStatistics(self):
+        if self.file_pool is None: return None
+        return self.file_pool.statistics()
+
     def getFilepath(self, file_key_or_path):
         if isinstance(file_key_or_path, int):
             return self.getFilepathForUcanid(file_key_or_path)
@@ -222,6 +280,8 @@ class ObsnetDataFactory(object):
                 return file_key_or_path
             elif file_key_or_path == 'index':
                 return self.config.station_index
+            elif file_key_or_path == 'network':
+                return self.getNetworkFilepath()
         return None
 
     def getFilepathForUcanid(self, ucanid, file_type='hours'):
@@ -236,6 +296,12 @@ class ObsnetDataFactory(object):
         if not os.path.exists(dirpath): os.makedirs(dirpath)
         return filepath
 
+    def getNetworkFilepath(self):
+        """ Path to the consolidated hourly data file for all stations.
+        """
+        if 'network_file' in self.config: return self.config.network_file
+        return os.path.join(self.config.working_dir, 'network_hours.h5')
+
     def getManagerClass(self, file_key_or_path):
         if isinstance(file_key_or_path, (tuple,list)):
             filetype = file_key_or_path[1]
@@ -252,9 +318,10 @@ class ObsnetDataFactory(object):
     # * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 
     def getStations(self, metadata='ucanid', criteria=None, filepath=None,
-                          sort_by=None):
+                          sort_by=None, as_dicts=True):
         if filepath is None or filepath == 'index':
-            return self.getIndexedStations(metadata, criteria, sort_by)
+            return self.getIndexedStations(metadata, criteria, sort_by,
+                                           as_dicts)
         elif filepath == 'newa':
             return self.getNewaStations(metadata, criteria, sort_by)
         elif filepath == 'ucan':
@@ -269,24 +336,24 @@ class ObsnetDataFactory(object):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def getIndexedStations(self, metadata='all', criteria=None, sort_by=None):
-
-        manager = self.getFileManager('index', mode='r')
-        dataset_names = self._parseMetadata(metadata, manager)
-        _criteria = self._validCriteria(criteria, dataset_names)
-        datasets = manager.getDataWhere(dataset_names, _criteria)
-        manager.closeFile()
-
-        stations = [ ]
-        for stn_indx in range(len(datasets[0])):
-            station = { }
-            for indx in range(len(dataset_names)):
-                station[safeDataKey(dataset_names[indx])] =\
-                                         safevalue(datasets[indx][stn_indx])
-            stations.append(station)
-
-        if sort_by is not None:
-            stations = self._sortStations(stations, sort_by)
+    def getIndexedStations(self, metadata='all', criteria=None, sort_by=None,
+                                 as_dicts=True):
+        """ Returns stations from the index file that satisfy criteria. The
+        columns of the index file are cached for the life of the process.
+        When as_dicts is False, light-weight row views are returned instead
+        of a list of dictionaries.
+        """
+        cache = stationIndexCache(self.getFilepath('index'))
+        if isinstance(metadata, basestring) and metadata == 'all':
+            dataset_names = cache.listDatasets()
+        else: dataset_names = self._parseMetadata(metadata)
+        _criteria = self._validCriteria(criteria, cache.listDatasets())
+
+        stations = cache.stations(dataset_names, _criteria, sort_by)
+        if _criteria and len(stations) == 0:
+            errmsg = 'No entries meet search criteria : %s'
+            raise ValueError, errmsg % str(_criteria)
+        if as_dicts: return stations.asDicts()
         return stations
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -362,44 +429,41 @@ class ObsnetDataFactory(object):
     def getStationsInDirectory(self, directory_key_or_path, metadata='all',
                                      criteria=None, file_type=None,
                                      sort_by=None):
-        dataset_names = self._parseMetadata(metadata)
-        _criteria = self._validCriteria(criteria, station.keys())
-        constraints = dictToConstraints(_criteria, ') and (')
-
+        """ Returns metadata for the stations that have data files in a
+        directory. File attributes are read from the station file catalog,
+        which is refreshed first so that only new or modified files are
+        opened.
+        """
         if os.path.exists(directory_key_or_path):
             directory_path = directory_key_or_path
-        else: directory_path = self.getDirectoryPath(directory_key_or_path)
-        if file_type is None:
-            file_suffix = '_%s.h5' % directory_key_or_path
+            if file_type is None:
+                file_type = os.path.basename(os.path.normpath(directory_path))
         else:
-            file_suffix = '_%s.h5' % file_type
-        has_elements = 'hour' in file_suffix
-
-        filepaths = [ ]
-        for name in os.listdir(directory_path):
-            if name.endswith(file_suffix):
-                filepaths.append(os.path.join(directory_path, name))
-        if len(filepaths) < 1: return ()
-
-        stations = [ ]
-        ManagerClass = self.getManagerClass(directory_key_or_path)
-        for filepath in filepaths:
-            manager = ManagerClass(filepaths[0], 'r')
-            attrs = manager.getFileAttributes()
-            manager.closeFile()
-
-            if constraints is None or eval(constraints,globals(),attrs):
-                station =  { }
-                for key, value in attrs:
-                    if key in dataset_names: station[key] = value
-
-                if has_elements and 'elements' in dataset_names:
-                    station['elements'] = ','.join(manager.listGroups())
-
-                stations.append(station)
-
-        if sort_by is not None: stations = self._sortStations(stations,sort_by)
-        return stations
+            directory_path = self.getDirectoryPath(directory_key_or_path)
+            if file_type is None: file_type = directory_key_or_path
+
+        if file_type in self.config.ManagerClass.keys():
+            ManagerClass = self.config.ManagerClass[file_type]
+        else: ManagerClass = HDF5DataFileManager
+
+        catalog = self.getStationFileCatalog()
+        catalog.refreshDirectory(directory_path, file_type, ManagerClass)
+
+        if metadata == 'all': columns = None
+        else: columns = self._parseMetadata(metadata)
+        criteria = self._validCriteria(criteria, catalog.listColumnNames())
+        return catalog.getStations(directory_path, file_type, columns,
+                                   criteria, sort_by)
+
+    def getStationFileCatalog(self):
+        if self.file_catalog is None:
+            if 'file_catalog' in self.config:
+                filepath = self.config.file_catalog
+            else:
+                filepath = os.path.join(self.config.working_dir,
+                                        'station_files.db')
+            self.file_catalog = StationFileCatalog(filepath)
+        return self.file_catalog
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
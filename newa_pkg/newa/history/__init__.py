@@ -4,7 +4,7 @@ import os, sys
 import numpy as N
 
 from rccpy.analysis.stats import emptyStatsDataset, newStatsRecord
-from rccpy.timeseries.data import TimeSeries
+from rccpy.timeseries.data import groupRecord, TimeSeries
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -17,6 +17,28 @@ from newa.factory import MONTHS
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+def saveDetectorState(stats_manager, dataset_name, detector):
+    """ Saves the streaming state of a detector in the statistics file, so
+    that detection can continue with data that is added later.
+    """
+    pending, attrs = detector.getState()
+    if stats_manager.datasetExists(dataset_name):
+        stats_manager.replaceDataset(dataset_name, pending, attrs)
+    else: stats_manager.createDataset(dataset_name, pending, attrs)
+
+def restoreDetectorState(stats_manager, dataset_name, detector):
+    """ Restores a detector state saved by saveDetectorState. The next
+    chunk passed to the detector's update() must begin with the entry after
+    the last one that was detected. Returns False when there is no saved
+    state.
+    """
+    if not stats_manager.datasetExists(dataset_name): return False
+    pending, attrs = stats_manager.getData(dataset_name, True)
+    detector.setState(pending, attrs)
+    return True
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
 def reportStatistics(log_file, stats, label1, label2, stats_fmt, distrib_fmt,
                      coverage_fmt, indent='    '):
     stats_indent = indent + '    '
@@ -85,9 +107,6 @@ def historicalExtremes(factory, ucanid, elements, debug=False):
         if 'content_type' not in  data_attrs:
             data_attrs['content_type'] = element_config['value_type']
         time_series = TimeSeries(element, base_time, data, **data_attrs)
-        month_array = N.array([ date[1] for date in 
-                                time_series.getDates(date_format='tuple') ],
-                              dtype=int)
 
         elem_descr = element_config['description']
         # create the element group if it's not already there
@@ -115,9 +134,15 @@ def historicalExtremes(factory, ucanid, elements, debug=False):
                          EXTR_DISTRIB_FMT, EXTR_COVERAGE_FMT)
 
         # find extremes for each month and insert into statistics dataset
+        monthly = time_series.groupBy('month')
+        month_groups = dict(zip(monthly['month'].tolist(),
+                                range(len(monthly['month']))))
         for month in range(1,13):
-            indexes = N.where(month_array==month)
-            stats = time_series._calcArrayStatistics(data[indexes])
+            if month in month_groups:
+                stats = groupRecord(monthly, month_groups[month])
+                del stats['month']
+            else: # no data for the month
+                stats = time_series._calcArrayStatistics(data[:0])
             stats['period'] = Month = MONTHS[month-1]
             stats_dataset[month] = newStatsRecord(time_stamp, stats,
                                                    ('period',3))
@@ -138,8 +163,8 @@ def historicalExtremes(factory, ucanid, elements, debug=False):
                     }
             stats_manager.createDataset(dataset_name, stats_dataset, attrs)
 
-    hours_manager.closeFile()
-    stats_manager.closeFile()
+    factory.releaseFileManager(hours_manager)
+    factory.releaseFileManager(stats_manager)
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -173,7 +198,8 @@ def historicalSequences(factory, ucanid, elements, report_missing, log_file,
         element_config = CONFIG.elements[element].asDict()
 
         dataset_name = '%s.value' % element
-        data, data_attrs = hours_manager.getSerialData(dataset_name, True)
+        # detectors step through the data, so it is read as it is used
+        data, data_attrs = hours_manager.getLazySerialData(dataset_name)
         frequency = data_attrs['frequency']
         first_time = 'first_%s' % frequency
         last_time = 'last_%s' % frequency
@@ -189,7 +215,8 @@ def historicalSequences(factory, ucanid, elements, report_missing, log_file,
 
         # calculate statistics for filtered sequence groups
         seq_filters = CONFIG.sequences.filters[element]
-        sequences = detector(filters=seq_filters)
+        sequences = detector(filters=seq_filters,
+                             chunk_size=data.block_length)
         num_valid = 0
         num_missing = 0
         seq_stats = detector.calcStatistics()
@@ -224,6 +251,9 @@ def historicalSequences(factory, ucanid, elements, report_missing, log_file,
         createOrUpdateGroup(stats_manager, seq_group_name,
                             'sequence statistics for %s' % elem_descr,
                             '%s sequence statistics' % element)
+        # save the detector state so daily runs can extend the sequences
+        saveDetectorState(stats_manager, '%s.detector_state' % seq_group_name,
+                          detector)
 
         # create a stats data group for each sequnce group
         for seq_stats_key, stats in seq_stats.items():
@@ -277,14 +307,13 @@ def historicalSequences(factory, ucanid, elements, report_missing, log_file,
 
             # create a listing of all sequences above minimum run length
             if sequences:
-                sequences = [ run for run in sequences
-                              if run[1] > min_run_length ]
+                sequences = sequences[sequences['count'] > min_run_length]
             if sequences:
                 if log_file: detector._saveSequences(log_file, sequences)
                 else: detector._reportSequences(sequences)
 
-    hours_manager.closeFile()
-    stats_manager.closeFile()
+    factory.releaseFileManager(hours_manager)
+    factory.releaseFileManager(stats_manager)
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -313,7 +342,8 @@ def historicalSpikes(factory, ucanid, elements, log_file, debug):
         element_config = CONFIG.elements[element].asDict()
 
         dataset_name = '%s.value' % element
-        data, data_attrs = hours_manager.getSerialData(dataset_name, True)
+        # detectors step through the data, so it is read as it is used
+        data, data_attrs = hours_manager.getLazySerialData(dataset_name)
         frequency = data_attrs['frequency']
         first_time = 'first_%s' % frequency
         last_time = 'last_%s' % frequency
@@ -330,7 +360,8 @@ def historicalSpikes(factory, ucanid, elements, log_file, debug):
 
         # calculate statistics for filtered spike groups
         spike_filter_groups = CONFIG.spikes.filters[element]
-        spikes = detector(filters=spike_filter_groups)
+        spikes = detector(filters=spike_filter_groups,
+                          chunk_size=data.block_length)
         num_valid = 0
         num_missing = 0
         spike_stats = detector.calcStatistics()
@@ -358,6 +389,9 @@ def historicalSpikes(factory, ucanid, elements, log_file, debug):
         createOrUpdateGroup(stats_manager, spike_group_name,
                             'spike statistics for %s' % elem_descr,
                             '%s spike statistics' % element)
+        # save the detector state so daily runs can extend the spikes
+        saveDetectorState(stats_manager,
+                          '%s.detector_state' % spike_group_name, detector)
 
         # create a stats data group for each sequnce group
         for stats_key, stats in spike_stats.items():
@@ -413,6 +447,6 @@ def historicalSpikes(factory, ucanid, elements, log_file, debug):
                 if log_file: detector._saveSpikes(log_file, spikes)
                 else: detector._reportSpikes(spikes)
 
-    hours_manager.closeFile()
-    stats_manager.closeFile()
+    factory.releaseFileManager(hours_manager)
+    factory.releaseFileManager(stats_manager)
 
@@ -2,11 +2,15 @@
 """
 
 import os
+from glob import glob
 from datetime import datetime
 
-from rccpy.hdf5.manager import fullObjectPath
+import numpy as N
+
+from rccpy.hdf5.manager import dottedKey, fullObjectPath
 from rccpy.hdf5.manager import HDF5DataFileManager
 from rccpy.utils.data import safedict
+from rccpy.timeseries.lazy import LazyDataArray
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -28,38 +32,187 @@ def getSerialCriteria(dataset_name):
         return CONFIG.elements[dataset_name].serial_type
     else: return None
 
+def getDailyReducers(dataset_name):
+    """ Returns the names of the reducers used to resample an element to
+    days, ('mean',) unless the element configuration has daily_reducers.
+    """
+    parts = dataset_name.split('.')
+    if len(parts) > 1 and parts[-1] in ('date','value'): name = parts[-2]
+    else: name = parts[-1]
+    if name in CONFIG_ELEMENTS:
+        return tuple(CONFIG.elements[name].get('daily_reducers', ('mean',)))
+    return ('mean',)
+
+def isSidecarDataset(dataset_name):
+    return dottedKey(dataset_name).endswith('.value')
+
+def sidecarPath(filepath, dataset_name):
+    """ Path of the .npy file that mirrors a dataset, e.g. the sidecar for
+    'temp.value' in hours/1234_hours.h5 is hours/1234_hours.temp.value.npy
+    """
+    return '%s.%s.npy' % (os.path.splitext(filepath)[0],dottedKey(dataset_name))
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 class ObsnetDataFileManager(HDF5DataFileManager):
+    """ When sidecars are enabled, an uncompressed .npy copy of each
+    element's value dataset is kept next to the data file and reads of the
+    values return a read-only numpy.memmap of the copy. Processes that read
+    the same file share the memory mapped pages. A sidecar is only used
+    when it is newer than the data file, and sidecars for datasets that are
+    changed are rewritten when the file is flushed or closed.
+    """
 
-    def __init__(self, filepath=None, mode='r'):
-        HDF5DataFileManager(self, filepath, mode)
+    def __init__(self, filepath=None, mode='r', sidecars=False):
+        self.sidecars = sidecars
+        self.stale_sidecars = set()
+        self.opened_mtime = None
+        HDF5DataFileManager.__init__(self, filepath, mode)
         self.filepath = filepath
 
-    def getSerialData(self, dataset_names, include_attributes=False, **kwargs):
+    def enableSidecars(self, enable=True):
+        self.sidecars = enable
+
+    def sidecarPath(self, dataset_name):
+        return sidecarPath(self.hdf5_filepath, dataset_name)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def getMappedData(self, dataset_name, include_attributes=False):
+        """ Returns the data in a value dataset as a read-only memmap of
+        its sidecar. The sidecar is created if it does not exist or is out
+        of date. Returns the contents of the dataset when sidecars are not
+        enabled or the dataset cannot have a sidecar.
+        """
+        self.assertFileOpen()
+        dataset = HDF5DataFileManager.getDataset(self, dataset_name)
+        data = None
+        if self.sidecars and isSidecarDataset(dataset_name):
+            data = self._loadSidecar(dataset_name, dataset)
+            if data is None and self._writeSidecar(dataset_name, dataset):
+                data = self._loadSidecar(dataset_name, dataset)
+        if data is None: data = dataset[...]
+        if include_attributes: return data, dict(dataset.attrs)
+        return data
 
-        data = self.getData(dataset_names, True, **kwargs)
+    def getSerialData(self, dataset_names, include_attributes=False, **kwargs):
+        """ Returns data serialized using the element configuration. Pass
+        start_time and end_time to read only part of a time series.
+        """
+        out = kwargs.pop('out', None)
+        data = self._getSerialSource(dataset_names, **kwargs)
         if isinstance(dataset_names, (tuple,list)):
-            data == list(data)
+            if out is None: out = (None,) * len(dataset_names)
+            data = list(data)
             for indx in range(len(dataset_names)):
+                _array_, attrs = data[indx]
                 serial_attrs = getSerialCriteria(dataset_names[indx])
                 if serial_attrs is not None:
-                    _array_, attrs = data[indx]
-                    _array_, attrs = self._serialize(_array_, attrs, serial_attrs)
-                    if include_attributes: data[indx] = (_array_, attrs)
-                    else: data[indx] = _array_
+                    _array_, attrs = self._serialize(_array_, attrs,
+                                                     serial_attrs, out[indx])
+                if include_attributes: data[indx] = (_array_, attrs)
+                else: data[indx] = _array_
             return tuple(data)
         else:
+            data, attrs = data
             serial_attrs = getSerialCriteria(dataset_names)
             if serial_attrs is not None:
-                data, attrs = self._serialize(data[0], data[1], serial_attrs)
+                data, attrs = self._serialize(data, attrs, serial_attrs, out)
             if include_attributes: return data, attrs
             else: return data
 
+    def getLazySerialData(self, dataset_name, cache_blocks=4):
+        """ Returns (data, attrs) like getSerialData(dataset_name, True),
+        but data is a LazyDataArray that reads and serializes blocks of the
+        dataset only when they are used. The file must stay open while the
+        data is in use.
+        """
+        dataset = self.getDataset(dataset_name)
+        attrs = dict(dataset.attrs)
+        serial_attrs = getSerialCriteria(dataset_name)
+        if serial_attrs is None:
+            return LazyDataArray(dataset, None, cache_blocks,
+                                 attrs=dict(attrs)), attrs
+
+        raw_attrs = dict(attrs)
+        def serialize(data):
+            return self._serialize(data, dict(raw_attrs), serial_attrs)[0]
+        # serialize an empty slice to get the serial dtype and attributes
+        empty, attrs = self._serialize(dataset[0:0], attrs, serial_attrs)
+        return LazyDataArray(dataset, serialize, cache_blocks,
+                             dtype=empty.dtype, attrs=dict(attrs)), attrs
+
+    def _getSerialSource(self, dataset_names, **kwargs):
+        if not self.sidecars:
+            return HDF5DataFileManager._getSerialSource(self, dataset_names,
+                                                        **kwargs)
+        if isinstance(dataset_names, (tuple,list)):
+            return tuple([self._getMappedSource(name, **kwargs)
+                          for name in dataset_names])
+        return self._getMappedSource(dataset_names, **kwargs)
+
+    def _getMappedSource(self, dataset_name, **kwargs):
+        start_time = kwargs.get('start_time', None)
+        end_time = kwargs.get('end_time', None)
+        data, attrs = self.getMappedData(dataset_name, True)
+        if start_time is None and end_time is None: return data, attrs
+        return self._sliceWindow(data, attrs, start_time, end_time, True,
+                                 kwargs.get('pad', False))
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def closeFile(self):
+        if self.hdf5_file is not None and self.hdf5_file_mode in ('w','a'):
+            self.flushFile()
+            filepath = self.hdf5_filepath
+            HDF5DataFileManager.closeFile(self)
+            # closing the file changes its modification time
+            self._touchSidecars(filepath)
+        else: HDF5DataFileManager.closeFile(self)
+        self.stale_sidecars = set()
+
+    def flushFile(self):
+        HDF5DataFileManager.flushFile(self)
+        if self.stale_sidecars: self._syncSidecars()
+
+    def openFile(self, hdf5_filepath=None, mode='r'):
+        HDF5DataFileManager.openFile(self, hdf5_filepath, mode)
+        self.opened_mtime = os.path.getmtime(self.hdf5_filepath)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def appendData(self, dataset_name, numpy_array):
+        self._markSidecarStale(dataset_name)
+        return HDF5DataFileManager.appendData(self, dataset_name, numpy_array)
+
+    def deleteObject(self, object_name):
+        HDF5DataFileManager.deleteObject(self, object_name)
+        self._markSidecarStale(object_name, True)
+
+    def insertData(self, dataset_name, indexes, data):
+        self._markSidecarStale(dataset_name)
+        HDF5DataFileManager.insertData(self, dataset_name, indexes, data)
+
+    def replaceDataset(self, dataset_name, data, attributes):
+        self._markSidecarStale(dataset_name)
+        HDF5DataFileManager.replaceDataset(self, dataset_name, data,
+                                           attributes)
+
+    def resizeDataset(self, dataset_name, max_index):
+        self._markSidecarStale(dataset_name)
+        return HDF5DataFileManager.resizeDataset(self, dataset_name, max_index)
+
+    def updateDataset(self, dataset_name, numpy_array, attributes={}, **kwargs):
+        self._markSidecarStale(dataset_name)
+        return HDF5DataFileManager.updateDataset(self, dataset_name,
+                                                 numpy_array, attributes,
+                                                 **kwargs)
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def createDataset(self, dataset_name, numpy_array, attributes={}, **kwargs):
         self.assertFileWritable()
+        self._markSidecarStale(dataset_name)
 
         attrs = self._verfiyCreateAttributes(dataset_name, attributes,
                                              numpy_array)
@@ -73,9 +226,10 @@ class ObsnetDataFileManager(HDF5DataFileManager):
                                       dtype, fill_value, attributes={},
                                       chunk_size=None, compression='lzf'):
         self.assertFileWritable()
+        self._markSidecarStale(dataset_name)
 
         attrs = self._verfiyCreateAttributes(dataset_name, attributes,
-                                             numpy_array)
+                                             N.empty((0,), dtype=dtype))
         name, parent = self._keyToNameAndParent(self.hdf5_file, dataset_name)
         dataset = self._createDataset_(parent, name, initial_shape, attrs,
                                        dtype=dtype, maxshape=max_shape, 
@@ -132,3 +286,70 @@ class ObsnetDataFileManager(HDF5DataFileManager):
 
         return attrs
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _loadSidecar(self, dataset_name, dataset):
+        if dottedKey(dataset_name) in self.stale_sidecars: return None
+        filepath = self.sidecarPath(dataset_name)
+        if not os.path.exists(filepath): return None
+        if os.path.getmtime(filepath) < \
+           os.path.getmtime(self.hdf5_filepath): return None
+        try:
+            data = N.load(filepath, mmap_mode='r')
+        except (IOError, ValueError):
+            return None
+        if data.shape != dataset.shape or data.dtype != dataset.dtype:
+            return None
+        return data
+
+    def _markSidecarStale(self, object_name, deleted=False):
+        key = dottedKey(object_name)
+        if deleted or isSidecarDataset(key): self.stale_sidecars.add(key)
+
+    def _removeSidecars(self, object_name):
+        root = os.path.splitext(self.hdf5_filepath)[0]
+        key = dottedKey(object_name)
+        filepaths = glob('%s.%s.*npy' % (root, key))
+        filepaths.append('%s.%s.npy' % (root, key))
+        for filepath in filepaths:
+            if os.path.exists(filepath): os.remove(filepath)
+
+    def _syncSidecars(self):
+        stale_sidecars = self.stale_sidecars
+        self.stale_sidecars = set()
+        dataset_names = self.listDatasets()
+        for key in stale_sidecars:
+            if self.sidecars and key in dataset_names:
+                dataset = HDF5DataFileManager.getDataset(self, key)
+                if self._writeSidecar(key, dataset): continue
+            self._removeSidecars(key)
+
+    def _touchSidecars(self, filepath):
+        """ Keep sidecars that were up to date when the file was opened
+        (or were written since) newer than the data file.
+        """
+        root = os.path.splitext(filepath)[0]
+        for sidecar in glob('%s.*.npy' % root):
+            if os.path.getmtime(sidecar) >= self.opened_mtime:
+                os.utime(sidecar, None)
+
+    def _writeSidecar(self, dataset_name, dataset):
+        """ Writes a new sidecar for the dataset. The new file replaces any
+        existing sidecar in a single step, so readers never see a partial
+        file. Returns False if the sidecar could not be written.
+        """
+        if dataset.size == 0 or not isSidecarDataset(dataset_name):
+            return False
+        filepath = self.sidecarPath(dataset_name)
+        temp_filepath = '%s.%d.tmp' % (filepath, os.getpid())
+        try:
+            temp_file = open(temp_filepath, 'wb')
+            try:
+                N.save(temp_file, dataset[...])
+            finally:
+                temp_file.close()
+            os.rename(temp_filepath, filepath)
+        except (IOError, OSError):
+            if os.path.exists(temp_filepath): os.remove(temp_filepath)
+            return False
+        return True
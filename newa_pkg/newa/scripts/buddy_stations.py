@@ -100,8 +100,8 @@ for indx in need_buddies:
             del manager
 
             time_series = MultipleTimeSeries(site_info, buddy_info)
-            temps = time_series.getData()
-            diffs = N.absolute(temps['site'] - temps['buddy'])
+            diffs = abs(time_series.expression('site') -
+                        time_series.expression('buddy')).evaluate()
             avg_diff = N.nanmean(diffs)
             del time_series, buddy_temp, site_temp
 
@@ -0,0 +1,96 @@
+#! /Users/rem63/venvs/nrcc_prod/bin/python
+
+import os, sys
+
+from rccpy.utils.options import stringToTuple
+from rccpy.utils.timeutils import dateAsTuple
+
+from newa.factory import ObsnetDataFactory
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+from newa.config import config as CONFIG
+ELEMENTS = CONFIG.elements
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+from optparse import OptionParser
+parser = OptionParser()
+
+parser.add_option('-e', action='store', type='string', dest='elements',
+                  default='all')
+parser.add_option('-p', action='store', type='int', dest='file_pool_size',
+                  default=0)
+parser.add_option('-s', action='store', type='string', dest='first_hour',
+                  default=None)
+parser.add_option('-w', action='store', type='string', dest='working_dir',
+                  default=None)
+parser.add_option('-z', action='store_true', dest='debug', default=False)
+
+options, args = parser.parse_args()
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+procmsg = '\nprocessing station %d of %d : %d : %s (%s)'
+skipmsg = '\nNo hourly data file for station %d of %d : %d : %s (%s)'
+elemmsg = '    %s : %d hours added'
+unitmsg = '    %s : units (%s) do not match network file (%s), skipped'
+
+debug = options.debug
+
+if options.elements == 'all': all_elements = list(ELEMENTS.keys())
+else: all_elements = list(stringToTuple(options.elements))
+all_elements.sort()
+
+factory = ObsnetDataFactory(options)
+stations = factory.argsToStationData(args, options)
+total_stations = len(stations)
+
+network = factory.getFileManager('network', 'a')
+if 'ucanid' not in network.listDatasets():
+    if options.first_hour is None:
+        print 'First hour (-s) is required to create the network file.'
+        sys.exit(1)
+    network.initialize(dateAsTuple(options.first_hour, True))
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+station_num = 0
+
+for station in stations:
+    station_num += 1
+    ucanid = station['ucanid']
+
+    filepath = factory.getFilepathForUcanid(ucanid, 'hours')
+    if not os.path.exists(filepath):
+        print skipmsg % (station_num, total_stations, ucanid, station['sid'],
+                         station['name'])
+        continue
+
+    print procmsg % (station_num, total_stations, ucanid, station['sid'],
+                     station['name'])
+
+    manager = factory.getFileManager((ucanid,'hours'), 'r')
+    network_elements = network.listElements()
+    for element in all_elements:
+        if element not in manager.listGroups(): continue
+        # only read the hours after the last one already in the store
+        next_hour = network.nextStationHour(ucanid, element)
+        data, attrs = manager.getDataWindow('%s.value' % element, next_hour,
+                                            None, True)
+        if element in network_elements:
+            units = network.getGroupAttribute(element, 'units')
+            if attrs['units'] != units:
+                print unitmsg % (element, attrs['units'], units)
+                continue
+        num_hours = network.updateStation(ucanid, element, data,
+                                          attrs['first_hour'], attrs)
+        if debug: print elemmsg % (element, num_hours)
+    factory.releaseFileManager(manager)
+
+    network.flushFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+factory.releaseFileManager(network)
+factory.closeAllFileManagers()
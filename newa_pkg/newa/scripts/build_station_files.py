@@ -8,8 +8,10 @@ import numpy as N
 
 from rccpy.atmos.dewpt import generateDewpointArray
 from rccpy.atmos.dewpt import calculateDewpointDepression
+from rccpy.atmos.dewpt import dewpointFromHumidityAndTemp
 from rccpy.hdf5.manager import HDF5DataFileManager
 from rccpy.stations.ucan import UcanConnection, UcanInvalidElementError
+from rccpy.timeseries.generators import dateArrayGenerator
 
 from rccpy.utils.exceptutils import reportLastException
 from rccpy.utils.options import stringToTuple
@@ -26,20 +28,20 @@ ELEMENTS = CONFIG.elements
 NETWORKS = CONFIG.networks
 
 DATE_FORMULA = 'year*1000000 + month*10000 + day*100 + hour'
+ONE_HOUR = relativedelta(hours=1)
+
+# element datasets are created resizable so that they can be extended
+EXTENSIBLE = { 'maxshape' : (None,), 'chunks' : True, 'compression' : 'lzf' }
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 def generateHoursArray(first_hour, last_hour):
-    hour = asDatetime(first_hour)
-    last_hour = asDatetime(last_hour)
-    interval = relativedelta(hours=1)
-    hours = [ ]
-    while hour <= last_hour:
-        int_date = (hour.year*1000000) + (hour.month * 10000)
-        int_date += (hour.day * 100) + hour.hour
-        hours.append(int_date)
-        hour += interval
-    return N.array(hours, dtype='i4')
+    hours = dateArrayGenerator('hour')(first_hour, last_hour, date_format=int)
+    return hours.astype('i4')
+
+def hoursBetween(first_hour, last_hour):
+    delta = asDatetime(last_hour) - asDatetime(first_hour)
+    return (delta.days * 24) + (delta.seconds / 3600)
 
 def transformData(station, element, data):
     if element in ('dewpt','dewpt_depr'):
@@ -70,7 +72,7 @@ def addElementDatasets(manager, station, element, data, first_hour, last_hour,
     dataset_name = '%s.date' % element
     print '    creating %s dataset' % dataset_name
     manager.createDataset(dataset_name, generateHoursArray(first_hour,last_hour),
-                          attrs)
+                          attrs, **EXTENSIBLE)
     manager.setDatasetAttribute(dataset_name, 'description',
                                 'Year,Month,Day,Hour')
     manager.setDatasetAttribute(dataset_name, 'date_formula', DATE_FORMULA)
@@ -82,7 +84,194 @@ def addElementDatasets(manager, station, element, data, first_hour, last_hour,
     attrs['value_type'] = ELEMENTS[element].value_type
     print '    creating %s dataset' % dataset_name
     data = transformData(station, element, data)
-    manager.createDataset(dataset_name, data, attrs)
+    manager.createDataset(dataset_name, data, attrs, **EXTENSIBLE)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def isValidExtreme(value):
+    if value is None or value == -32768: return False
+    return N.isfinite(value)
+
+def extendDataset(manager, dataset_name, data):
+    # datasets in files built before they were made resizable have to be
+    # rewritten before they can be extended
+    if not manager.isExtensible(dataset_name):
+        print '    rewriting %s as resizable dataset' % dataset_name
+        old_data, attrs = manager.getData(dataset_name, True)
+        manager.deleteDataset(dataset_name)
+        manager.createDataset(dataset_name, old_data, attrs, **EXTENSIBLE)
+    return manager.appendData(dataset_name, data)
+
+def appendElementData(manager, station, element, data, first_hour, **kwargs):
+    group_attrs = manager.getGroupAttributes(element)
+    prev_last_hour = asDatetime(tuple(group_attrs['last_hour']))
+    first_hour = asDatetime(first_hour)
+
+    # drop any hours that are already in the file
+    overlap = hoursBetween(first_hour, prev_last_hour) + 1
+    if overlap > 0:
+        data = data[overlap:]
+        first_hour = prev_last_hour + ONE_HOUR
+    if len(data) == 0: return None
+
+    values = transformData(station, element, data)
+    # fill any gap between the end of the file and the new data
+    gap = hoursBetween(prev_last_hour, first_hour) - 1
+    if gap > 0:
+        missing = N.empty((gap,), dtype=values.dtype)
+        missing.fill(-32768)
+        values = N.concatenate((missing, values))
+
+    start_hour = prev_last_hour + ONE_HOUR
+    last_hour = start_hour + relativedelta(hours=len(values)-1)
+    print '\n  appending %d hours to %s (%s thru %s)' % (len(values), element,
+          start_hour.strftime('%Y-%m-%d:%H'), last_hour.strftime('%Y-%m-%d:%H'))
+
+    date_dataset = '%s.date' % element
+    value_dataset = '%s.value' % element
+    extendDataset(manager, date_dataset,
+                  generateHoursArray(start_hour, last_hour))
+    extendDataset(manager, value_dataset, values)
+
+    # update the time span and value extremes
+    last_hour = dateAsTuple(last_hour, True)
+    updated = manager._timestamp()
+    for name in (element, date_dataset, value_dataset):
+        manager.setObjectAttribute(name, 'last_hour', last_hour)
+        manager.setObjectAttribute(name, 'updated', updated)
+
+    value_attrs = manager.getDatasetAttributes(value_dataset)
+    new_min = kwargs.get('min', None)
+    if isValidExtreme(new_min):
+        old_min = value_attrs.get('min', None)
+        if isValidExtreme(old_min): new_min = min(old_min, new_min)
+        manager.setDatasetAttribute(value_dataset, 'min', new_min)
+    new_max = kwargs.get('max', None)
+    if isValidExtreme(new_max):
+        old_max = value_attrs.get('max', None)
+        if isValidExtreme(old_max): new_max = max(old_max, new_max)
+        manager.setDatasetAttribute(value_dataset, 'max', new_max)
+
+    return last_hour
+
+def dataExtremes(data, missing_value=N.nan):
+    if N.isfinite(missing_value):
+        valid = data[N.where(data != missing_value)]
+    else:
+        valid = data[N.where(N.isfinite(data))]
+    if len(valid) > 0: return N.min(valid), N.max(valid)
+    return missing_value, missing_value
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def fileDataAsTsvUnits(manager, station, element, start_hour, end_hour):
+    data, attrs = manager.getDataWindow('%s.value' % element, start_hour,
+                                        end_hour, True, pad=True)
+    data = N.array(data, dtype=float)
+    data[N.where(data == attrs['missing'])] = N.nan
+    tsv_units = getTsVarType(station, element)[-1]
+    return convertUnits(data, attrs['units'], tsv_units), tsv_units
+
+def appendDewpointData(manager, station):
+    """ Calculates dewpoint and dewpoint depression from the temp and rhum
+    data in the file, but only for hours that are not already in the
+    dewpt and dewpt_depr datasets.
+    """
+    groups = manager.listGroups()
+    if 'temp' not in groups or 'rhum' not in groups: return None
+
+    temp_attrs = manager.getGroupAttributes('temp')
+    rhum_attrs = manager.getGroupAttributes('rhum')
+    end_hour = min(asDatetime(tuple(temp_attrs['last_hour'])),
+                   asDatetime(tuple(rhum_attrs['last_hour'])))
+    if 'dewpt' in groups:
+        dewpt_attrs = manager.getGroupAttributes('dewpt')
+        start_hour = asDatetime(tuple(dewpt_attrs['last_hour'])) + ONE_HOUR
+    else:
+        start_hour = max(asDatetime(tuple(temp_attrs['first_hour'])),
+                         asDatetime(tuple(rhum_attrs['first_hour'])))
+    if start_hour > end_hour: return None
+
+    temp_data, temp_units = \
+    fileDataAsTsvUnits(manager, station, 'temp', start_hour, end_hour)
+    rhum_data, rhum_units = \
+    fileDataAsTsvUnits(manager, station, 'rhum', start_hour, end_hour)
+
+    dewpt_data = dewpointFromHumidityAndTemp(rhum_data, temp_data, temp_units)
+    depr_data = temp_data - dewpt_data
+    units = manager.getDatasetAttribute('temp.value', 'units')
+
+    for element, data in (('dewpt',dewpt_data), ('dewpt_depr',depr_data)):
+        _min, _max = dataExtremes(data)
+        if element in groups:
+            appendElementData(manager, station, element, data, start_hour,
+                              min=_min, max=_max)
+        else:
+            attrs = { 'units':units, 'min':_min, 'max':_max, 'missing':-32768 }
+            if element == 'dewpt':
+                caveat = "%s (calculated using Temperature and Relative Humidity)"
+                attrs['description'] = caveat % ELEMENTS[element].description
+            addElementDatasets(manager, station, element, data, start_hour,
+                               end_hour, **attrs)
+    return dateAsTuple(end_hour, True)
+
+def updateStationFile(factory, ucan, station, filepath, all_elements,
+                      end_date, debug):
+    """ Appends hours that are later than the last hour of each element
+    already in an existing station file.
+    """
+    manager = factory.getFileManager(filepath, 'a')
+    groups = manager.listGroups()
+
+    available_elements = NETWORKS[station['network']].elements
+    elements = [ elem for elem in all_elements if elem in available_elements
+                 and elem not in ('dewpt','dewpt_depr') ]
+
+    latest_hour = tuple(manager.getFileAttribute('last_hour'))
+    for element in elements:
+        dtype, missing_value, units, tsv_name, tsv_units =\
+        getTsVarType(station, element)
+
+        if element in groups:
+            prev_last_hour = tuple(manager.getGroupAttribute(element,
+                                                             'last_hour'))
+            start_hour = asDatetime(prev_last_hour) + ONE_HOUR
+            if end_date is not None and start_hour > asDatetime(end_date):
+                continue
+            start_hour = dateAsTuple(start_hour, True)
+        else: start_hour = None
+
+        try:
+            first_hour, last_hour, data =\
+            ucan.getHourlyData(station, tsv_name, dtype, tsv_units,
+                               missing_value, start_hour, end_date, debug)
+        except UcanInvalidElementError as e:
+            print ' ', e.args[0]
+            continue
+        if len(data) == 0: continue
+
+        _min, _max = dataExtremes(data, missing_value)
+        if element in groups:
+            last_hour = appendElementData(manager, station, element, data,
+                                          first_hour, min=_min, max=_max)
+        else:
+            last_hour = dateAsTuple(asDatetime(first_hour) +
+                                    relativedelta(hours=len(data)-1), True)
+            addElementDatasets(manager, station, element, data, first_hour,
+                               last_hour, units=units, missing=-32768,
+                               min=_min, max=_max)
+        if last_hour is not None: latest_hour = max(latest_hour, last_hour)
+
+    # derived elements only need to be calculated for the new hours
+    last_hour = appendDewpointData(manager, station)
+    if last_hour is not None: latest_hour = max(latest_hour, last_hour)
+
+    manager.setFileAttribute('last_hour', latest_hour)
+    manager.setFileAttribute('updated', manager._timestamp())
+    manager.closeFile()
+    print 'updated file for %s at %s' % (station['name'], filepath)
+    sys.stdout.flush()
+    sys.stderr.flush()
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -107,6 +296,8 @@ parser.add_option('-e', action='store', type='string', dest='elements',
                   default='all')
 parser.add_option('-w', action='store', type='string', dest='working_dir',
                   default=None)
+parser.add_option('-u', action='store_true', dest='update_existing',
+                  default=False)
 parser.add_option('-x', action='store_true', dest='replace_existing',
                   default=False)
 parser.add_option('-y', action='store_true', dest='test', default=False)
@@ -143,6 +334,10 @@ skipmsg = 'skipping station %d of %d : %d : %s (%s)'
 
 days_per_request = options.days_per_request
 replace_existing = options.replace_existing
+update_existing = options.update_existing
+if update_existing and replace_existing:
+    print 'Options -u (update) and -x (replace) cannot be used together.'
+    sys.exit(1)
 test_run = options.test
 if test_run: debug = True
 else: debug = options.debug
@@ -156,6 +351,12 @@ for station in stations:
     filepath = factory.getFilepathForUcanid(station['ucanid'], 'hours')
     if os.path.exists(filepath):
         if replace_existing: os.remove(filepath)
+        elif update_existing:
+            print procmsg % (station_num, total_stations, station['ucanid'],
+                             station['sid'], station['name'])
+            updateStationFile(factory, ucan, station, filepath, all_elements,
+                              end_date, debug)
+            continue
         else:
             print skipmsg % (station_num, total_stations, station['ucanid'],
                              station['sid'], station['name'])
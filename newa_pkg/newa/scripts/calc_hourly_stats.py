@@ -8,10 +8,13 @@ import numpy as N
 
 from rccpy.utils.data import validValues
 from rccpy.utils.options import optionsAsDict, stringToTuple
-from rccpy.utils.timeutils import asDatetime, isLeapYear
+from rccpy.utils.timeutils import asDatetime
 from rccpy.utils.timeutils import dateAsInt, decodeIntegerDate
 from rccpy.utils.units import getConversionFunction
 
+from rccpy.timeseries.data import TimeSeries
+from rccpy.timeseries.windows import rollingSums
+
 from newa.factory import ObsnetDataFactory
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -123,7 +126,7 @@ percent_missing = options.percent_missing
 report_rate = options.report_rate
 replace_existing = options.replace_existing
 
-max_sample_size = durtions_days * durations_hours
+max_sample_size = duration_days * duration_hours
 min_sample_size = int(max_sample_size * (1.0 - (percent_missing / 100.)))
 rel_hours_cushion = relativedelta(hours=hours_cushion)
 
@@ -185,40 +188,35 @@ for ucanid in ucanids:
 
         raw_data, raw_attrs = hours_manager.getData('%s.value' % element, True)
         raw_data = transformInput(element, raw_data, N.nan)
-        raw_hour_index = hours_cushion
-        last_index = len(raw_data) - hours_cushion
-
-        current_year = current_hour.year
-        is_leap_year = isLeapYear(current_year)
-        year_index = 0
-
-        current_month = current_hour.month
-        is_leap_month = iis_leap_year and current_month == 2
-
-        currrent_hour = base_hour + rel_hours_cushion
-
-        hour_matrix = [ [ [ ] for i in range(24) ] for j in range(365) ]
-        while raw_hour_index <= last_index:
-            if current_hour.year != current_year:
-                current_year = current_hour.year
-                is_leap_year = isLeapYear(current_year)
-                year_index += 1
-                current_month = 0 # force next if statement to fire
-            if current_hour.month != current_month:
-                current_month = current_hour.month
-                is_leap_month = is_leap_year and current_month == 2
-            if is_leap_month and current_hour.day == 29:
-                raw_hour_index += 2
-            else:
-                start_index = raw_hour_index - hours_cushion
-                end_index = raw_hour_index + hours_cushion
-                data = raw_data[start_index:end_index]
-                data = list(data[N.where(N.isfinite(data))])
-                num_hours = len(data)
-                if num_hours > 0:
-                    julian = current_hour.timetuple().tm_yday - 1
-                    hour_matrix[julian,current_hour.hour].extend(data)
-                raw_hour_index += 1
+        time_series = TimeSeries(element, base_hour, raw_data,
+                                 frequency='hour', missing=N.nan)
+
+        # sums over a window of +/- hours_cushion hours around every hour
+        counts, sums, squares, offset = rollingSums(raw_data, duration_hours,
+                                                    center=True)
+
+        # accumulate the windows for each day of year and hour of the day,
+        # skipping Feb 29 and hours whose window is clipped at either end
+        day_of_year = time_series.getCalendarKey('day_of_year')
+        keep = N.zeros(len(raw_data), dtype=bool)
+        keep[hours_cushion:len(raw_data)-hours_cushion] = True
+        keep &= day_of_year != 60
+        day_index = day_of_year - 1 - (day_of_year > 60)
+        cells = (day_index * 24) + time_series.getCalendarKey('hour')
+        cells = cells[keep]
+        count_sums = N.bincount(cells, counts[keep], 365*24).reshape(365,24)
+        value_sums = N.bincount(cells, sums[keep], 365*24).reshape(365,24)
+        square_sums = N.bincount(cells, squares[keep], 365*24).reshape(365,24)
+
+        # add +/- days_cushion days around each day of the year
+        count_matrix = count_sums.copy()
+        sum_matrix = value_sums.copy()
+        square_matrix = square_sums.copy()
+        for days in range(1, days_cushion+1):
+            for shift in (days, -days):
+                count_matrix += N.roll(count_sums, shift, axis=0)
+                sum_matrix += N.roll(value_sums, shift, axis=0)
+                square_matrix += N.roll(square_sums, shift, axis=0)
 
         # save the stats as datasets
         attrs = { 'created' : created,
@@ -232,18 +230,14 @@ for ucanid in ucanids:
         print 'created %s data group' % element
 
         # build stats datasets
-        count_matrix = N.zeros((365,24),'i2')
-        hourly_means = N.empty((365,24), float)
-        hourly_means.fill(N.nan)
-        hourly_stddevs = N.empty((365,24), float)
-        hourly_stddevs.fill(N.nan)
-        for i in range(365):
-            for j in range(24):
-                data = N.array(hour_matrix[i,j])
-                if len(data) >= min_sample_size:
-                    count_matrix[i,j] = len(data)
-                    hourly_means[i,j] = N.mean(data)
-                    hourly_stddevs[i,j] = N.std(data)
+        enough = count_matrix >= min_sample_size
+        safe_count = N.where(enough, count_matrix, 1)
+        hourly_means = N.where(enough, sum_matrix / safe_count, N.nan)
+        shifted_means = (sum_matrix / safe_count) - offset
+        variance = (square_matrix / safe_count) - (shifted_means**2)
+        hourly_stddevs = N.where(enough, N.sqrt(N.where(variance > 0.,
+                                                        variance, 0.)), N.nan)
+        count_matrix = N.where(enough, count_matrix, 0).astype('i2')
 
         # save the stats datasets
         dataset_name = '%s.count' % element
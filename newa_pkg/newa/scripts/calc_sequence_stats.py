@@ -217,8 +217,7 @@ def calcSequenceStatistics(factory, ucanid, elements, min_run_length,
 
             # create a listing of all sequences above minimum run length
             if sequences:
-                sequences = [ run for run in sequences
-                              if run[1] > min_run_length ]
+                sequences = sequences[sequences['count'] > min_run_length]
             if sequences:
                 if seq_log_file:
                     detector._saveSequences(seq_log_file, sequences)
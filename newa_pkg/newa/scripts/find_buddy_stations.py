@@ -21,8 +21,11 @@ from optparse import OptionParser
 parser = OptionParser()
 parser.add_option('-b', action='store', type='int', dest='max_buddies',
                   default=4)
+parser.add_option('-p', action='store', type='int', dest='file_pool_size',
+                  default=32)
 parser.add_option('-w', action='store', type='string', dest='working_dir',
                   default=None)
+parser.add_option('-z', action='store_true', dest='debug', default=False)
 
 options, args = parser.parse_args()
 
@@ -75,6 +78,7 @@ for ucanid in by_ucanid:
         end_hour = tuple(buddy_attrs['latest_hour'])[:4]
         delta = datetime(*end_hour) - datetime(*start_hour)
         num_hours = (delta.days * 24) + (delta.seconds / 3600) 
+        factory.releaseFileManager(buddy_manager)
         buddies.append((icao_id, distance, start_hour, num_hours))
         if len(buddies) >= max_buddies: break
 
@@ -87,5 +91,10 @@ for ucanid in by_ucanid:
     stats_manager = factory.getFileManager((ucanid,'statistics'), mode='a')
     attrs = { 'description' : 'buddy stations in ICAO network', }
     stats_manager.updateDataset('buddies', record, attrs)
-    stats_manager.closeFile()
+    factory.releaseFileManager(stats_manager)
+
+factory.releaseFileManager(index_manager)
+if options.debug:
+    print factory.filePoolStatistics()
+factory.closeAllFileManagers()
 
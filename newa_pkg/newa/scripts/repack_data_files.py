@@ -0,0 +1,143 @@
+#! /Users/rem63/venvs/nrcc_prod/bin/python
+
+import os, sys
+from datetime import datetime
+
+from rccpy.hdf5.layout import benchmarkLayouts, candidateLayouts
+from rccpy.hdf5.layout import combineResults, formatResults, repackFile
+from rccpy.hdf5.layout import DAILY_ACCESS_PATTERNS, DAILY_CHUNK_LENGTHS
+from rccpy.hdf5.layout import HOURLY_ACCESS_PATTERNS, HOURLY_CHUNK_LENGTHS
+
+from newa.factory import ObsnetDataFactory
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# file type : (dataset to benchmark, access patterns, chunk lengths, extensible)
+FILE_TYPES = {
+    'hours' : ('temp.value', HOURLY_ACCESS_PATTERNS, HOURLY_CHUNK_LENGTHS, True),
+    'days' : ('temp.value', DAILY_ACCESS_PATTERNS, DAILY_CHUNK_LENGTHS, True),
+    'statistics' : ('temp.extremes', (('por',None,1.),), (16,), False),
+    }
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+from optparse import OptionParser
+parser = OptionParser()
+
+parser.add_option('-d', action='store', type='string', dest='dataset_name',
+                  default=None)
+parser.add_option('-k', action='store_true', dest='keep_backup',
+                  default=False)
+parser.add_option('-n', action='store', type='int', dest='sample_size',
+                  default=5)
+parser.add_option('-r', action='store_true', dest='repack', default=False)
+parser.add_option('-t', action='store', type='string', dest='file_type',
+                  default='hours')
+parser.add_option('-w', action='store', type='string', dest='working_dir',
+                  default=None)
+parser.add_option('-z', action='store_true', dest='debug', default=False)
+
+options, args = parser.parse_args()
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+benchmsg = '\nbenchmarking station %d of %d : %d : %s (%s)'
+repackmsg = '\nrepacking station %d of %d : %d : %s (%s)'
+skipmsg = '\nNo %s data file for station %d of %d : %d : %s (%s)'
+
+debug = options.debug
+file_type = options.file_type
+if file_type not in FILE_TYPES:
+    print 'Unsupported file type : %s' % file_type
+    sys.exit(1)
+dataset_name, access_patterns, chunk_lengths, extensible = FILE_TYPES[file_type]
+if options.dataset_name is not None: dataset_name = options.dataset_name
+# the layout is applied to all datasets of the same kind, e.g. every 'value'
+dataset_kind = dataset_name.split('.')[-1]
+
+factory = ObsnetDataFactory(options)
+stations = factory.argsToStationData(args, options)
+total_stations = len(stations)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+layouts = candidateLayouts(chunk_lengths, extensible=extensible)
+log_dirpath = factory.getDirectoryPath('log')
+if not os.path.exists(log_dirpath): os.makedirs(log_dirpath)
+
+result_sets = [ ]
+station_num = 0
+for station in stations:
+    if len(result_sets) >= options.sample_size: break
+    station_num += 1
+    ucanid = station['ucanid']
+
+    filepath = factory.getFilepathForUcanid(ucanid, file_type)
+    if not os.path.exists(filepath):
+        if debug:
+            print skipmsg % (file_type, station_num, total_stations, ucanid,
+                             station['sid'], station['name'])
+        continue
+
+    manager = factory.getFileManager((ucanid,file_type), 'r')
+    if dataset_name in manager.listDatasets():
+        data = manager.getData(dataset_name)
+    else: data = None
+    factory.releaseFileManager(manager)
+    if data is None or len(data) == 0: continue
+
+    print benchmsg % (station_num, total_stations, ucanid, station['sid'],
+                      station['name'])
+    results = benchmarkLayouts(data, layouts, access_patterns, extensible,
+                               temp_dir=log_dirpath)
+    if debug:
+        for line in formatResults(results, access_patterns): print line
+    result_sets.append(results)
+
+if not result_sets:
+    print 'No %s datasets found to benchmark.' % dataset_name
+    sys.exit(1)
+
+results = combineResults(result_sets)
+best_layout = results[0]['layout']
+
+# record the results
+log_filepath = os.path.join(log_dirpath, '%s_layout.log' % file_type)
+log_file = open(log_filepath, 'a')
+log_file.write('\n%s : %s for %d stations\n' %
+               (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), dataset_name,
+                len(result_sets)))
+for line in formatResults(results, access_patterns):
+    log_file.write('%s\n' % line)
+log_file.write('best layout : %s\n' % best_layout.describe())
+log_file.close()
+
+print '\nbest layout for %s : %s' % (dataset_name, best_layout.describe())
+print 'results recorded in %s' % log_filepath
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+if options.repack:
+    factory.closeAllFileManagers()
+
+    def chooseLayout(name, dataset):
+        if name.split('/')[-1] == dataset_kind: return best_layout
+        return None
+
+    station_num = 0
+    for station in stations:
+        station_num += 1
+        ucanid = station['ucanid']
+        filepath = factory.getFilepathForUcanid(ucanid, file_type)
+        if not os.path.exists(filepath): continue
+
+        print repackmsg % (station_num, total_stations, ucanid, station['sid'],
+                           station['name'])
+        size = os.path.getsize(filepath)
+        repackFile(filepath, chooseLayout, options.keep_backup)
+        if debug:
+            print '    %d bytes before, %d after' % (size,
+                                                    os.path.getsize(filepath))
+        sys.stdout.flush()
+        sys.stderr.flush()
+
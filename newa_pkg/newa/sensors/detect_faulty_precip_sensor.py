@@ -172,7 +172,8 @@ if options.county is not None: metadata.append('county')
 if options.state is not None: metadata.append('state')
 
 factory = ObsnetDataFactory(options)
-stations = factory.argsToStationData((), options, tuple(metadata))
+stations = factory.argsToStationData((), options, tuple(metadata),
+                                     as_dicts=False)
 
 num_days = (end_date - start_date).days + 1
 date_str = start_date.strftime('%Y-%m-%d')
@@ -100,7 +100,7 @@ else: search_criteria = eval(options.search_criteria)
 
 # loop through all stations that match search criteria
 for station in factory.getIndexedStations('all', search_criteria,
-                                          sort_by='name'):
+                                          sort_by='name', as_dicts=False):
     try:
         result = validation_manager.validate(station)
     except Exception as e:
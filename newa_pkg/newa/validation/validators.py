@@ -4,6 +4,7 @@ import numpy as N
 
 from rccpy.analysis.sequence import SequenceDetector
 from rccpy.analysis.spike import SpikeDetector, CircularAngleSpikeDetector
+from rccpy.analysis.spike import spikeMagnitudes
 
 from rccpy.utils.timeutils import asDatetime
 
@@ -231,7 +232,7 @@ class SequenceValidator(BaseValidator):
             num_stddevs = self.stddevs[severity]
             limit = mean + (num_stddevs * stddev)
 
-            for value, length, end_index in detected:
+            for value, length, end_index in detected.tolist():
                 if end_index < front_cushion: continue
                 if length > limit and self.isvalid[end_index]:
                     end_hour = self.hourFromIndex(end_index)
@@ -292,11 +293,12 @@ class SpikeValidator(BaseValidator):
             num_stddevs = self.stddevs[severity]
             limit = mean + (num_stddevs * stddev)
 
-            for spike, indx, value in detected:
-                magnitude = min(abs(spike[0]),abs(spike[1]))
-                if magnitude > limit  and self.isvalid[indx]:
+            magnitudes = spikeMagnitudes(detected)
+            for spike in detected[magnitudes > limit].tolist():
+                leg_1, leg_2, indx, value = spike
+                if self.isvalid[indx]:
                     hour = self.hourFromIndex(indx)
-                    detail = (severity, 'spk', hour, value, spike, limit,
-                              num_stddevs)
+                    detail = (severity, 'spk', hour, value, (leg_1, leg_2),
+                              limit, num_stddevs)
                     self._capture(indx, detail)
 
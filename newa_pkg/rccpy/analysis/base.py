@@ -1,6 +1,19 @@
 
+from datetime import datetime
+
 import numpy as N
 
+from rccpy.analysis.results import DetectorResults
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def missingMask(values, missing_value):
+    """ Returns a boolean array that is True where values are missing.
+    """
+    if missing_value is None: return N.zeros(values.shape, dtype=bool)
+    if N.isnan(missing_value): return N.isnan(values)
+    return values == missing_value
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 class BaseDetector(object):
@@ -11,6 +24,8 @@ class BaseDetector(object):
 
         if data_type == int and N.isnan(missing_value):
             missing_value = -32768
+        # missing value as it appears in the arrays passed to _detect
+        self.detect_missing = missing_value
         if N.isnan(missing_value):
             def _countMissing(sequence):
                 return len(N.where(N.isnan(sequence))[0])
@@ -31,6 +46,8 @@ class BaseDetector(object):
         self.detected = None
         self.filters = None
         self.filter_groups = None
+        # (frequency, base_time, interval) attached to detected results
+        self.time_axis = (None, None, 1)
 
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
@@ -50,20 +67,128 @@ class BaseDetector(object):
         if end_index is None: end_index = len(data_array)
 
         # detect sequences of identical values
-        if self.data_type == int:
-            data_array[N.where(N.isinf(data_array))] = self.missing_value
-            data_array[N.where(N.isnan(data_array))] = self.missing_value
-            return self._detect(N.array(data_array, dtype=int), start_index,
-                                end_index)
-        else:
-            return self._detect(data_array, start_index, end_index)
+        return self._detect(self._detectArray(data_array), start_index,
+                            end_index)
 
     def _detect(self, data_array, start_index, end_index):
         # do the real work
         raise NotImplementedError
 
+    def _detectArray(self, data_array, copy=False):
+        """ Returns data_array as it is passed to _detect, integer detectors
+        get an int array with invalid values set to the missing value.
+        """
+        if self.data_type != int: return data_array
+        if copy or not isinstance(data_array, N.ndarray):
+            data_array = N.array(data_array)
+        if data_array.dtype.kind == 'f':
+            data_array[N.where(~N.isfinite(data_array))] = self.detect_missing
+        return N.array(data_array, dtype=int)
+
+    def _results(self, records):
+        """ Wraps a structured array of detections on this detector's
+        time axis.
+        """
+        return DetectorResults(records, *self.time_axis)
+
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
     def applyFilters(self, filters):
         return None
 
+    # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
+
+    def resetStream(self, first_index=0):
+        """ Starts streaming detection. The first chunk passed to update()
+        begins at first_index in the complete data array.
+        """
+        self.num_entries = first_index
+        self.streamed = [ ]
+        self._resetPending()
+
+    def update(self, chunk):
+        """ Detects in the next chunk of consecutive data. Detections that
+        continue past the end of the chunk are held until the chunk that
+        completes them. Returns the results completed by this chunk.
+        """
+        if not hasattr(self, 'streamed'): self.resetStream()
+        records = self._update(self._detectArray(chunk, True))
+        self.num_entries += len(chunk)
+        self.streamed.append(records)
+        return self._results(records)
+
+    def finish(self):
+        """ Completes streaming detection and returns all results detected
+        since the stream was started or its state was restored, including
+        a run that is still open at the end of the last chunk. They are
+        also the detector's detected results, so filters and statistics
+        work the same as they do after detect(). The pending data is kept,
+        so getState() still returns a state that later chunks can continue,
+        and a run reported here is not reported again by a later finish()
+        unless more entries have been added to it.
+        """
+        if not hasattr(self, 'streamed'): self.resetStream()
+        self.streamed.append(self._finish())
+
+        records = [ chunk for chunk in self.streamed if len(chunk) > 0 ]
+        if records: records = N.concatenate(records)
+        else: records = self.streamed[-1]
+        self.detected = self._results(records)
+        self.streamed = [ ]
+        return self.detected
+
+    def detectInChunks(self, data_array, chunk_size, start_index=0,
+                             end_index=None):
+        """ Same results as detect(), but data_array is only read chunk_size
+        entries at a time.
+        """
+        if end_index is None: end_index = len(data_array)
+        self.resetStream(start_index)
+        for start in range(start_index, end_index, chunk_size):
+            self.update(data_array[start:min(start+chunk_size, end_index)])
+        return self.finish()
+
+    def getState(self):
+        """ Returns (pending, attrs) where pending is an array of the data
+        held over from the last chunk and attrs is a dictionary of simple
+        values, so the state can be saved as a dataset and its attributes.
+        """
+        if not hasattr(self, 'streamed'): self.resetStream()
+        pending, attrs = self._getPending()
+        attrs['num_entries'] = self.num_entries
+        frequency, base_time, interval = self.time_axis
+        if frequency is not None:
+            attrs['frequency'] = frequency
+            attrs['base_time'] = tuple(base_time.timetuple()[:4])
+            attrs['interval'] = interval
+        return pending, attrs
+
+    def setState(self, pending, attrs):
+        """ Restores a state saved with getState(), the next chunk passed to
+        update() must begin with the entry after the last one that was
+        passed before the state was saved.
+        """
+        self.resetStream(int(attrs['num_entries']))
+        if 'frequency' in attrs and self.time_axis[0] is None:
+            self.time_axis = (str(attrs['frequency']),
+                              datetime(*[int(part) for part in
+                                         attrs['base_time']]),
+                              int(attrs['interval']))
+        self._setPending(N.asarray(pending), attrs)
+
+    def _resetPending(self):
+        raise NotImplementedError
+
+    def _update(self, data_array):
+        raise NotImplementedError
+
+    def _finish(self):
+        # returns the held detections, without discarding the pending data
+        raise NotImplementedError
+
+    def _getPending(self):
+        raise NotImplementedError
+
+    def _setPending(self, pending, attrs):
+        raise NotImplementedError
+
@@ -0,0 +1,200 @@
+""" Compiles detector filter strings into vectorized mask functions.
+
+Filters are configured as the condition of a list comprehension over the
+detected records, e.g. 'if (run[0] > 0 and run[0] < 60)' for runs or
+'if spike != 0' for spikes. Instead of evaluating a comprehension for every
+filter group, each condition is parsed once into a function of the result
+columns that returns a boolean mask, and compiled filter sets are cached, so
+the filters for an element are only compiled the first time they are used.
+
+Supported expressions : comparisons (including chained comparisons), and,
+or, not, arithmetic, numbers, abs(), subscripts of the record name that
+select a field (see SEQUENCE_FILTER_FIELDS and SPIKE_FILTER_FIELDS) and the
+names of the fields themselves.
+"""
+
+import ast
+import operator
+
+import numpy as N
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# subscripts of the record name in filter strings and the column they select,
+# the empty subscript is the record name by itself
+SEQUENCE_FILTER_FIELDS = { () : 'value', (0,) : 'value', (1,) : 'count',
+                           (2,) : 'end_index' }
+SPIKE_FILTER_FIELDS = { () : 'magnitude', (0,0) : 'leg_1', (0,1) : 'leg_2',
+                        (1,) : 'index', (2,) : 'value' }
+
+FILTER_OPERATORS = { ast.Add : N.add, ast.Sub : N.subtract,
+                     ast.Mult : N.multiply, ast.Div : N.true_divide,
+                     ast.Mod : N.mod, ast.Pow : N.power,
+                     ast.Eq : N.equal, ast.NotEq : N.not_equal,
+                     ast.Lt : N.less, ast.LtE : N.less_equal,
+                     ast.Gt : N.greater, ast.GtE : N.greater_equal,
+                     ast.USub : N.negative, ast.UAdd : operator.pos,
+                     ast.Not : N.logical_not, ast.Invert : N.logical_not,
+                     ast.And : N.logical_and, ast.Or : N.logical_or,
+                   }
+FILTER_FUNCTIONS = { 'abs' : N.absolute, 'min' : N.minimum,
+                     'max' : N.maximum }
+FILTER_CONSTANTS = { 'True' : True, 'False' : False }
+
+FILTER_ERRMSG = "Unsupported filter expression '%s' : %s"
+
+_FILTER_CACHE = { }
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def compileFilter(filter_, record_name, fields):
+    """ Returns a function that takes a mapping of column names to arrays
+    and returns a boolean mask of the records that pass the filter. An empty
+    filter passes every record.
+    """
+    expression = filter_.strip()
+    if expression.startswith('if '): expression = expression[3:].strip()
+    if not expression: return _passAll
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError, e:
+        raise ValueError, FILTER_ERRMSG % (filter_, str(e))
+    function = _compileNode(tree.body, filter_, record_name, fields)
+    def _filterMask(columns):
+        mask = N.asarray(function(columns), dtype=bool)
+        if mask.ndim == 0: mask = N.repeat(mask, columns.num_records)
+        return mask
+    return _filterMask
+
+def compileFilters(filters, record_name, fields):
+    """ Compiles all of the (key, filter, label, format) entries in a filter
+    set. Returns a tuple of (key, mask function) pairs. Compiled sets are
+    cached, so a filter set is only compiled once.
+    """
+    cache_key = (record_name, tuple(sorted(fields.items())),
+                 tuple([ (params[0], params[1]) for params in filters ]))
+    compiled = _FILTER_CACHE.get(cache_key, None)
+    if compiled is None:
+        compiled = tuple([ (key, compileFilter(filter_, record_name, fields))
+                           for key, filter_, label, fmt in filters ])
+        _FILTER_CACHE[cache_key] = compiled
+    return compiled
+
+def filterMasks(columns, compiled):
+    """ Evaluates every compiled filter against the same columns. Returns a
+    list of (key, mask) pairs in filter order.
+    """
+    if not isinstance(columns, FilterColumns):
+        columns = FilterColumns(columns)
+    return [ (key, function(columns)) for key, function in compiled ]
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class FilterColumns(dict):
+    """ Columns of detected records shared by all filters in a set. Derived
+    columns are passed as functions of the records and are only calculated
+    when a filter uses them, then kept for the other filters.
+    """
+
+    def __init__(self, records, derived=None):
+        dict.__init__(self)
+        self.records = records
+        self.num_records = len(records)
+        if derived is None: derived = { }
+        self.derived = derived
+
+    def __missing__(self, name):
+        function = self.derived.get(name, None)
+        if function is not None: column = function(self.records)
+        else: column = self.records[name]
+        self[name] = column
+        return column
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def _passAll(columns):
+    return N.ones(columns.num_records, dtype=bool)
+
+def _subscriptPath(node, filter_, record_name):
+    """ Returns the record subscripts of a node, e.g. (0,1) for run[0][1],
+    or None when the node is not a subscript of the record name.
+    """
+    path = [ ]
+    while isinstance(node, ast.Subscript):
+        if not (isinstance(node.slice, ast.Index) and
+                isinstance(node.slice.value, ast.Num)):
+            raise ValueError, FILTER_ERRMSG % (filter_, 'invalid subscript')
+        path.insert(0, int(node.slice.value.n))
+        node = node.value
+    if isinstance(node, ast.Name) and node.id == record_name:
+        return tuple(path)
+    return None
+
+def _compileNode(node, filter_, record_name, fields):
+    compile_ = lambda child: _compileNode(child, filter_, record_name, fields)
+
+    if isinstance(node, (ast.Name, ast.Subscript)):
+        path = _subscriptPath(node, filter_, record_name)
+        if path is not None:
+            if path not in fields:
+                errmsg = "'%s%s' does not select a field"
+                raise ValueError, FILTER_ERRMSG % (filter_, errmsg %
+                      (record_name, ''.join(['[%d]' % i for i in path])))
+            name = fields[path]
+            return lambda columns: columns[name]
+        if isinstance(node, ast.Name):
+            if node.id in FILTER_CONSTANTS:
+                value = FILTER_CONSTANTS[node.id]
+                return lambda columns: value
+            if node.id in fields.values():
+                name = node.id
+                return lambda columns: columns[name]
+        raise ValueError, FILTER_ERRMSG % (filter_, 'unknown name')
+
+    if isinstance(node, ast.Num):
+        value = node.n
+        return lambda columns: value
+
+    if isinstance(node, ast.Compare):
+        operands = [ compile_(node.left) ] + map(compile_, node.comparators)
+        ops = [ _operator(op, filter_) for op in node.ops ]
+        def _compare(columns):
+            values = [ operand(columns) for operand in operands ]
+            result = ops[0](values[0], values[1])
+            for indx in range(1, len(ops)):
+                result = N.logical_and(result, ops[indx](values[indx],
+                                                         values[indx+1]))
+            return result
+        return _compare
+
+    if isinstance(node, ast.BoolOp):
+        operands = map(compile_, node.values)
+        op = _operator(node.op, filter_)
+        def _boolean(columns):
+            return reduce(op, [ operand(columns) for operand in operands ])
+        return _boolean
+
+    if isinstance(node, ast.BinOp):
+        left = compile_(node.left)
+        right = compile_(node.right)
+        op = _operator(node.op, filter_)
+        return lambda columns: op(left(columns), right(columns))
+
+    if isinstance(node, ast.UnaryOp):
+        operand = compile_(node.operand)
+        op = _operator(node.op, filter_)
+        return lambda columns: op(operand(columns))
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+    and node.func.id in FILTER_FUNCTIONS and not node.keywords:
+        function = FILTER_FUNCTIONS[node.func.id]
+        args = map(compile_, node.args)
+        return lambda columns: function(*[ arg(columns) for arg in args ])
+
+    raise ValueError, FILTER_ERRMSG % (filter_, node.__class__.__name__)
+
+def _operator(op, filter_):
+    function = FILTER_OPERATORS.get(op.__class__, None)
+    if function is None:
+        raise ValueError, FILTER_ERRMSG % (filter_, op.__class__.__name__)
+    return function
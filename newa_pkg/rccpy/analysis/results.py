@@ -0,0 +1,133 @@
+""" Containers for the runs and spikes found by the detectors.
+
+Results are kept in a NumPy structured array with one record per detection
+and named fields, so filtering, sorting and grouping are column operations.
+A time axis (frequency, base time and interval of the data array) may be
+attached, which makes it possible to find the time or month of any index
+field without looking at each detection.
+"""
+
+import numpy as N
+
+from rccpy.timeseries.generators import calendarLookup, epochsToTimes
+from rccpy.timeseries.generators import timeToEpoch
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def sequenceDtype(value_dtype):
+    """ Record type for detected runs : the first value in the run, the
+    number of entries in the run and the index of its last entry.
+    """
+    return N.dtype([('value', value_dtype), ('count', 'i8'),
+                    ('end_index', 'i8')])
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class DetectorResults(object):
+    """ Structured array of detections with an optional time axis.
+    Indexing with a field name returns the column and an int returns a
+    single record. Any other index (slice, boolean mask or index array)
+    returns a DetectorResults for the selected records on the same time axis.
+    """
+
+    def __init__(self, records, frequency=None, base_time=None, interval=1):
+        self.records = records
+        self.frequency = frequency
+        self.base_time = base_time
+        self.interval = interval
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, (basestring,int,long,N.integer)):
+            return self.records[key]
+        return self.subset(key)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, repr(self.records))
+
+    @property
+    def dtype(self): return self.records.dtype
+
+    @property
+    def fields(self): return self.records.dtype.names
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def subset(self, key):
+        return DetectorResults(self.records[key], self.frequency,
+                               self.base_time, self.interval)
+
+    def sorted(self, field):
+        return self.subset(N.argsort(self.records[field], kind='mergesort'))
+
+    def tolist(self):
+        return self.records.tolist()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def epochs(self, indexes):
+        """ Returns the frequency epochs of data array indexes (a field name
+        or an array).
+        """
+        if self.frequency is None:
+            raise ValueError, 'Results do not have a time axis.'
+        if isinstance(indexes, basestring): indexes = self.records[indexes]
+        return timeToEpoch(self.frequency, self.base_time) \
+             + (N.asarray(indexes, dtype='i8') * self.interval)
+
+    def times(self, indexes, date_format=None):
+        """ Returns the times of data array indexes in any of the date
+        formats supported by epochsToTimes.
+        """
+        return epochsToTimes(self.frequency, self.epochs(indexes), date_format)
+
+    def monthEpochs(self, indexes):
+        """ Returns the number of months since January 1970 for data array
+        indexes, works for 'hour', 'day' and 'month' frequencies.
+        """
+        epochs = self.epochs(indexes)
+        if self.frequency == 'month': return epochs
+        if self.frequency == 'hour': epochs = epochs // 24
+        elif self.frequency != 'day':
+            errmsg = '`%s` frequency does not have months'
+            raise ValueError, errmsg % self.frequency
+        if len(epochs) == 0: return epochs
+        year, month, day = calendarLookup(epochs)
+        return ((year.astype('i8') - 1970) * 12) + month - 1
+
+    def months(self, indexes):
+        """ Returns the month (1 - 12) of data array indexes.
+        """
+        return (self.monthEpochs(indexes) % 12) + 1
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def groupByMonth(self, first_index, last_index=None):
+        """ Returns a tuple of 12 DetectorResults, one for each month of
+        the year. When last_index is also given, each detection is included
+        in every month from the month of first_index thru the month of
+        last_index.
+        """
+        first = self.monthEpochs(first_index)
+        if last_index is None:
+            rows = N.arange(len(first))
+            months = first % 12
+        else:
+            spans = (self.monthEpochs(last_index) - first) + 1
+            rows = N.repeat(N.arange(len(first)), spans)
+            offsets = N.arange(len(rows)) - N.repeat(N.cumsum(spans) - spans,
+                                                     spans)
+            months = (N.repeat(first, spans) + offsets) % 12
+        return tuple([ self.subset(rows[months == month])
+                       for month in range(12) ])
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def emptyResults(dtype, frequency=None, base_time=None, interval=1):
+    return DetectorResults(N.empty(0, dtype=dtype), frequency, base_time,
+                           interval)
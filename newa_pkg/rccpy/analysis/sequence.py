@@ -1,7 +1,10 @@
 
 import numpy as N
 
-from rccpy.analysis.base import BaseDetector
+from rccpy.analysis.base import BaseDetector, missingMask
+from rccpy.analysis.filters import FilterColumns, SEQUENCE_FILTER_FIELDS
+from rccpy.analysis.filters import compileFilters, filterMasks
+from rccpy.analysis.results import DetectorResults, sequenceDtype
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -11,6 +14,71 @@ GROUP_ERRMSG = "either 'groupSequences()' or call method must be run prior to '%
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+def quantizer(tolerance):
+    """ Returns a function that maps values to keys that are equal for all
+    values that are equivalent at the tolerance :
+        N.inf = identical values
+        0 = same integer part
+        int = same value when rounded to that number of decimal places
+        float = same multiple of the tolerance
+    """
+    if N.isinf(tolerance): return lambda values: values
+    if tolerance == 0: return N.trunc
+    if isinstance(tolerance, (int,long)):
+        return lambda values: N.round(values, tolerance)
+    return lambda values: N.floor(values / float(tolerance))
+
+def runLengths(data_array, missing_value=None, tolerance=N.inf,
+               start_index=0, end_index=None, min_count=2):
+    """ Finds runs of equivalent values and runs of missing values in
+    data_array[start_index:end_index]. tolerance is any of the values
+    accepted by quantizer, or a quantizer function. Returns (values, counts,
+    end_indexes) arrays for runs with at least min_count entries, where the
+    value is the first value in the run and the end index is the index of
+    the last entry of the run in data_array. Run boundaries are found in a
+    single pass over the whole array.
+    """
+    if end_index is None: end_index = len(data_array)
+    values = N.asarray(data_array[start_index:end_index])
+    num_values = len(values)
+    if num_values == 0:
+        empty = N.array([ ], dtype=int)
+        return values[:0], empty, empty
+
+    missing = missingMask(values, missing_value)
+    if callable(tolerance): keys = tolerance(values)
+    else: keys = quantizer(tolerance)(values)
+    changes = N.empty(num_values, dtype=bool)
+    changes[0] = True
+    changes[1:] = (keys[1:] != keys[:-1]) | (missing[1:] != missing[:-1])
+    # adjacent missing values are always part of the same run
+    changes[1:] &= ~(missing[1:] & missing[:-1])
+
+    starts = N.flatnonzero(changes)
+    ends = N.empty(len(starts), dtype=int)
+    ends[:-1] = starts[1:] - 1
+    ends[-1] = num_values - 1
+    counts = (ends - starts) + 1
+    keep = counts >= min_count
+    return values[starts[keep]], counts[keep], ends[keep] + start_index
+
+def runColumn(sequences, field):
+    """ Returns one field of detected runs as an array, sequences may be
+    a DetectorResults or a sequence of (value, count, end_index) tuples.
+    """
+    if isinstance(sequences, DetectorResults): return sequences[field]
+    position = ('value', 'count', 'end_index').index(field)
+    return N.array([ run[position] for run in sequences ])
+
+def sortedRuns(sequences):
+    """ Returns detected runs as a list of tuples in end index order.
+    """
+    if isinstance(sequences, DetectorResults):
+        return sequences.sorted('end_index').tolist()
+    return sorted(sequences, key=lambda x:x[2])
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
 class SequenceDetector(BaseDetector):
 
     REPORT_FORMAT = '%s%%d occurences starting @ %%d = %%s'
@@ -24,44 +92,94 @@ class SequenceDetector(BaseDetector):
         self.statistics = None
 
         self.tolerance = tolerance
-        if N.isinf(tolerance):
-            def _isEquivalent(value_1, value_2):
-                return value_1 == value_2
-        elif tolerance == 0:
-            def _isEquivalent(value_1, value_2):
-                return (int(value_1) - int(value_2)) == 0
-        elif isinstance(tolerance, int):
-            _tolerance = eval('1e-%d' % tolerance)
-            def _isEquivalent(value_1, value_2):
-                return abs(value_1 - value_2) <= _tolerance
-            self.tolerance = _tolerance
-        else:
-            def _isEquivalent(value_1, value_2):
-                return abs(value_1 - value_2) <= tolerance
-        self._isEquivalent = _isEquivalent
+        self.quantize = quantizer(tolerance)
+        if isinstance(tolerance, int) and tolerance > 0:
+            self.tolerance = 10. ** -tolerance
 
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
     def _detect(self, data_array, start_index, end_index):
-        runs = [ ]
-        count = 1
-        indx = start_index
-        previous = data_array[0]
-
-        while indx < end_index:
-            value = data_array[indx]
-            if self.isMissing(previous) and self.isMissing(value):
-                count += 1
-            elif self._isEquivalent(value, previous):
-                count += 1
-            else:
-                if count > 1:
-                    runs.append( (previous, count, indx-1) )
-                previous = value
-                count = 1
-            indx += 1
+        values, counts, end_indexes = \
+            runLengths(data_array, self.detect_missing, self.quantize,
+                       start_index, end_index)
+        return self._results(self._records(values, counts, end_indexes))
+
+    def _records(self, values, counts, end_indexes):
+        runs = N.empty(len(counts), dtype=sequenceDtype(values.dtype))
+        runs['value'] = values
+        runs['count'] = counts
+        runs['end_index'] = end_indexes
+        return runs
 
-        return tuple(runs)
+    # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
+
+    def _resetPending(self):
+        # first value and length of the run that is still open
+        self.open_run = None
+        # length of the open run when finish() last reported it
+        self.reported_count = 0
+        self.value_dtype = N.dtype(self.data_type)
+
+    def _update(self, data_array):
+        data_array = N.asarray(data_array)
+        if len(data_array) > 0: self.value_dtype = data_array.dtype
+        if self.open_run is None:
+            values = data_array
+            first_index = self.num_entries
+            extra = 0
+        elif len(data_array) == 0:
+            return self._records(N.empty(0, self.value_dtype), [ ], [ ])
+        else:
+            # the first value of the open run stands in for the whole run
+            open_value, open_count = self.open_run
+            values = N.concatenate((N.array([open_value], self.value_dtype),
+                                    data_array))
+            first_index = self.num_entries - 1
+            extra = open_count - 1
+
+        values, counts, end_indexes = \
+            runLengths(values, self.detect_missing, self.quantize, 0, None, 1)
+        if len(counts) == 0:
+            return self._records(values, counts, end_indexes)
+        counts[0] += extra
+        end_indexes += first_index
+
+        closed = counts[:-1] >= 2
+        if len(counts) > 1:
+            # the open run ended, it was already reported unless it grew
+            if counts[0] <= self.reported_count: closed[0] = False
+            self.reported_count = 0
+        # the last run may continue in the next chunk
+        self.open_run = (values[-1], int(counts[-1]))
+        return self._records(values[:-1][closed], counts[:-1][closed],
+                             end_indexes[:-1][closed])
+
+    def _finish(self):
+        values = N.empty(0, self.value_dtype)
+        counts = end_indexes = N.array([ ], dtype=int)
+        # the open run is not reported again unless it has grown
+        if self.open_run is not None and self.open_run[1] >= 2 \
+        and self.open_run[1] > self.reported_count:
+            values = N.array([self.open_run[0]], self.value_dtype)
+            counts = N.array([self.open_run[1]])
+            end_indexes = N.array([self.num_entries - 1])
+            self.reported_count = self.open_run[1]
+        return self._records(values, counts, end_indexes)
+
+    def _getPending(self):
+        if self.open_run is None:
+            return (N.empty(0, self.value_dtype),
+                    { 'open_count' : 0, 'reported_count' : 0 })
+        return (N.array([self.open_run[0]], self.value_dtype),
+                { 'open_count' : self.open_run[1],
+                  'reported_count' : self.reported_count })
+
+    def _setPending(self, pending, attrs):
+        self.value_dtype = pending.dtype
+        if int(attrs['open_count']) > 0:
+            self.open_run = (pending[0], int(attrs['open_count']))
+            # states saved before this was tracked have not been reported
+            self.reported_count = int(attrs.get('reported_count', 0))
 
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
@@ -72,24 +190,24 @@ class SequenceDetector(BaseDetector):
         filter_groups = { }
 
         # group sequences by filter ... do not use sequences of missing data
-        valid = [ run for run in self.detected if not self.isMissing(run[0]) ]
-        if valid:
+        missing = missingMask(self.detected['value'], self.detect_missing)
+        valid = self.detected[~missing]
+        if len(valid):
             if filters is not None:
-                for key_, filter_, label_, fmt_ in filters:
-                    if key_ == 'missing': continue
-                    if filter_:
-                        runs = eval("[ run for run in valid %s]" % filter_)
-                        if runs: filter_groups[key_] = tuple(runs)
-                    else:
-                        filter_groups[key_] = valid
+                filters = [ params for params in filters
+                            if params[0] != 'missing' ]
+                compiled = compileFilters(filters, 'run',
+                                          SEQUENCE_FILTER_FIELDS)
+                for key_, mask in filterMasks(FilterColumns(valid.records),
+                                              compiled):
+                    if mask.any(): filter_groups[key_] = valid[mask]
             else:
                 filter_groups['x==x'] = valid
                 self.filters.append(('x==x','','valid values',lambda x:str(x)))
 
         # sequences of missing data
-        missing = [ run for run in self.detected if self.isMissing(run[0]) ]
-        if missing:
-            filter_groups['missing'] = tuple(missing)
+        if missing.any():
+            filter_groups['missing'] = self.detected[missing]
             if filters is None:
                 self.filters.append( ('missing','','missing values',
                                                 'missing') )
@@ -109,15 +227,15 @@ class SequenceDetector(BaseDetector):
                 # loop through sequence filters
                 for key, flt, lbl, fmt in self.filters:
                     runs = self.filter_groups.get(key, ())
-                    if runs: stats[key] = self._calcStatistics(runs)
+                    if len(runs): stats[key] = self._calcStatistics(runs)
 
         # return stats dictionary
         self.statistics = stats
         return stats
 
     def _calcStatistics(self, sequences):
-        counts = [ run[1] for run in sequences ]
-        if counts: return { 'max' : N.max(counts), 'min' : N.min(counts),
+        counts = runColumn(sequences, 'count')
+        if len(counts): return { 'max' : N.max(counts), 'min' : N.min(counts),
                             'median' : N.median(counts),
                             'mean' : int(round(N.mean(counts))),
                             'stddev' : max(int(round(N.std(counts))),1),
@@ -146,25 +264,24 @@ class SequenceDetector(BaseDetector):
                 continue
             key, f, label, fmt = params
             runs = filter_groups.get(key, ())
-            if runs and count_cutoff:
+            if len(runs) and count_cutoff:
                 statistic = self.statistics[count_cutoff]
-                runs = [run for run in runs if run[1] > statistic]
-            if runs:
+                runs = runs[runs['count'] > statistic]
+            if len(runs):
                 print summary % label
                 self._reportSequences(self._formatValues(runs, fmt),
                                       '        ')
         # runs of missing values
         if include_missing:
             runs = filter_groups.get('missing', ())
-            if runs:
+            if len(runs):
                 k, f, label, fmt = missing_filter
                 print summary % label
                 self._reportSequences(self._formatValues(runs, fmt), '        ')
 
     def _reportSequences(self, sequences, spacer='    '):
         fmt = self.REPORT_FORMAT % spacer
-        sequences.sort(key=lambda x:x[2])
-        for run in sequences:
+        for run in sortedRuns(sequences):
             print fmt % (run[1],run[2],run[0])
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -184,18 +301,18 @@ class SequenceDetector(BaseDetector):
                 continue
             key, f, label, fmt = params
             runs = filter_groups.get(key, ())
-            if runs and count_cutoff:
+            if len(runs) and count_cutoff:
                 statistic = self.statistics['%s_count' % count_cutoff]
-                runs = [run for run in runs if run[1] > statistic]
-            if runs: 
-                output_file.write(summary % label_)
+                runs = runs[runs['count'] > statistic]
+            if len(runs):
+                output_file.write(summary % label)
                 self._saveSequences(output_file, self._formatValues(runs, fmt),
                                     '        ')
 
         # runs of missing values
         if include_missing:
             runs = filter_groups.get('missing', ())
-            if runs:
+            if len(runs):
                 k, f, label, fmt = missing_filter
                 output_file.write(summary % label)
                 self._saveSequences(output_file, self._formatValues(runs, fmt),
@@ -203,14 +320,15 @@ class SequenceDetector(BaseDetector):
 
     def _saveSequences(self, output_file, sequences, spacer='    '):
         fmt = self.SAVE_FORMAT % spacer
-        sequences.sort(key=lambda x:x[2])
-        for run in sequences:
+        for run in sortedRuns(sequences):
             output_file.write(fmt % (run[1],run[2],run[0]))
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def _formatValues(self, sequences, format_=None):
         if format_ is None: format_ = str
+        if isinstance(sequences, DetectorResults):
+            sequences = sequences.tolist()
 
         if callable(format_):
             return [(format_(run[0]), run[1], run[2]) for run in sequences]
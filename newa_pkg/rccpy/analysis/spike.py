@@ -3,7 +3,10 @@ import datetime
 
 import numpy as N
 
-from rccpy.analysis.base import BaseDetector
+from rccpy.analysis.base import BaseDetector, missingMask
+from rccpy.analysis.filters import FilterColumns, SPIKE_FILTER_FIELDS
+from rccpy.analysis.filters import compileFilters, filterMasks
+from rccpy.analysis.results import DetectorResults
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -13,6 +16,77 @@ SUPPORTED_ELEMENTS = ('temp','rhum','dewpt','srad','wdir','wspd')
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+def spikeDtype(value_dtype, leg_dtype=None):
+    """ Record type for detected spikes : the two legs of the spike (the
+    differences into and out of the spike), its index and its value.
+    """
+    if leg_dtype is None: leg_dtype = value_dtype
+    return N.dtype([('leg_1', leg_dtype), ('leg_2', leg_dtype),
+                    ('index', 'i8'), ('value', value_dtype)])
+
+def linearDifferences(values):
+    """ Differences between consecutive values.
+    """
+    return N.diff(values)
+
+def angleDifferences(values):
+    """ Differences between consecutive compass directions, positive is
+    clockwise and the magnitude is never more than 180 degrees.
+    """
+    angles = N.diff(values)
+    return N.where(angles > 180, angles - 360,
+                   N.where(angles < -180, angles + 360, angles))
+
+def findSpikes(data_array, missing_value=None, start_index=0, end_index=None,
+               differences=linearDifferences, min_magnitude=1):
+    """ Finds every spike in data_array[start_index:end_index]. A spike is
+    a value that is higher or lower than the values on both sides of it by
+    at least min_magnitude. Windows that include a missing value are
+    skipped. Returns a structured array (see spikeDtype) with the index of
+    each spike in data_array.
+    """
+    if end_index is None: end_index = len(data_array)
+    values = N.asarray(data_array[start_index:end_index])
+    with N.errstate(invalid='ignore'):
+        legs = differences(values)
+    dtype = spikeDtype(values.dtype, legs.dtype)
+    if len(values) < 3: return N.empty(0, dtype=dtype)
+
+    missing = missingMask(values, missing_value)
+    middle = values[1:-1]
+    leg_1 = legs[:-1]
+    leg_2 = legs[1:]
+    with N.errstate(invalid='ignore'):
+        spikes = ~(missing[:-2] | missing[1:-1] | missing[2:])
+        spikes &= (middle != values[:-2]) & (middle != values[2:])
+        spikes &= (N.absolute(leg_1) >= min_magnitude)
+        spikes &= (N.absolute(leg_2) >= min_magnitude)
+        # the legs must go in opposite directions
+        spikes &= (leg_1 > 0) != (leg_2 > 0)
+
+    where = N.flatnonzero(spikes)
+    detected = N.empty(len(where), dtype=dtype)
+    detected['leg_1'] = leg_1[where]
+    detected['leg_2'] = leg_2[where]
+    detected['index'] = where + start_index + 1
+    detected['value'] = middle[where]
+    return detected
+
+def spikeMagnitudes(spikes):
+    """ Magnitude of each spike, the smaller of its two legs.
+    """
+    return N.minimum(N.absolute(spikes['leg_1']), N.absolute(spikes['leg_2']))
+
+def sortedSpikes(spikes):
+    """ Returns detected spikes as a list of (leg_1, leg_2, index, value)
+    tuples in index order.
+    """
+    if isinstance(spikes, DetectorResults):
+        return spikes.sorted('index').tolist()
+    return N.sort(spikes, order='index', kind='mergesort').tolist()
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
 class SpikeDetector(BaseDetector):
 
     REPORT_FORMAT = '%s spike @ %%d : magnitude (%%d, %%d) : value = %%d'
@@ -27,54 +101,39 @@ class SpikeDetector(BaseDetector):
     def _detect(self, data_array, start_index, end_index):
         """ Detect all spikes in the data_array
         """
-        spikes = [ ]
-        start_seq = start_index
-        end_seq = start_index + 2
-
-        while end_seq < end_index:
-            spike = self._detectSpike(data_array[start_seq:end_seq+1])
-            if spike is not None:
-                spike_index = start_seq + 1
-                spikes.append((spike, spike_index, data_array[spike_index]))
-            start_seq += 1
-            end_seq += 1
-
-        return tuple(spikes)
-
-    def _detectSpike(self, spike):
-        """ A spike is a spike of  3 values where the middle value is
-        either higher or lower than the other two values.
-
-        Arguments :
-            spike = a spike of 3 values (list, tuple oor Numpy array)
-
-        Returns:
-            None = no spike present
-            or
-            value = aboslute value of the smallest leg of the spike
-        """
-        # Doesn't work with missing values
-        if self.countMissing(spike) > 0: return None
-        # no spike if middle value equals the value on either side of it
-        if spike[1]==spike[0] or spike[1]==spike[2]: return None
+        return self._results(findSpikes(data_array, self.detect_missing,
+                                        start_index, end_index,
+                                        self._differences))
 
-        # difference btween middle value and the value on either side of it
-        diff_1_0 = self._difference(spike[:2])
-        diff_2_1 = self._difference(spike[1:])
+    def _differences(self, values):
+        return linearDifferences(values)
 
-        # no spike if either difference is zero
-        if abs(diff_1_0) < 1 or abs(diff_2_1) < 1: return None
-        # no spike when both differences have the same sign
-        if diff_1_0 > 0 and diff_2_1 > 0: return None
-        if diff_1_0 < 0 and diff_2_1 < 0: return None
+    # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
-        # spike occurs when the sign of differences between consecutive
-        # values is different ... only need the smaller value of the two diffs
-        return diff_1_0, diff_2_1
+    def _resetPending(self):
+        # last two values seen, a spike at the last value can only be found
+        # when the next value arrives
+        self.pending = N.empty(0, N.dtype(self.data_type))
 
-    def _difference(self, two_values):
-        # seems silly, but makes it much easier to build subclasses
-        return two_values[1] - two_values[0]
+    def _update(self, data_array):
+        data_array = N.asarray(data_array)
+        values = N.concatenate((self.pending.astype(data_array.dtype),
+                                data_array))
+        spikes = findSpikes(values, self.detect_missing, 0, None,
+                            self._differences)
+        spikes['index'] += self.num_entries - len(self.pending)
+        self.pending = values[-2:]
+        return spikes
+
+    def _finish(self):
+        return findSpikes(self.pending[:0], self.detect_missing, 0, None,
+                          self._differences)
+
+    def _getPending(self):
+        return self.pending.copy(), { }
+
+    def _setPending(self, pending, attrs):
+        self.pending = pending[-2:]
 
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
@@ -84,10 +143,11 @@ class SpikeDetector(BaseDetector):
         # group spikes by filter ... do not use spikes of missing data
         if filters is not None:
             filter_groups = { }
-            list_comprehension = "[spike for spike in self.detected %s]"
-            for key_, filter_, label_, fmt_ in filters:
-                spikes = eval(list_comprehension % filter_)
-                if spikes: filter_groups[key_] = tuple(spikes)
+            compiled = compileFilters(filters, 'spike', SPIKE_FILTER_FIELDS)
+            columns = FilterColumns(self.detected.records,
+                                    { 'magnitude' : spikeMagnitudes })
+            for key_, mask in filterMasks(columns, compiled):
+                if mask.any(): filter_groups[key_] = self.detected[mask]
 
         else: filter_groups = None
 
@@ -108,16 +168,15 @@ class SpikeDetector(BaseDetector):
                 # loop through sequence filters
                 for key, flt, lbl, fmt in self.filters:
                     spikes = self.filter_groups.get(key, ())
-                    if spikes: stats[key] = self._calcStatistics(spikes)
+                    if len(spikes): stats[key] = self._calcStatistics(spikes)
 
         # return stats dictionary
         self.statistics = stats
         return stats
 
     def _calcStatistics(self, spikes):
-        magnitudes = [ min(abs(spike[0][0]),abs(spike[0][1]))
-                       for spike in spikes ]
-        if magnitudes:
+        magnitudes = spikeMagnitudes(spikes)
+        if len(magnitudes):
             return { 'max' : N.max(magnitudes),
                      'min' : N.min(magnitudes),
                      'median' : N.median(magnitudes),
@@ -139,22 +198,20 @@ class SpikeDetector(BaseDetector):
 
     def _reportSpikes(self, spikes, spacer='    '):
         fmt = self.REPORT_FORMAT % spacer
-        spikes.sort(key=lambda x:x[1])
-        for spike in spikes:
-            print fmt % (spike[1],spike[0][0],spike[0][1],spike[2])
+        for leg_1, leg_2, index, value in sortedSpikes(spikes):
+            print fmt % (index, leg_1, leg_2, value)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def saveSpikes(self, output_file, spacer='    '):
         if self.detected is None:
             raise RuntimeError, DETECT_ERRMSG % 'saveSpikes'
-        self._saveSpikes(self, output_file, self.detected, spacer)
+        self._saveSpikes(output_file, self.detected, spacer)
 
     def _saveSpikes(self, output_file, spikes, spacer='    '):
         fmt = self.SAVE_FORMAT % spacer
-        for spike in spikes:
-            line = fmt % (spike[1],spike[0][0],spile[0][1],spike[2])
-            output_file.write(line)
+        for leg_1, leg_2, index, value in sortedSpikes(spikes):
+            output_file.write(fmt % (index, leg_1, leg_2, value))
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -163,11 +220,5 @@ class CircularAngleSpikeDetector(SpikeDetector):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _difference(self, two_angles):
-        # positive angle is always clockwise
-        angle = two_angles[1] - two_angles[0]
-        if abs(angle) <= 180 : return angle
-        if two_angles[0] > two_angles[1]:
-            return (two_angles[1] + 360) - two_angles[0] 
-        return two_angles[1] - (two_angles[0] + 360)
-
+    def _differences(self, values):
+        return angleDifferences(values)
@@ -3,7 +3,7 @@ from dateutil.relativedelta import relativedelta
 
 import numpy as N
 
-from rccpy.utils.time import asDatetime
+from rccpy.utils.timeutils import asDatetime
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
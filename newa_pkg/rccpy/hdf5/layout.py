@@ -0,0 +1,274 @@
+""" Chunk layout and compression advisor for HDF5 time series datasets.
+
+Candidate layouts (chunk length along the time axis plus a compression
+filter) are benchmarked against a copy of a real dataset using the access
+patterns of the jobs that read it, e.g. full period of record scans and
+short daily or monthly windows. The layout with the lowest weighted read
+time can then be used to repack existing files.
+"""
+
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import h5py
+import numpy as N
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# (name, number of entries read, relative frequency of the access)
+# a window of None means the full dataset is read
+HOURLY_ACCESS_PATTERNS = ( ('por', None, 1.), ('day', 24, 30.),
+                           ('month', 744, 4.) )
+DAILY_ACCESS_PATTERNS = ( ('por', None, 1.), ('month', 31, 30.),
+                          ('year', 366, 4.) )
+
+# chunk lengths along the time axis
+HOURLY_CHUNK_LENGTHS = (168, 744, 2190, 8760)
+DAILY_CHUNK_LENGTHS = (31, 92, 366, 1461)
+
+# (compression, compression_opts, shuffle)
+DEFAULT_FILTERS = ( (None, None, False), ('lzf', None, False),
+                    ('lzf', None, True), ('gzip', 1, False),
+                    ('gzip', 1, True), ('gzip', 4, True), ('gzip', 9, True) )
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class DatasetLayout(object):
+    """ Storage layout of a single dataset. A chunk_length of None means
+    contiguous storage, which can not be used for compressed or extensible
+    datasets.
+    """
+
+    def __init__(self, chunk_length=None, compression=None,
+                       compression_opts=None, shuffle=False):
+        self.chunk_length = chunk_length
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+
+    def __eq__(self, other):
+        return isinstance(other, DatasetLayout) and \
+               self.describe() == other.describe()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.describe())
+
+    def __repr__(self):
+        return 'DatasetLayout(%s)' % self.describe()
+
+    def createArgs(self, shape, maxshape=None):
+        """ Returns keyword arguments for h5py create_dataset.
+        """
+        args = { }
+        if self.chunk_length is not None:
+            chunk_length = self.chunk_length
+            if maxshape is None or maxshape[0] is not None:
+                # fixed size datasets can not have chunks larger than data
+                chunk_length = min(chunk_length, max(shape[0], 1))
+            chunks = (chunk_length,) + tuple([max(size, 1)
+                                              for size in shape[1:]])
+            args['chunks'] = chunks
+            if maxshape is not None: args['maxshape'] = maxshape
+        if self.compression is not None:
+            args['compression'] = self.compression
+            if self.compression_opts is not None:
+                args['compression_opts'] = self.compression_opts
+        if self.shuffle: args['shuffle'] = True
+        return args
+
+    def describe(self):
+        if self.chunk_length is None: chunks = 'contiguous'
+        else: chunks = 'chunks=%d' % self.chunk_length
+        if self.compression is None: compression = 'none'
+        elif self.compression_opts is None: compression = self.compression
+        else: compression = '%s-%s' % (self.compression,
+                                       str(self.compression_opts))
+        if self.shuffle: compression += '+shuffle'
+        return '%s,%s' % (chunks, compression)
+
+def layoutOfDataset(dataset):
+    """ Returns the DatasetLayout of an existing h5py dataset.
+    """
+    if dataset.chunks is None: chunk_length = None
+    else: chunk_length = dataset.chunks[0]
+    return DatasetLayout(chunk_length, dataset.compression,
+                         dataset.compression_opts, dataset.shuffle)
+
+def candidateLayouts(chunk_lengths=HOURLY_CHUNK_LENGTHS,
+                     filters=DEFAULT_FILTERS, extensible=True):
+    layouts = [ ]
+    if not extensible: layouts.append(DatasetLayout())
+    for chunk_length in chunk_lengths:
+        for compression, compression_opts, shuffle in filters:
+            layouts.append(DatasetLayout(chunk_length, compression,
+                                         compression_opts, shuffle))
+    return layouts
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def _timeReads(filepath, num_entries, window, num_windows, repeat, random):
+    """ Returns the best average time (over repeat tries) to read one
+    window of entries from the 'data' dataset in filepath.
+    """
+    if window is None or window >= num_entries:
+        starts = [0,]
+        window = num_entries
+    else:
+        starts = random.randint(0, num_entries - window + 1, num_windows)
+
+    best = None
+    for attempt in range(repeat):
+        # reopen so that the chunk cache does not carry over between tries
+        hdf5_file = h5py.File(filepath, 'r')
+        try:
+            dataset = hdf5_file['data']
+            start_time = time.time()
+            for start in starts:
+                dataset[start:start+window]
+            elapsed = (time.time() - start_time) / len(starts)
+        finally:
+            hdf5_file.close()
+        if best is None or elapsed < best: best = elapsed
+    return best
+
+def benchmarkLayouts(data, layouts, access_patterns=HOURLY_ACCESS_PATTERNS,
+                     extensible=True, repeat=3, num_windows=50, temp_dir=None,
+                     seed=0):
+    """ Writes data to a scratch file using each of the layouts and times
+    the reads in access_patterns. Returns a list of result dictionaries,
+    best (lowest weighted read time) first. Each result contains the
+    layout, the size of the file, the time to write the data, the time for
+    each access pattern and the weighted score.
+    """
+    if len(data) == 0:
+        raise ValueError, 'Can not benchmark layouts for an empty dataset.'
+    if extensible: maxshape = (None,) + data.shape[1:]
+    else: maxshape = None
+
+    results = [ ]
+    for layout in layouts:
+        random = N.random.RandomState(seed)
+        handle, filepath = tempfile.mkstemp(suffix='.h5', dir=temp_dir)
+        os.close(handle)
+        try:
+            start_time = time.time()
+            hdf5_file = h5py.File(filepath, 'w')
+            try:
+                hdf5_file.create_dataset('data', data=data,
+                                   **layout.createArgs(data.shape, maxshape))
+            finally:
+                hdf5_file.close()
+            result = { 'layout' : layout, 'write' : time.time() - start_time,
+                       'size' : os.path.getsize(filepath), }
+            score = 0.
+            for name, window, weight in access_patterns:
+                elapsed = _timeReads(filepath, len(data), window, num_windows,
+                                     repeat, random)
+                result[name] = elapsed
+                score += weight * elapsed
+            result['score'] = score
+            results.append(result)
+        finally:
+            os.remove(filepath)
+
+    results.sort(key=lambda result: result['score'])
+    return results
+
+def combineResults(result_sets):
+    """ Sums the scores and sizes for each layout over results from more
+    than one dataset (e.g. a sample of stations). Returns results in the
+    same form as benchmarkLayouts, best first.
+    """
+    combined = { }
+    for results in result_sets:
+        for result in results:
+            key = result['layout'].describe()
+            if key not in combined:
+                combined[key] = dict(result)
+            else:
+                total = combined[key]
+                for name, value in result.items():
+                    if name != 'layout': total[name] += value
+    results = combined.values()
+    results.sort(key=lambda result: result['score'])
+    return results
+
+def formatResults(results, access_patterns=HOURLY_ACCESS_PATTERNS):
+    """ Returns the results as lines of a text table.
+    """
+    names = [pattern[0] for pattern in access_patterns]
+    header = '%-28s %10s %10s' % ('layout', 'size', 'score')
+    for name in names: header += ' %10s' % name
+    lines = [header,]
+    for result in results:
+        line = '%-28s %10d %10.6f' % (result['layout'].describe(),
+                                      result['size'], result['score'])
+        for name in names: line += ' %10.6f' % result[name]
+        lines.append(line)
+    return lines
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def _copyAttributes(from_object, to_object):
+    for name, value in from_object.attrs.items():
+        to_object.attrs[name] = value
+
+def repackFile(filepath, chooseLayout, keep_backup=False):
+    """ Rewrites an HDF5 file with a new layout for its datasets.
+    chooseLayout is called with the full name and the h5py object of each
+    dataset and must return a DatasetLayout or None to keep the layout the
+    dataset already has. Attributes, fill values and extensibility are
+    preserved. The original file is replaced only after the new file has
+    been completely written. Returns a dictionary with the layouts that
+    were applied to each dataset.
+    """
+    repack_filepath = '%s.repack' % filepath
+    applied = { }
+
+    source = h5py.File(filepath, 'r')
+    try:
+        target = h5py.File(repack_filepath, 'w')
+        try:
+            _copyAttributes(source, target)
+
+            def copyObject(name, _object):
+                if isinstance(_object, h5py.Dataset):
+                    if len(_object.shape) == 0: layout = None
+                    else: layout = chooseLayout(name, _object)
+                    if layout is None: layout = layoutOfDataset(_object)
+                    maxshape = _object.maxshape
+                    if _object.chunks is None: maxshape = None
+                    args = layout.createArgs(_object.shape, maxshape)
+                    if _object.fillvalue is not None:
+                        args['fillvalue'] = _object.fillvalue
+                    if _object.size > 0: args['data'] = _object[...]
+                    else: args['shape'] = _object.shape
+                    dataset = target.create_dataset(name, dtype=_object.dtype,
+                                                    **args)
+                    _copyAttributes(_object, dataset)
+                    applied[name] = layout
+                else:
+                    group = target.require_group(name)
+                    _copyAttributes(_object, group)
+
+            source.visititems(copyObject)
+        finally:
+            target.close()
+    except:
+        source.close()
+        if os.path.exists(repack_filepath): os.remove(repack_filepath)
+        raise
+    source.close()
+
+    if keep_backup:
+        backup_filepath = '%s.%s' % (filepath,
+                                     datetime.now().strftime('%Y%m%d%H%M%S'))
+        os.rename(filepath, backup_filepath)
+    os.rename(repack_filepath, filepath)
+    return applied
+
@@ -3,13 +3,16 @@
 
 import os
 from datetime import datetime
+from dateutil.relativedelta import relativedelta
 
 import h5py
 import numpy as N
 
 from rccpy.utils.data import safestring, safevalue, safedict
-from rccpy.utils.data import safeDataKey, dictToWhere, listToWhere
-from rccpy.utils.units import getConversionFunction
+from rccpy.utils.data import safeDataKey
+from rccpy.hdf5.query import compileCriteria
+from rccpy.utils.units import getInPlaceConversion
+from rccpy.utils.timeutils import asDatetime
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -77,6 +80,47 @@ def walkToObject(root_object, object_key):
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+TIME_TUPLE_LENGTH = { 'hour':4, 'day':3, 'month':2, 'year':1 }
+
+def timeToIndex(base_time, _time, frequency, interval=1):
+    """ Returns the index of _time in a time series dataset whose first
+    entry is at base_time.
+    """
+    base_time = asDatetime(base_time)
+    _time = asDatetime(_time)
+    if frequency == 'hour':
+        delta = _time - base_time
+        offset = (delta.days * 24) + (delta.seconds / 3600)
+    elif frequency == 'day':
+        offset = (_time - base_time).days
+    elif frequency == 'month':
+        offset = ((_time.year - base_time.year) * 12) + _time.month \
+                 - base_time.month
+    elif frequency == 'year':
+        offset = _time.year - base_time.year
+    else:
+        raise ValueError, 'Unsupported time series frequency : %s' % frequency
+    return offset / interval
+
+def indexToTime(base_time, index, frequency, interval=1):
+    """ Returns the time of the entry at index as a tuple.
+    """
+    base_time = asDatetime(base_time)
+    offset = index * interval
+    if frequency == 'hour':
+        _time = base_time + relativedelta(hours=offset)
+    elif frequency == 'day':
+        _time = base_time + relativedelta(days=offset)
+    elif frequency == 'month':
+        _time = base_time + relativedelta(months=offset)
+    elif frequency == 'year':
+        _time = base_time + relativedelta(years=offset)
+    else:
+        raise ValueError, 'Unsupported time series frequency : %s' % frequency
+    return _time.timetuple()[:TIME_TUPLE_LENGTH[frequency]]
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
 class HDF5DataFileMixin:
     """ Mixin class that reads, transforms and subsets data arrays in
     HDF5-encoded files.
@@ -123,13 +167,14 @@ class HDF5DataFileMixin:
 
         create_args = { }
         for arg_name in kwargs:
-            create_args[safe_name(arg_name)] = kwargs[arg_name]
+            create_args[safeDataKey(arg_name)] = kwargs[arg_name]
 
-        if 'maxshape' in create_args:
+        # extendable dataset created from a shape instead of an array
+        if 'maxshape' in create_args and not isinstance(numpy_array,N.ndarray):
             if 'dtype' not in create_args:
                 raise IOError, "'dtype' is required for extendable datasets."
             if len(numpy_array) != len(create_args['maxshape']):
-                errmg = '3rd argument must be the initial shape of the array.'
+                errmsg = '3rd argument must be the initial shape of the array.'
                 raise IOError, errmsg
             initial_shape = numpy_array
             dataset = parent.create_dataset(dataset_key, initial_shape,
@@ -424,6 +469,7 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
         self.hdf5_file_mode = mode
         self.dataset_names = ()
         self.open_container = ('',None)
+        self.column_cache = { }
         if hdf5_filepath is not None:
             self.openFile(hdf5_filepath, mode)
 
@@ -458,8 +504,14 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
         if criteria:
             indexes = self._where(criteria)
             if indexes and len(indexes[0]) > 0:
-                return self.getData(dataset_names, include_attributes,
-                                    indexes=indexes)
+                if include_attributes:
+                    return self.getData(dataset_names, include_attributes,
+                                        indexes=indexes)
+                # columns used by previous queries are already in memory
+                if isinstance(dataset_names, (tuple,list)):
+                    return tuple([self._getColumn(name)[indexes]
+                                  for name in dataset_names])
+                return self._getColumn(dataset_names)[indexes]
             else:
                 errmsg = 'No entries meet search criteria : %s'
                 raise ValueError, errmsg % str(criteria)
@@ -467,25 +519,97 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
 
     def getSerialData(self, dataset_names, serial_criteria,
                             include_attributes=False, **kwargs):
-        data = self.getData(dataset_names, True, **kwargs)
+        out = kwargs.pop('out', None)
+        data = self._getSerialSource(dataset_names, **kwargs)
         if isinstance(dataset_names, (tuple,list)):
-            data == list(data)
+            if out is None: out = (None,) * len(dataset_names)
+            data = list(data)
             for indx in range(len(dataset_names)):
                 _array_, attrs = data[indx]
                 serial_attrs = serial_criteria[indx]
-                _array_, attrs = self._serialize(_array_, attrs, serial_attrs)
+                _array_, attrs = self._serialize(_array_, attrs, serial_attrs,
+                                                 out[indx])
                 if include_attributes: data[indx] = (_array_, attrs)
                 else: data[indx] = _array_
             return tuple(data)
         else:
-            data, attrs = self._serialize(data[0], data[1], serial_criteria)
+            data, attrs = self._serialize(data[0], data[1], serial_criteria,
+                                          out)
             if include_attributes: return data, attrs
             else: return data
 
+    def getDataWindow(self, dataset_name, start_time=None, end_time=None,
+                            include_attributes=False, pad=False):
+        """ Reads only the entries of a time series dataset that fall between
+        start_time and end_time (inclusive). The dataset must have a
+        'frequency' attribute and a 'first_<frequency>' attribute with the
+        time of the first entry. When pad is True, times outside of the
+        dataset's period of record are filled with its missing value.
+        Otherwise the window is clipped to the period of record.
+        """
+        self.assertFileOpen()
+        name, parent = self._keyToNameAndParent(self.hdf5_file, dataset_name)
+        dataset = self._getDataset_(parent, name)
+        return self._sliceWindow(dataset, dict(dataset.attrs), start_time,
+                                 end_time, include_attributes, pad)
+
+    def _sliceWindow(self, dataset, attrs, start_time, end_time,
+                           include_attributes, pad):
+        """ Time window slice of any array-like object, e.g. an HDF5
+        dataset or a numpy array, with the time series attributes in attrs.
+        """
+        frequency = attrs['frequency']
+        interval = attrs.get('interval', 1)
+        base_time = tuple(attrs['first_%s' % frequency])
+        num_entries = dataset.shape[0]
+
+        if start_time is None: start = 0
+        else: start = timeToIndex(base_time, start_time, frequency, interval)
+        if end_time is None: stop = num_entries
+        else: stop = timeToIndex(base_time,end_time,frequency,interval) + 1
+
+        first = max(start, 0)
+        last = max(min(stop, num_entries), first)
+        data = dataset[first:last]
+
+        if pad and (start < first or stop > last) and stop > start:
+            window = N.empty((stop-start,) + dataset.shape[1:],
+                             dtype=dataset.dtype)
+            window.fill(attrs.get('missing', 0))
+            window[first-start:last-start] = data
+            data = window
+            first = start
+            last = stop
+
+        if include_attributes:
+            attrs['first_%s' % frequency] = \
+                indexToTime(base_time, first, frequency, interval)
+            attrs['last_%s' % frequency] = \
+                indexToTime(base_time, last-1, frequency, interval)
+            return data, attrs
+        return data
+
+    def _getSerialSource(self, dataset_names, **kwargs):
+        """ Returns (data, attributes) for each dataset. When a time window
+        is passed in kwargs, only the data in that window is read.
+        """
+        start_time = kwargs.pop('start_time', None)
+        end_time = kwargs.pop('end_time', None)
+        pad = kwargs.pop('pad', False)
+        if start_time is None and end_time is None:
+            return self.getData(dataset_names, True, **kwargs)
+
+        if isinstance(dataset_names, (tuple,list)):
+            return tuple([ self.getDataWindow(name, start_time, end_time,
+                                              True, pad)
+                           for name in dataset_names ])
+        return self.getDataWindow(dataset_names,start_time,end_time,True,pad)
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def createDataset(self, dataset_name, numpy_array, attributes={}, **kwargs):
         self.assertFileWritable()
+        self._clearColumnCache()
 
         attrs = safedict(attributes)
         if 'created' not in attrs:
@@ -521,7 +645,8 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
         return self.dataset_names
 
     def insertData(self, dataset_name, indexes, data):
-        dataset = self.getdataset(dataset_name)
+        self._clearColumnCache()
+        dataset = self.getDataset(dataset_name)
         if isinstance(indexes, int):
             dataset[indexes] = data
         elif isinstance(indexes, (tuple,list)):
@@ -552,14 +677,36 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
         self.createDataset(dataset_name, data, attributes)
 
     def resizeDataset(self, dataset_name, max_index):
-        self.assertFileOpen()
+        self.assertFileWritable()
+        self._clearColumnCache()
         dataset = self.getDataset(dataset_name)
-        old_shape = self.hdf5_file[dataset_name].shape
-        new_size = (max_index,) + old_shape[1:]
-        self.hdf5_file[dataset_name].resize(new_size)
+        dataset.resize((max_index,) + dataset.shape[1:])
+        return dataset
+
+    def appendData(self, dataset_name, numpy_array):
+        """ Extends the first dimension of a resizable dataset and copies
+        numpy_array into the new entries. Returns the new dataset length.
+        """
+        self.assertFileWritable()
+        dataset = self.getDataset(dataset_name)
+        if not self.isExtensible(dataset_name):
+            errmsg = "'%s' dataset cannot be extended."
+            raise IOError, errmsg % dataset_name
+        old_size = dataset.shape[0]
+        new_size = old_size + len(numpy_array)
+        self.resizeDataset(dataset_name, new_size)
+        dataset[old_size:new_size] = numpy_array
+        return new_size
+
+    def isExtensible(self, dataset_name):
+        """ Returns True if the first dimension of the dataset is resizable.
+        """
+        maxshape = self.getDataset(dataset_name).maxshape
+        return maxshape is not None and maxshape[0] is None
 
     def updateDataset(self, dataset_name, numpy_array, attributes={}, **kwargs):
         self.assertFileWritable()
+        self._clearColumnCache()
         
         name, parent = self._keyToNameAndParent(self.hdf5_file, dataset_name)
         if name in self.dataset_names:
@@ -624,6 +771,7 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
             raise IOError, 'HDF5 file is not writable.'
 
     def closeFile(self):
+        self._clearColumnCache()
         if self.hdf5_file is not None:
             self._closeFile_(self.hdf5_file)
             self.hdf5_file = None
@@ -642,6 +790,11 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
         self.assertFileOpen()
         return self._getFileAttributes_(self.hdf5_file)
 
+    def flushFile(self):
+        """ Forces any buffered changes to be written to the file.
+        """
+        if self.hdf5_file is not None: self.hdf5_file.flush()
+
     def getFilePath(self):
         return self.hdf5_filepath
 
@@ -725,7 +878,13 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
 
     def deleteObject(self, object_name):
         self.assertFileWritable()
-        self._deleteObject_(self.hdf5_file, object_name)
+        self._clearColumnCache()
+        # dotted names (e.g. 'temp.sequences.detector_state') are deleted
+        # from their parent group
+        name, parent = self._keyToNameAndParent(self.hdf5_file, object_name)
+        self._deleteObject_(parent, name)
+        # the deleted object may have been the open container
+        self.open_container = ('',None)
 
     def deleteObjectAttribute(self, object_name, attr_name):
         self._deleteObjectAttribute_(self.getObject(object_name), attr_name)
@@ -855,72 +1014,93 @@ class HDF5DataFileManager(HDF5DataFileMixin, object):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _serialize(self, data, attrs, serial_attrs):
-        serial_type = serial_attrs[0]
+    def _serialize(self, data, attrs, serial_attrs, out=None):
+        """ Casts data to the serial type, converts it to the serial units
+        and replaces missing values. Steps that would not change the data
+        are skipped. The result is written into out when it is passed,
+        otherwise data is modified in place whenever its type does not
+        need to change.
+        """
+        serial_type, serial_units, serial_missing = serial_attrs[:3]
         if serial_type == float:
-            if data.dtype.kind != 'f': data = N.array(data, dtype=float)
+            if data.dtype.kind == 'f': dtype = data.dtype
+            else: dtype = N.dtype(float)
         elif serial_type == int:
-            if data.dtype.kind != 'i': data = N.array(data, dtype=int)
-        elif isinstance(serial_type, basestring):
-            if N.dtype(serial_type) != data.dtype:
-                data = N.array(data, dtype=serial_type)
-
-        missing = attrs['missing']
-        serial_missing = serial_attrs[2]
-        if N.isfinite(missing):
-            if serial_missing != missing:
-                data[N.where(data == missing)] = serial_missing
-                attrs['missing'] = serial_missing
-        elif N.isnan(missing):
-            if not N.isnan(serial_missing):
-                data[N.where(N.isnan(data))] = serial_missing
-                attrs['missing'] = serial_missing
-        elif N.isinf(missing):
-            if not N.isinf(serial_missing):
-                data[N.where(N.isinf(data))] = serial_missing
-                attrs['missing'] = serial_missing
-
-        if serial_attrs[1] != attrs['units']:
-            convert = getConversionFunction(attrs['units'], serial_attrs[1])
-            if convert is not None: data = convert(data)
-            attrs['units'] = serial_attrs[1]
-
-        return data, attrs
+            if data.dtype.kind == 'i': dtype = data.dtype
+            else: dtype = N.dtype(int)
+        elif isinstance(serial_type, basestring): dtype = N.dtype(serial_type)
+        else: dtype = data.dtype
+
+        # locate missing values before the data is altered
+        missing = attrs.get('missing', None)
+        missing_mask = None
+        if missing is not None and not self._sameMissing(missing,
+                                                         serial_missing):
+            if N.isnan(missing): missing_mask = N.isnan(data)
+            elif N.isinf(missing): missing_mask = N.isinf(data)
+            else: missing_mask = data == missing
+            if not missing_mask.any(): missing_mask = None
+            attrs['missing'] = serial_missing
+
+        convert = None
+        units = attrs.get('units', None)
+        if serial_units != units:
+            convert = getInPlaceConversion(units, serial_units)
+            attrs['units'] = serial_units
+        # converted values can not be stored in an integer array
+        if convert is not None and dtype.kind != 'f': dtype = N.dtype(float)
+
+        if out is not None:
+            if out.shape != data.shape:
+                errmsg = 'Output array shape %s does not match data shape %s'
+                raise ValueError, errmsg % (str(out.shape), str(data.shape))
+            if convert is not None and out.dtype.kind != 'f':
+                errmsg = 'Unit conversion requires a float output array : %s'
+                raise TypeError, errmsg % str(out.dtype)
+            out[...] = data
+        elif dtype != data.dtype: out = data.astype(dtype)
+        # read-only data (e.g. a memory mapped file) must be copied
+        elif not data.flags.writeable and (convert is not None or
+                                           missing_mask is not None):
+            out = data.copy()
+        else: out = data
+
+        if convert is not None: convert(out)
+        if missing_mask is not None: out[missing_mask] = serial_missing
+
+        return out, attrs
+
+    def _sameMissing(self, missing, serial_missing):
+        if isinstance(missing, basestring) or \
+           isinstance(serial_missing, basestring):
+            return missing == serial_missing
+        if N.isnan(missing): return N.isnan(serial_missing)
+        if N.isinf(missing): return N.isinf(serial_missing)
+        return missing == serial_missing
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def _where(self, criteria):
         if criteria:
+            query = compileCriteria(criteria)
+            if len(query) == 0: return None
             errmsg = 'Key for filter criteria is not a valid dataset name : %s'
-            where = None
-            constraint_data = { }
             dataset_names = self.listDatasets()
-
-            if isinstance(criteria, dict):
-                for key, constraint in criteria.items():
-                    if constraint is None: continue
-                    if key == 'bbox':
-                        constraint_data['lon'] = self.getData('lon')
-                        constraint_data['lat'] = self.getData('lat')
-                    elif key in dataset_names:
-                        if key not in constraint_data:
-                            constraint_data[key] = self.getData(key)
-                    else: raise KeyError, errmsg % key
-                if constraint_data:
-                    where = dictToWhere(criteria)
-
-            elif isinstance(criteria, (list,tuple)):
-                for rule in criteria:
-                    key = rule[0]
-                    if key in dataset_names:
-                        if key not in constraint_data:
-                            constraint_data[key] = self.getData(key)
-                    else: raise KeyError, errmsg % key
-                if constraint_data:
-                    where = listToWhere(criteria)
-
-            if where is not None:
-                return eval(where, globals(), constraint_data)
-
+            for key in query.keys():
+                if key not in dataset_names: raise KeyError, errmsg % key
+            return query.where(self._getColumn)
         return None
 
+    def _getColumn(self, dataset_name):
+        """ Returns the full contents of a dataset. Datasets are cached
+        so that repeated queries on the same file only read them once.
+        """
+        column = self.column_cache.get(dataset_name, None)
+        if column is None:
+            column = self.getData(dataset_name)
+            self.column_cache[dataset_name] = column
+        return column
+
+    def _clearColumnCache(self):
+        self.column_cache = { }
+
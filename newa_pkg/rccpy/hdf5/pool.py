@@ -0,0 +1,203 @@
+""" Bounded pool of open HDF5 file managers.
+
+Scripts that visit the same station files over and over (buddy searches,
+historical statistics, validation) pay for an open/close and a fresh parse
+of the HDF5 metadata every time they ask for a manager. The pool keeps a
+limited number of managers open and hands the same instance back on
+subsequent requests for the same file.
+"""
+
+import os
+from collections import OrderedDict
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+READ_MODES = ('r',)
+WRITE_MODES = ('a','w','r+')
+
+def poolKey(filepath, mode=None):
+    """ Returns the (path, mode) key of a pooled manager. Modes are reduced
+    to 'r' and 'a', a manager opened with 'w' or 'r+' is pooled as 'a'.
+    """
+    path = os.path.normpath(os.path.abspath(filepath))
+    if mode is None: return path
+    if isWritableMode(mode): return (path, 'a')
+    return (path, 'r')
+
+def isWritableMode(mode):
+    return mode in WRITE_MODES
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class HDF5FileManagerPool(object):
+    """ LRU pool of open HDF5 file managers.
+
+    Managers are keyed by the normalized path of their file together with
+    the mode they were opened in ('r' or 'a'), so a read-only request is
+    never handed a writable manager and the reverse. A file can only be
+    open in one mode at a time, so a request for the other mode closes the
+    pooled manager first.
+
+    Managers that are checked out (returned by getManager or added with
+    addManager and not yet passed to releaseManager) are pinned. When the
+    pool is full, the least recently used manager that is not pinned is
+    flushed and closed before a new one is opened. When every manager is
+    pinned, the pool grows past max_open until some are released.
+    """
+
+    def __init__(self, max_open=16):
+        if max_open < 1:
+            raise ValueError, 'Pool size must be at least 1 : %d' % max_open
+        self.max_open = max_open
+        self.managers = OrderedDict()
+        self.checked_out = { }
+        self.hits = 0
+        self.misses = 0
+        self.reopens = 0
+        self.evictions = 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def __contains__(self, filepath):
+        return len(self._keysForPath(filepath)) > 0
+
+    def __len__(self):
+        return len(self.managers)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def getManager(self, filepath, mode, ManagerClass):
+        """ Returns an open manager for filepath in mode and pins it until
+        it is released. When there is no pooled manager for the file and
+        mode, a new one is created by calling ManagerClass(filepath, mode).
+        """
+        key = poolKey(filepath, mode)
+        manager = self.managers.get(key, None)
+
+        if manager is not None:
+            # manager was closed by a caller, it must be reopened
+            if manager.hdf5_file is None: self._discard(key)
+            else:
+                self.hits += 1
+                self._touch(key)
+                self._pin(key)
+                return manager
+
+        # the file can not be open in two modes at once
+        for other_key in self._keysForPath(filepath):
+            if self.checked_out.get(other_key, 0) > 0:
+                errmsg = "'%s' is in use with mode '%s'"
+                raise IOError, errmsg % other_key
+            self._closeManager(self.managers[other_key])
+            self._discard(other_key)
+            self.reopens += 1
+
+        self.misses += 1
+        manager = ManagerClass(filepath, mode)
+        self.addManager(manager, mode)
+        return manager
+
+    def addManager(self, manager, mode=None):
+        """ Adds an already open manager to the pool, it is checked out to
+        the caller until it is released.
+        """
+        if mode is None: mode = manager.hdf5_file_mode
+        key = poolKey(manager.getFilePath(), mode)
+        if key in self.managers:
+            if self.managers[key] is not manager:
+                self._closeManager(self.managers[key])
+            self._discard(key)
+        self._makeRoom()
+        self.managers[key] = manager
+        self._pin(key)
+
+    def releaseManager(self, manager):
+        """ Indicates that the caller is done with the manager for now. The
+        file stays open in the pool, but any pending changes are written
+        to disk and the manager may be evicted once nobody holds it.
+        """
+        key = self._keyForManager(manager)
+        if key is None: return False
+        count = self.checked_out.get(key, 0)
+        if count > 1: self.checked_out[key] = count - 1
+        else: self.checked_out.pop(key, None)
+        if key[1] == 'a' and manager.hdf5_file is not None:
+            manager.flushFile()
+        self._makeRoom(0)
+        return True
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def closeAll(self):
+        for manager in self.managers.values():
+            self._closeManager(manager)
+        self.managers.clear()
+        self.checked_out.clear()
+
+    def closeManager(self, filepath):
+        """ Closes the pooled managers for filepath in every mode.
+        """
+        for key in self._keysForPath(filepath):
+            self._closeManager(self.managers[key])
+            self._discard(key)
+
+    def flushAll(self):
+        for (path, mode), manager in self.managers.items():
+            if mode == 'a' and manager.hdf5_file is not None:
+                manager.flushFile()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.reopens = 0
+        self.evictions = 0
+
+    def statistics(self):
+        requests = self.hits + self.misses
+        if requests > 0: hit_rate = float(self.hits) / requests
+        else: hit_rate = 0.
+        return { 'hits' : self.hits, 'misses' : self.misses,
+                 'reopens' : self.reopens, 'evictions' : self.evictions,
+                 'open' : len(self.managers), 'max_open' : self.max_open,
+                 'checked_out' : len(self.checked_out),
+                 'hit_rate' : hit_rate,
+               }
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _closeManager(self, manager):
+        if manager.hdf5_file is not None: manager.closeFile()
+
+    def _discard(self, key):
+        del self.managers[key]
+        self.checked_out.pop(key, None)
+
+    def _keyForManager(self, manager):
+        for key in self._keysForPath(manager.getFilePath()):
+            if self.managers[key] is manager: return key
+        return None
+
+    def _keysForPath(self, filepath):
+        path = poolKey(filepath)
+        return [ key for key in self.managers.keys() if key[0] == path ]
+
+    def _makeRoom(self, needed=1):
+        """ Evicts unpinned managers, least recently used first, until
+        there is room for needed more managers or nothing can be evicted.
+        """
+        while len(self.managers) + needed > self.max_open:
+            for key in self.managers.keys():
+                if self.checked_out.get(key, 0) == 0: break
+            else: return
+            self._closeManager(self.managers[key])
+            self._discard(key)
+            self.evictions += 1
+
+    def _pin(self, key):
+        self.checked_out[key] = self.checked_out.get(key, 0) + 1
+
+    def _touch(self, key):
+        manager = self.managers.pop(key)
+        self.managers[key] = manager
@@ -0,0 +1,298 @@
+""" Compiled selection criteria for column oriented HDF5 data files.
+
+Criteria use the same formats accepted by rccpy.utils.data.dictToWhere and
+rccpy.utils.data.listToWhere. Instead of being rendered into an expression
+string and evaluated, they are parsed once into a tree of predicates that
+operate directly on NumPy arrays. Predicates are evaluated in order of
+expected selectivity and each one is only applied to the entries that
+survived the predicates before it.
+"""
+
+import operator
+
+import numpy as N
+
+from rccpy.utils.data import stringToBbox
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+OPERATORS = { '==' : operator.eq, '!=' : operator.ne,
+              '<'  : operator.lt, '<=' : operator.le,
+              '>'  : operator.gt, '>=' : operator.ge,
+              'eq' : operator.eq, 'ne' : operator.ne,
+              'lt' : operator.lt, 'le' : operator.le,
+              'gt' : operator.gt, 'ge' : operator.ge,
+            }
+
+FUNCTIONS = { 'N.isnan' : N.isnan, 'N.isinf' : N.isinf,
+              'N.isfinite' : N.isfinite,
+            }
+
+# rough estimates of the fraction of entries that pass each type of test,
+# used only to decide the order of evaluation
+SELECTIVITY = { 'equals' : 0.05, 'member' : 0.05, 'range' : 0.25,
+                'compare' : 0.5, 'function' : 0.5,
+              }
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def _asColumnValue(column, value):
+    """ Coerce a criteria value to the type of the column it is compared to.
+    """
+    kind = column.dtype.kind
+    if kind in 'SU':
+        if not isinstance(value, basestring): return str(value)
+        return value
+    if isinstance(value, basestring):
+        if kind in 'iu': return int(value)
+        if kind == 'f': return float(value)
+        if kind == 'b': return value.lower() in ('true','t','1','yes')
+    return value
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class Predicate(object):
+    """ Test applied to a single column.
+    """
+    kind = None
+
+    def __init__(self, key):
+        self.key = key
+
+    def keys(self):
+        return (self.key,)
+
+    def mask(self, column):
+        raise NotImplementedError
+
+    def selectivity(self):
+        return SELECTIVITY[self.kind]
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.describe())
+
+class EqualsPredicate(Predicate):
+    kind = 'equals'
+
+    def __init__(self, key, value):
+        Predicate.__init__(self, key)
+        self.value = value
+
+    def describe(self):
+        return '%s == %s' % (self.key, repr(self.value))
+
+    def mask(self, column):
+        return column == _asColumnValue(column, self.value)
+
+class MemberPredicate(Predicate):
+    kind = 'member'
+
+    def __init__(self, key, values):
+        Predicate.__init__(self, key)
+        self.values = tuple(values)
+
+    def describe(self):
+        return '%s in %s' % (self.key, repr(self.values))
+
+    def mask(self, column):
+        values = [_asColumnValue(column, value) for value in self.values]
+        if len(values) < 8:
+            mask = column == values[0]
+            for value in values[1:]: mask |= (column == value)
+            return mask
+        return N.in1d(column, N.array(values, dtype=column.dtype))
+
+    def selectivity(self):
+        return min(SELECTIVITY[self.kind] * len(self.values), 1.)
+
+class ComparePredicate(Predicate):
+    kind = 'compare'
+
+    def __init__(self, key, op, value):
+        Predicate.__init__(self, key)
+        if op not in OPERATORS:
+            raise ValueError, 'Unsupported comparison operator : %s' % op
+        self.op = op
+        self.value = value
+
+    def describe(self):
+        return '%s %s %s' % (self.key, self.op, repr(self.value))
+
+    def mask(self, column):
+        return OPERATORS[self.op](column, _asColumnValue(column, self.value))
+
+    def selectivity(self):
+        if self.op in ('==','eq'): return SELECTIVITY['equals']
+        if self.op in ('!=','ne'): return 1. - SELECTIVITY['equals']
+        return SELECTIVITY[self.kind]
+
+class RangePredicate(Predicate):
+    """ Inclusive range test : low <= column <= high
+    """
+    kind = 'range'
+
+    def __init__(self, key, low, high):
+        Predicate.__init__(self, key)
+        self.low = low
+        self.high = high
+
+    def describe(self):
+        return '%s <= %s <= %s' % (repr(self.low), self.key, repr(self.high))
+
+    def mask(self, column):
+        mask = column >= _asColumnValue(column, self.low)
+        mask &= column <= _asColumnValue(column, self.high)
+        return mask
+
+class FunctionPredicate(Predicate):
+    kind = 'function'
+
+    def __init__(self, key, function_name):
+        Predicate.__init__(self, key)
+        self.function_name = function_name
+        self.function = FUNCTIONS[function_name]
+
+    def describe(self):
+        return '%s(%s)' % (self.function_name, self.key)
+
+    def mask(self, column):
+        return self.function(column)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class CompiledQuery(object):
+    """ Conjunction of predicates. All predicates must be true for an entry
+    to be selected.
+    """
+
+    def __init__(self, predicates):
+        self.predicates = tuple(sorted(predicates,
+                                       key=lambda pred: pred.selectivity()))
+
+    def __len__(self):
+        return len(self.predicates)
+
+    def __repr__(self):
+        return 'CompiledQuery(%s)' % ' & '.join([pred.describe()
+                                                 for pred in self.predicates])
+
+    def keys(self):
+        keys = [ ]
+        for predicate in self.predicates:
+            for key in predicate.keys():
+                if key not in keys: keys.append(key)
+        return tuple(keys)
+
+    def indexes(self, getColumn):
+        """ Returns an array with the indexes of all entries that satisfy
+        the query. getColumn must be a callable that returns the full data
+        array for a column key.
+        """
+        indexes = None
+        for predicate in self.predicates:
+            column = getColumn(predicate.key)
+            if indexes is None:
+                indexes = N.flatnonzero(predicate.mask(column))
+            else:
+                indexes = indexes[predicate.mask(column[indexes])]
+            # no reason to look any further
+            if len(indexes) == 0: break
+        if indexes is None: return N.array([ ], dtype=int)
+        return indexes
+
+    def where(self, getColumn):
+        """ Returns indexes in the same form as N.where() """
+        return (self.indexes(getColumn),)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def _bboxPredicates(bbox):
+    if isinstance(bbox, basestring): bbox = stringToBbox(bbox)
+    return [ RangePredicate('lon', float(bbox[0]), float(bbox[2])),
+             RangePredicate('lat', float(bbox[1]), float(bbox[3])) ]
+
+def _dictPredicates(criteria):
+    predicates = [ ]
+    for key, constraint in criteria.items():
+        if constraint is None: continue
+
+        if key == 'bbox':
+            predicates.extend(_bboxPredicates(constraint))
+
+        elif isinstance(constraint, basestring):
+            if constraint in FUNCTIONS:
+                predicates.append(FunctionPredicate(key, constraint))
+            elif ',' in constraint:
+                values = [value.strip() for value in constraint.split(',')]
+                predicates.append(MemberPredicate(key, values))
+            else: predicates.append(EqualsPredicate(key, constraint))
+
+        elif isinstance(constraint, (tuple,list)):
+            if len(constraint) == 1:
+                value = constraint[0]
+                if value in FUNCTIONS:
+                    predicates.append(FunctionPredicate(key, value))
+                elif isinstance(value, basestring) and ',' in value:
+                    values = [_value.strip() for _value in value.split(',')]
+                    predicates.append(MemberPredicate(key, values))
+                else: predicates.append(EqualsPredicate(key, value))
+            elif len(constraint) in (2,3):
+                # third item is a format string, only needed by eval
+                predicates.append(ComparePredicate(key, constraint[0],
+                                                   constraint[1]))
+            else:
+                errmsg = 'Invalid constraint for %s : %s'
+                raise ValueError, errmsg % (key, str(constraint))
+
+        else: predicates.append(EqualsPredicate(key, constraint))
+
+    return predicates
+
+def _listPredicates(criteria):
+    predicates = [ ]
+    for constraint in criteria:
+        key = constraint[0]
+        if key == 'bbox':
+            predicates.extend(_bboxPredicates(constraint[1]))
+        elif len(constraint) == 2:
+            if constraint[1] in FUNCTIONS:
+                predicates.append(FunctionPredicate(key, constraint[1]))
+            else: predicates.append(EqualsPredicate(key, constraint[1]))
+        elif len(constraint) in (3,4):
+            predicates.append(ComparePredicate(key, constraint[1],
+                                               constraint[2]))
+        else:
+            raise ValueError, 'Invalid constraint : %s' % str(constraint)
+    return predicates
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+COMPILED_QUERIES = { }
+MAX_COMPILED_QUERIES = 256
+
+def _criteriaKey(criteria):
+    if isinstance(criteria, dict):
+        return ('dict', repr(sorted(criteria.items())))
+    return ('list', repr(tuple(criteria)))
+
+def compileCriteria(criteria):
+    """ Parses criteria in either dictionary or list format into a
+    CompiledQuery. Compiled queries are cached, so repeated searches with
+    the same criteria are only parsed once.
+    """
+    if isinstance(criteria, CompiledQuery): return criteria
+    key = _criteriaKey(criteria)
+    query = COMPILED_QUERIES.get(key, None)
+    if query is not None: return query
+
+    if isinstance(criteria, dict): query = CompiledQuery(_dictPredicates(criteria))
+    elif isinstance(criteria, (list,tuple)):
+        query = CompiledQuery(_listPredicates(criteria))
+    else:
+        errmsg = 'Invalid type for selection criteria : %s'
+        raise TypeError, errmsg % type(criteria)
+
+    if len(COMPILED_QUERIES) >= MAX_COMPILED_QUERIES: COMPILED_QUERIES.clear()
+    COMPILED_QUERIES[key] = query
+    return query
+
@@ -1,6 +1,6 @@
 """ Time Series datasets """
 
-import datetime
+from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 import numpy as N
@@ -8,9 +8,12 @@ import numpy as N
 from rccpy.utils.exceptutils import ShapeMismatchException
 from rccpy.utils.timeutils import asDatetime
 
-from .generators import dateArrayGenerator
+from .generators import calendarLookup, dateArrayGenerator, daysFromCivil
+from .generators import timeToEpoch
 from .indexers import timeIndexer
 from .iterators import timeIterator
+from .resample import periodAsTime, resampleArray
+from .windows import rollingStatistics, validMask, ROLLING_STATISTICS
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -30,6 +33,58 @@ def defaultMissingValue(dtype):
     elif dtype.kind == 'S': return ''
     else: return None
 
+def paddedWindow(data, start_index, end_index, missing, out=None,
+                 mask=False):
+    """ Returns the entries in data from start_index up to (not including)
+    end_index. Windows that are inside data are returned as a view. Windows
+    that extend before the start or past the end of data are filled with
+    the missing value and the available entries are copied in with a single
+    slice assignment. A preallocated array may be passed as out for the
+    padded windows, in which case the result is a view of out. When mask is
+    True, a boolean array that is True for valid (in bounds and not missing)
+    entries is also returned.
+    """
+    num_entries = end_index - start_index
+    if num_entries < 0:
+        errmsg = 'Window end index %d is before start index %d'
+        raise ValueError, errmsg % (end_index, start_index)
+    array_size = len(data)
+
+    if start_index >= 0 and end_index <= array_size:
+        window = data[start_index:end_index]
+    else:
+        if out is None: window = N.empty(num_entries, dtype=data.dtype)
+        elif len(out) < num_entries:
+            errmsg = 'Output array has %d entries, window needs %d'
+            raise ValueError, errmsg % (len(out), num_entries)
+        else: window = out[:num_entries]
+        window.fill(missing)
+        first = max(start_index, 0)
+        last = min(end_index, array_size)
+        if last > first:
+            window[first-start_index:last-start_index] = data[first:last]
+
+    if mask: return window, validMask(window, missing)
+    return window
+
+def isLeapYear(year):
+    return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+# calendar keys available for each frequency
+CALENDAR_KEYS = { 'hour' : ('year','month','day','day_of_year','hour'),
+                  'day' : ('year','month','day','day_of_year'),
+                  'month' : ('year','month'),
+                  'year' : ('year',),
+                }
+
+def groupRecord(groups, index):
+    """ Returns a statistics dictionary for a single group in the results
+    of TimeSeries.groupBy, in the same form as calcDataStatistics.
+    """
+    record = { }
+    for name, values in groups.items(): record[name] = values[index]
+    return record
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 class TimeSeries(object):
@@ -101,13 +156,6 @@ class TimeSeries(object):
                 elif isinstance(_time, (tuple,list)): return datetime(*_time)
                 else: return datetime( _time/1000000, (_time/10000) % 100,
                                        (_time/100) % 100, _time % 100 )
-            def _indexForTime(_time):
-                delta = asDatetime(_time) - self.base_time
-                hours = (delta.days * 24) + (delta.seconds / 3600)
-                indx = hours / interval
-                over = hours % interval
-                if over > 0: return indx + 1
-                else: return indx
             def _relativeDelta(hours): return relativedelta(hours=hours)
             def _timeAsString(_time): return _time.strftime('%Y-%m-%d:%H')
             def _timeAtIndex(indx):
@@ -119,11 +167,6 @@ class TimeSeries(object):
                 if isinstance(_time, (tuple,list)): return datetime(*_time)
                 else: return datetime( _time/10000, (_time/100) % 100,
                                        _time % 100 )
-            def _indexForTime(_time):
-                indx = (asDatetime(_time) - self.base_time).days / interval
-                over = (asDatetime(_time) - self.base_time).days % interval
-                if over > 0: return indx + 1
-                else: return indx
             def _relativeDelta(days): return relativedelta(days=days)
             def _timeAsString(_time): return _time.strftime('%Y-%m-%d')
             def _timeAtIndex(indx):
@@ -134,13 +177,6 @@ class TimeSeries(object):
                 if isinstance(_time, datetime): return _time
                 if isinstance(_time, (tuple,list)): return datetime(*_time)
                 else: return datetime( _time/100, _time % 100, 1 )
-            def _indexForTime(_time):
-                date_time = asDatetime(_time)
-                years = date_time.year - self.base_time.year
-                months = years * 12
-                if date_time.month != 12: months -= (12 - date_time.month)
-                if self.base_time.month != 1: months -= self.base_time.month - 1
-                return months
             def _relativeDelta(months): return relativedelta(months=months)
             def _timeAsString(_time): return _time.strftime('%Y-%m')
             def _timeAtIndex(indx):
@@ -151,8 +187,6 @@ class TimeSeries(object):
                 if isinstance(_time, datetime): return _time
                 if isinstance(_time, (tuple,list)): return datetime(*_time)
                 else: return datetime( _time/100, _time % 100, 1 )
-            def _indexForTime(_time):
-                return asDatetime(_time).year - self.base_time.year
             def _relativeDelta(years): return relativedelta(years=years)
             def _timeAsString(_time): return _time.strftime('%Y')
             def _timeAtIndex(indx):
@@ -162,7 +196,6 @@ class TimeSeries(object):
             raise KeyError, 'Unsupported data frequency : %s' % self.frequency
 
         self.asDatetime = _asDatetime
-        self.indexForTime = _indexForTime
         self.relativeDelta = _relativeDelta
         self.timeAsString = _timeAsString
         self.timeAtIndex = _timeAtIndex
@@ -172,7 +205,9 @@ class TimeSeries(object):
 
         self.indexer = timeIndexer(self.frequency, self.base_time,
                                    self.data_interval)
+        self.indexForTime = self.indexer.index
         self.generator = dateArrayGenerator(self.frequency)
+        self.calendar_keys = { }
 
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
@@ -184,12 +219,148 @@ class TimeSeries(object):
         return self.generator(start_time, end_time, interval=interval,
                               as_numpy=True, date_format=date_format)
 
+    def getCalendarKey(self, key_name):
+        """ Returns an array with the value of a calendar key ('year',
+        'month', 'day', 'day_of_year' or 'hour') for every entry in the time
+        series. Keys are computed once, when they are first requested.
+
+        'day_of_year' always has 366 days : Feb 29 is day 60 and Mar 1 is
+        day 61 in both leap and non-leap years, so the same calendar day
+        falls in the same group every year.
+        """
+        keys = self.calendar_keys.get(key_name, None)
+        if keys is None:
+            if key_name not in CALENDAR_KEYS[self.frequency]:
+                errmsg = "'%s' calendar key is not available for '%s' data"
+                raise KeyError, errmsg % (key_name, self.frequency)
+            self._calcCalendarKeys()
+            keys = self.calendar_keys[key_name]
+        return keys
+
+    def groupBy(self, *key_names):
+        """ Calculates statistics for groups of entries that have the same
+        calendar key values, e.g. groupBy('month') or groupBy('day_of_year',
+        'hour'). Returns a dictionary with an array for each key name with
+        the key values of the groups, and arrays with the coverage, missing,
+        min, max, mean, stddev and median of the valid values in each group.
+        All groups are calculated with a single sort. Groups without any
+        valid values get the same statistics as _calcArrayStatistics gives
+        an all-missing array (coverage is the number of entries).
+        """
+        if not key_names:
+            raise ValueError, 'At least one calendar key is required.'
+        keys = [self.getCalendarKey(name).astype(int) for name in key_names]
+        combined = keys[0].copy()
+        for key in keys[1:]: combined = (combined * (key.max() + 1)) + key
+
+        data = self.data[:]
+        valid = self._validMask(data, self.missing_value)
+        values = N.where(valid, data, 0)
+        # groups in key order, valid values first and in ascending order
+        order = N.lexsort((values, ~valid, combined))
+        combined = combined[order]
+        values = values[order]
+        valid = valid[order]
+
+        starts = N.concatenate(([0], N.flatnonzero(N.diff(combined)) + 1))
+        totals = N.diff(N.concatenate((starts, [len(combined)])))
+        coverage = N.add.reduceat(valid.astype(int), starts)
+        have_data = coverage > 0
+        safe_coverage = N.where(have_data, coverage, 1)
+
+        mean = N.add.reduceat(N.where(valid, values, 0.), starts) \
+             / safe_coverage
+        deviation = N.where(valid, values - N.repeat(mean, totals), 0.)
+        stddev = N.sqrt(N.add.reduceat(deviation * deviation, starts)
+                        / safe_coverage)
+
+        last = starts + safe_coverage - 1
+        lower = starts + ((safe_coverage - 1) // 2)
+        upper = starts + (safe_coverage // 2)
+        median = (values[lower] + values[upper]) / 2.
+
+        missing = self.missing_value
+        groups = { 'coverage' : N.where(have_data, coverage, totals),
+                   'missing' : totals - coverage,
+                   'min' : N.where(have_data, values[starts], missing),
+                   'max' : N.where(have_data, values[last], missing),
+                   'mean' : N.where(have_data, mean, missing),
+                   'stddev' : N.where(have_data, stddev, 0.),
+                   'median' : N.where(have_data, median, missing),
+                 }
+        for name, key in zip(key_names, keys):
+            groups[name] = key[order][starts]
+        return groups
+
+    def getRollingStatistics(self, width, center=False, min_count=1,
+                                   statistics=ROLLING_STATISTICS):
+        """ Returns a dictionary of arrays with statistics for a window of
+        `width` entries around every entry in the time series. See
+        rollingStatistics in rccpy.timeseries.windows.
+        """
+        return rollingStatistics(self.data[:], width, self.missing_value,
+                                 center, min_count, statistics)
+
+    def resample(self, frequency='day', reducer=None, day_start_hour=0,
+                       min_coverage=0.):
+        """ Returns a new TimeSeries with the data reduced to days or months,
+        e.g. resample('day', 'sum', 8) for daily totals of an observation day
+        that starts at 8 AM. reducer is one of the names in RESAMPLE_REDUCERS,
+        the default is 'vector_mean' for direction data and 'mean' for all
+        others. When reducer is a tuple/list of names, a dictionary with a
+        TimeSeries for each one is returned. Periods where the fraction of
+        valid entries is below min_coverage are missing.
+        """
+        if reducer is None:
+            if self.value_type == 'direction': reducer = 'vector_mean'
+            else: reducer = 'mean'
+        if self.data_type is float: missing = self.missing_value
+        else: missing = defaultMissingValue(N.dtype(float))
+
+        if isinstance(reducer, (tuple,list)):
+            resampled = { }
+            for name in reducer:
+                resampled[name] = self.resample(frequency, name,
+                                                day_start_hour, min_coverage)
+            return resampled
+
+        first_period, result, coverage = \
+            resampleArray(self.data[:], self.frequency, self.base_time,
+                          self.data_interval, self.missing_value, frequency,
+                          reducer, day_start_hour, min_coverage, fill=missing)
+        attrs = self._attributes()
+        attrs.update(frequency=frequency, interval=1, missing_value=missing)
+        # sums and counts are not limited to the range of the entries
+        if reducer in ('count','sum'): del attrs['value_type']
+        return TimeSeries(self.data_name, periodAsTime(frequency,first_period),
+                          result, **attrs)
+
+    def withBaseTime(self, base_time):
+        """ Returns a new TimeSeries that shares the data, but the first
+        entry is at base_time, e.g. to move an hourly time series from local
+        standard time to UTC (see rccpy.timeseries.timezones).
+        """
+        return TimeSeries(self.data_name, base_time, self.data,
+                          **self._attributes())
+
     def getIndexes(self, start_time, end_time):
         """ returns tuple containing index of start_time and index of end_time
         """
         _start_time, _end_time = self._validTimes(start_time, end_time)
         return self.indexer(_start_time, _end_time)
 
+    def getIndexesForTimes(self, times):
+        """ returns an array with the index of each time in an array or
+        sequence of times (integer dates, date tuples, datetimes, etc.)
+        """
+        return self.indexer.indexes(times)
+
+    def getTimesAtIndexes(self, indexes, date_format=None):
+        """ returns an array with the time at each index in an array of
+        indexes, in any of the formats supported by getDates
+        """
+        return self.indexer.timesAtIndexes(indexes, date_format)
+
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
     def getData(self, start_time=None, end_time=None):
@@ -197,11 +368,21 @@ class TimeSeries(object):
         return self._getData(self.data, self.missing_value, start_index,
                              end_index)
 
+    def getPaddedData(self, start_time=None, end_time=None, out=None,
+                            mask=False):
+        """ Same as getData, but always returns an array and the window may
+        be filled into a preallocated out array when it has to be padded.
+        See paddedWindow.
+        """
+        start_index, last_index = self.getIndexes(start_time, end_time)
+        return paddedWindow(self.data, start_index, last_index+1,
+                            self.missing_value, out, mask)
+
     def calcDataStatistics(self, start_time=None, end_time=None):
         if start_time is None or start_time == ':'\
         and end_time is None or end_time == ':':
             # calculate stats for entire dataset
-            return self._calcArrayStatistics(self.data, self.missing_value)
+            return self._calcArrayStatistics(self.data[:], self.missing_value)
         # calculate stats for some subset of data
         start, end = self.getIndexes(start_time, end_time)
         return self._calcArrayStatistics( self._getData(self.data,
@@ -222,6 +403,45 @@ class TimeSeries(object):
         return TimeSeriesDataIterator(self, _start_time, _end_time, interval,
                                             duration)
 
+    def getBlockIterator(self, start_time=None, end_time=None, interval=None,
+                               duration=None):
+        _start_time, _end_time = self._validTimes(start_time, end_time)
+        return TimeSeriesBlockIterator(self, _start_time, _end_time, interval,
+                                             duration)
+
+    def getIntervalIndexes(self, start_time=None, end_time=None,
+                                 interval=None, duration=None):
+        """ Returns arrays with the start index and last index of every
+        interval that getIndexer would step through. Integer intervals and
+        durations are computed directly from the epoch times, calendar
+        intervals (e.g. 'month') are stepped through once.
+        """
+        iter_start, iter_end = self._validTimes(start_time, end_time)
+        if interval is None: interval = self.data_interval
+        if duration is None: duration = self.data_interval
+        indexer = self.indexer
+
+        if self.frequency in ('hour','day') and isinstance(interval, int) \
+        and isinstance(duration, int):
+            first = timeToEpoch(self.frequency, iter_start)
+            last = timeToEpoch(self.frequency, iter_end)
+            if first > last:
+                errmsg = 'Interval start time (%s) is later than interval '
+                errmsg += 'end time (%s)'
+                raise ValueError, errmsg % (str(iter_start), str(iter_end))
+            ends = N.arange(first, last+1, interval, dtype='i8')
+            interval_ends = -((indexer.base_epoch - ends) // indexer.interval)
+            starts = ends - (duration - 1)
+            interval_starts = \
+                -((indexer.base_epoch - starts) // indexer.interval)
+            return interval_starts, interval_ends
+
+        iterator = timeIterator(self.frequency, iter_start, iter_end, interval,
+                                duration)
+        intervals = list(iterator)
+        return (indexer.indexes([times[0] for times in intervals]),
+                indexer.indexes([times[1] for times in intervals]))
+
     # - - - - - - - - - - - - - - - - - -  - - - - - - - - - - - - - - - - - -
 
     def getSequenceDetector(self):
@@ -273,52 +493,49 @@ class TimeSeries(object):
                           }
         return statistics
 
+    def _attributes(self):
+        return { 'description' : self.description,
+                 'frequency' : self.frequency, 'interval' : self.data_interval,
+                 'missing_value' : self.missing_value, 'units' : self.units,
+                 'value_type' : (self.value_type, self.lower_limit,
+                                 self.upper_limit), }
+
+    def _calcCalendarKeys(self):
+        base = self.base_time
+        count = len(self.data)
+        steps = N.arange(count, dtype='i8') * self.data_interval
+        keys = { }
+        if self.frequency in ('hour','day'):
+            base_day = int(daysFromCivil(base.year, base.month, base.day))
+            if self.frequency == 'hour':
+                hours = (base_day * 24) + base.hour + steps
+                days, keys['hour'] = divmod(hours, 24)
+            else: days = base_day + steps
+            year, month, day = calendarLookup(days)
+            year = year.astype(int)
+            day_of_year = days - daysFromCivil(year, 1, 1) + 1
+            day_of_year += (month > 2) & ~isLeapYear(year)
+            keys.update(year=year, month=month, day=day,
+                        day_of_year=day_of_year)
+        elif self.frequency == 'month':
+            months = (base.year * 12) + base.month - 1 + steps
+            keys['year'], keys['month'] = divmod(months, 12)
+            keys['month'] += 1
+        else: keys['year'] = base.year + steps
+        self.calendar_keys.update(keys)
+
+    def _validMask(self, numpy_array, missing):
+        if N.isfinite(missing):
+            valid = numpy_array != missing
+            if numpy_array.dtype.kind == 'f':
+                valid &= N.isfinite(numpy_array)
+            return valid
+        return N.isfinite(numpy_array)
+
     def _getData(self, _array, missing, start_index, last_index):
-        array_size = _array.size
-        dtype = _array.dtype
-
-        if start_index < 0:
-            if last_index == start_index:
-                return N.array([missing,])
-            elif last_index < 0:
-                too_early = (last_index - 1) - start_index
-                return N.array([missing for m in range(too_early)],
-                                dtype=dtype)
-            else:
-                end_index = last_index+1
-                data = [missing for m in range(abs(start_index))]
-                if end_index < array_size:
-                    data.extend(list(_array[0:end_index]))
-                else:
-                    data.extend(list(_array[:]))
-                    if end_index > array_size:
-                        overflow = end_index - array_size 
-                        data.extend([missing for m in range(overflow)])
-                return N.array(data, dtype=dtype)
-
-        elif start_index < array_size:
-            if last_index == start_index:
-                return _array[start_index]
-            else:
-                end_index = last_index+1
-                if end_index < array_size:
-                    return _array[start_index:end_index]
-                elif end_index == array_size:
-                    return _array[start_index:]
-                else: # end_index > array_size
-                    print 'end_index > array_size', end_index, array_size
-                    data = list(_array[start_index:])
-                    overflow = end_index - array_size
-                    data.extend([missing for m in range(overflow)])
-                    return N.array(data, dtype=dtype)
-
-        else: # start_index is beyond end of available data
-            end_index = last_index+1
-            msg = 'start_index is beyond end of available data'
-            print msg, start_index, array_size
-            over_the_top = end_index - start_index
-            return N.array([missing for m in range(over_the_top)],
-                            dtype=dtype)
+        if start_index == last_index and 0 <= start_index < len(_array):
+            return _array[start_index]
+        return paddedWindow(_array, start_index, last_index+1, missing)
 
     def _validTimes(self, start_time, end_time):
         """ returns tuple containing index of start_time and index of end_time
@@ -387,3 +604,49 @@ class TimeSeriesDataIterator(object):
         self.latest_interval = self.iterator.next()
         return self.time_series.getData(*self.latest_interval)
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class TimeSeriesBlockIterator(object):
+
+    def __init__(self, time_series, start_time=None, end_time=None,
+                       interval=None, duration=None):
+        """ Iterates through the same intervals as TimeSeriesDataIterator,
+        but the indexes of every interval are computed up front. Intervals
+        that are inside the data array are returned as views of the array.
+        Intervals that overrun either end are copied into a single buffer
+        that is filled with the missing value, so the data returned must be
+        copied if it is needed after the next step.
+        """
+        self.data = time_series.data
+        self.missing_value = time_series.missing_value
+        self.start_indexes, self.last_indexes = \
+            time_series.getIntervalIndexes(start_time, end_time, interval,
+                                           duration)
+
+        overrun = (self.start_indexes < 0) \
+                | (self.last_indexes >= len(self.data))
+        if overrun.any():
+            lengths = self.last_indexes - self.start_indexes + 1
+            self.buffer = N.empty(int(lengths[overrun].max()),
+                                  dtype=self.data.dtype)
+        else: self.buffer = None
+
+        self.position = 0
+        self.latest_indexes = None
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        return len(self.start_indexes)
+
+    def next(self):
+        position = self.position
+        if position >= len(self.start_indexes): raise StopIteration
+        self.position += 1
+
+        start_index = int(self.start_indexes[position])
+        last_index = int(self.last_indexes[position])
+        self.latest_indexes = (start_index, last_index)
+        return paddedWindow(self.data, start_index, last_index+1,
+                            self.missing_value, self.buffer)
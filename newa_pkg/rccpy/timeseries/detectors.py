@@ -1,28 +1,23 @@
 
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-
 import numpy as N
 
 from rccpy.analysis.base import BaseDetector
-from rccpy.analysis.sequence import SequenceDetector
+from rccpy.analysis.results import DetectorResults
+from rccpy.analysis.sequence import SequenceDetector, sortedRuns
 from rccpy.analysis.spike import SpikeDetector, CircularAngleSpikeDetector
+from rccpy.analysis.spike import sortedSpikes
 
 from rccpy.utils.timeutils import asDatetime
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-LAST_DAY_OF_MONTH = (31,28,31,30,31,30,31,31,30,31,30,31)
-ONE_MONTH = relativedelta(months=1)
-
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-
 class TimeSeriesDetectorMixin:
 
-    def __call__(self, start_time=None, end_time=None, filters=None):
+    def __call__(self, start_time=None, end_time=None, filters=None,
+                       chunk_size=None):
         """ Wrapper for a required sequence of steps
         """
-        self.detected = self.detect(start_time, end_time)
+        self.detected = self.detect(start_time, end_time, chunk_size)
         self.filters = filters
         if filters is not None: self.filter_groups = self.applyFilters(filters)
         else: self.filter_groups = None
@@ -36,22 +31,43 @@ class TimeSeriesDetectorMixin:
     def timeAsString(self, time_): return self.time_series.timeAsString(time_)
     def timeAtIndex(self, indx):   return self.time_series.timeAtIndex(indx)
 
+    def _asResults(self, detected):
+        """ Filter groups may be empty tuples, use an empty result on the
+        time axis for them.
+        """
+        if isinstance(detected, DetectorResults): return detected
+        return self._results(N.empty(0, dtype=self.detected.dtype))
+
+    def _setTimeSeries(self, time_series):
+        self.base_time = time_series.base_time
+        self.data = time_series.data
+        self.frequency = time_series.frequency
+        self.last_time = time_series.last_time
+        self.time_series = time_series
+        self.time_axis = (time_series.frequency, time_series.base_time,
+                          time_series.data_interval)
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def detect(self, start_time=None, end_time=None):
+    def detect(self, start_time=None, end_time=None, chunk_size=None):
+        """ Detects in the data between start_time and end_time. When
+        chunk_size is given, the data is read and processed chunk_size
+        entries at a time, which gives the same results.
+        """
         if start_time is None: start_index = 0
         else: start_index = self.indexForTime(self.asDatetime(start_time))
 
         if end_time is None: end_index = len(self.data)
         else: end_index = self.indexForTime(self.asDatetime(end_time))
 
-        if self.data_type == int:
-            data_array = self.data
-            data_array[N.where(N.isinf(data_array))] = self.missing_value
-            data_array[N.where(N.isnan(data_array))] = self.missing_value
-            return self._detect(N.array(data_array, dtype=int), start_index,
-                                end_index)
+        if chunk_size is not None:
+            return self.detectInChunks(self.data, chunk_size, start_index,
+                                       end_index)
+        if self.data_type == int and self.data.dtype.kind == 'f':
+            return self._detect(self._detectArray(self.data, True),
+                                start_index, end_index)
         else:
+            # integer and lazy (disk backed) data are used as they are
             return self._detect(self.data, start_index, end_index)
 
 
@@ -65,55 +81,38 @@ class TimeSeriesSequenceDetector(TimeSeriesDetectorMixin, SequenceDetector):
     def __init__(self, time_series, tolerance=N.inf):
         SequenceDetector.__init__(self, time_series.data_type, 
                                   time_series.missing_value, tolerance)
-        self.base_time = time_series.base_time
-        self.data = time_series.data
-        self.frequency = time_series.frequency
-        self.last_time = time_series.last_time
-        self.time_series = time_series
+        self._setTimeSeries(time_series)
 
     def _calcStatsByMonth(self, sequences):
+        """ Statistics for the runs in each month of the year, a run is
+        included in every month that it spans.
+        """
         if self.frequency not in ('hour','day'):
             errmsg = '`%s` frequency not supported by _calcStatsByMonth()'
             raise ValueError, errmsg % self.frequency
-
-        sequences_by_month = [ [ ] for month in range(12) ]
-        for run in sequences:
-            diff_2_1 = self.relativeDelta((run[2]-run[1])+1)
-            start_time = self.base_time + diff_2_1
-            sequences_by_month[start_time.month-1].append(run)
-            
-            end_time = self.timeAtIndex(run[2])
-            if (end_time.month > start_time.month or
-                end_time.year > start_time.year):
-
-                end_date = datetime(end_time.year, end_time.month,
-                                    LAST_DAY_OF_MONTH[end_time.month-1],23)
-                date = start_time + ONE_MONTH
-                while date < end_date:
-                    sequences_by_month[date.month-1].append(run)
-                    date += ONE_MONTH
-
-        return tuple( [ self._calcStatistics(runs)
-                        for runs in sequences_by_month ] )
+        sequences = self._asResults(sequences)
+        end_indexes = sequences['end_index']
+        start_indexes = (end_indexes - sequences['count']) + 1
+        runs_by_month = sequences.groupByMonth(start_indexes, end_indexes)
+        return tuple( [ self._calcStatistics(runs) for runs in runs_by_month ] )
 
     def _reportSequences(self, sequences, spacer='    '):
         fmt = self.REPORT_FORMAT % (spacer,self.frequency)
-        sequences.sort(key=lambda x:x[2])
-        for run in sequences:
-            start_time = self.timeAtIndex((run[2]-run[1])+1)
-            end_time = self.timeAtIndex(run[2])
-            print fmt % (run[1], self.timeAsString(start_time),
-                         self.timeAsString(end_time), run[2], run[0])
+        for line in self._sequenceLines(fmt, sequences):
+            print line
 
     def _saveSequences(self, output_file, sequences, spacer='    '):
         fmt = self.SAVE_FORMAT % (spacer, self.frequency)
-        for run in sequences:
-            start_time = self.timeAtIndex((run[2]-run[1])+1)
-            end_time = self.timeAtIndex(run[2])
-            line = fmt % (run[1], self.timeAsString(start_time),
-                          self.timeAsString(end_time), run[2], run[0])
+        for line in self._sequenceLines(fmt, sequences):
             output_file.write(line)
 
+    def _sequenceLines(self, fmt, sequences):
+        for value, count, end_index in sortedRuns(sequences):
+            start_time = self.timeAtIndex((end_index-count)+1)
+            end_time = self.timeAtIndex(end_index)
+            yield fmt % (count, self.timeAsString(start_time),
+                         self.timeAsString(end_time), end_index, value)
+
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -126,34 +125,26 @@ class SpikeDetectorMixin:
         if self.frequency not in ('hour','day'):
             errmsg = '`%s` frequency not supported by _calcStatsByMonth()'
             raise ValueError, errmsg % self.frequency
-
-        spikes_by_month = [ [ ] for month in range(12) ]
-        for spike in spikes:
-            spike_time = self.timeAtIndex(spike[1])
-            spikes_by_month[spike_time.month-1].append(spike)
-
-        return tuple( [ self._calcStatistics(spikes)
-                        for spikes in spikes_by_month ] )
+        spikes = self._asResults(spikes)
+        return tuple( [ self._calcStatistics(spikes_in_month) for
+                        spikes_in_month in spikes.groupByMonth('index') ] )
 
     def _reportSpikes(self, spikes, spacer='    '):
         fmt = self.REPORT_FORMAT % spacer
-        if isinstance(spikes, tuple): spikes = list(spikes)
-        spikes.sort(key=lambda x:x[1])
-        for spike in spikes:
-            spike_time = self.base_time + self.relativeDelta(spike[1])
-            print fmt % (self.timeAsString(spike_time),spike[1],spike[0][0],
-                         spike[0][1],spike[2])
+        for line in self._spikeLines(fmt, spikes):
+            print line
 
     def _saveSpikes(self, output_file, spikes, spacer='    '):
         fmt = self.SAVE_FORMAT % spacer
-        if isinstance(spikes, tuple): spikes = list(spikes)
-        spikes.sort(key=lambda x:x[1])
-        for spike in spikes:
-            spike_time = self.base_time + self.relativeDelta(spike[1])
-            line = fmt % (self.timeAsString(spike_time),spike[1],spike[0][0],
-                          spike[0][1],spike[2])
+        for line in self._spikeLines(fmt, spikes):
             output_file.write(line)
 
+    def _spikeLines(self, fmt, spikes):
+        for leg_1, leg_2, index, value in sortedSpikes(spikes):
+            spike_time = self.timeAtIndex(index)
+            yield fmt % (self.timeAsString(spike_time), index, leg_1, leg_2,
+                         value)
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 class SimpleTimeSeriesSpikeDetector(TimeSeriesDetectorMixin, SpikeDetectorMixin,
@@ -162,11 +153,7 @@ class SimpleTimeSeriesSpikeDetector(TimeSeriesDetectorMixin, SpikeDetectorMixin,
     def __init__(self, time_series, tolerance=N.inf):
         SpikeDetector.__init__(self, time_series.data_type, 
                                      time_series.missing_value)
-        self.base_time = time_series.base_time
-        self.data = time_series.data
-        self.frequency = time_series.frequency
-        self.last_time = time_series.last_time
-        self.time_series = time_series
+        self._setTimeSeries(time_series)
 
 class CircAngTimeSeriesSpikeDetector(TimeSeriesDetectorMixin,
                                      SpikeDetectorMixin,
@@ -175,11 +162,7 @@ class CircAngTimeSeriesSpikeDetector(TimeSeriesDetectorMixin,
     def __init__(self, time_series, tolerance=N.inf):
         SpikeDetector.__init__(self, time_series.data_type, 
                                      time_series.missing_value)
-        self.base_time = time_series.base_time
-        self.data = time_series.data
-        self.frequency = time_series.frequency
-        self.last_time = time_series.last_time
-        self.time_series = time_series
+        self._setTimeSeries(time_series)
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
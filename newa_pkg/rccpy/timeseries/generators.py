@@ -1,6 +1,5 @@
 
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 import numpy as N
 
@@ -9,173 +8,369 @@ from rccpy.utils.timeutils import asDatetime
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 DATE_ARRAY_GENERATORS = { }
+DATE_FORMATTERS = { }
 DATE_STRING_FORMATS = { 'hour' : '%Y-%m-%d-%H', 'day' : '%Y-%m-%d',
                         'month' : '%Y-%m', 'year' : '%Y' }
 
+# day number of 1970-01-01 in the civil day count used below
+EPOCH_DAY = 719468
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# integer civil calendar arithmetic (proleptic Gregorian calendar)
+# days are counted from 1970-01-01, so they can be used as datetime64[D]
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def daysFromCivil(year, month, day):
+    """ Returns the number of days since 1970-01-01 for each date. Works on
+    scalars or numpy arrays.
+    """
+    year = N.asarray(year, dtype='i8') - (N.asarray(month) <= 2)
+    era = N.floor_divide(year, 400)
+    year_of_era = year - (era * 400)
+    month = N.asarray(month, dtype='i8')
+    day_of_year = ((153 * (month + N.where(month > 2, -3, 9)) + 2) // 5) \
+                + N.asarray(day, dtype='i8') - 1
+    day_of_era = (year_of_era * 365) + (year_of_era // 4) \
+               - (year_of_era // 100) + day_of_year
+    return (era * 146097) + day_of_era - EPOCH_DAY
+
+def civilFromDays(days):
+    """ Returns (year, month, day) arrays for days since 1970-01-01.
+    """
+    days = N.asarray(days, dtype='i8') + EPOCH_DAY
+    era = N.floor_divide(days, 146097)
+    day_of_era = days - (era * 146097)
+    year_of_era = (day_of_era - (day_of_era // 1460) + (day_of_era // 36524)
+                   - (day_of_era // 146096)) // 365
+    day_of_year = day_of_era - ((365 * year_of_era) + (year_of_era // 4)
+                                - (year_of_era // 100))
+    mp = ((5 * day_of_year) + 2) // 153
+    day = day_of_year - (((153 * mp) + 2) // 5) + 1
+    month = mp + N.where(mp < 10, 3, -9)
+    year = year_of_era + (era * 400) + (month <= 2)
+    return year, month, day
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+# cached (year, month, day) for every day in a range of whole years
+CALENDAR_TABLE = { 'first_day' : None, 'last_day' : None, 'table' : None }
+
+def calendarLookup(days):
+    """ Returns (year, month, day) arrays for days since 1970-01-01 using a
+    cached lookup table. The table covers whole years and is only rebuilt
+    when days fall outside of it.
+    """
+    days = N.asarray(days, dtype='i8')
+    if len(days) == 0:
+        empty = N.array([ ], dtype='i8')
+        return empty, empty, empty
+    first_day = int(days.min())
+    last_day = int(days.max())
+
+    cached_first = CALENDAR_TABLE['first_day']
+    if cached_first is None or first_day < cached_first \
+    or last_day > CALENDAR_TABLE['last_day']:
+        if cached_first is not None:
+            first_day = min(first_day, cached_first)
+            last_day = max(last_day, CALENDAR_TABLE['last_day'])
+        first_year = int(civilFromDays(first_day)[0])
+        last_year = int(civilFromDays(last_day)[0])
+        first_day = int(daysFromCivil(first_year, 1, 1))
+        last_day = int(daysFromCivil(last_year, 12, 31))
+        year, month, day = civilFromDays(N.arange(first_day, last_day+1))
+        table = N.empty((3, len(year)), dtype='i2')
+        table[0] = year
+        table[1] = month
+        table[2] = day
+        CALENDAR_TABLE.update(first_day=first_day, last_day=last_day,
+                              table=table)
+
+    table = CALENDAR_TABLE['table'][:, days - CALENDAR_TABLE['first_day']]
+    return table[0], table[1], table[2]
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# integer epoch times : hours, days, months or years since 1970-01-01T00
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def civilDay(year, month, day):
+    """ Same as daysFromCivil for a single date, using Python integers.
+    """
+    if month <= 2: year -= 1
+    era = year // 400
+    year_of_era = year - (era * 400)
+    if month > 2: day_of_year = ((153 * (month - 3) + 2) // 5) + day - 1
+    else: day_of_year = ((153 * (month + 9) + 2) // 5) + day - 1
+    day_of_era = (year_of_era * 365) + (year_of_era // 4) \
+               - (year_of_era // 100) + day_of_year
+    return (era * 146097) + day_of_era - EPOCH_DAY
+
+def timeParts(date):
+    """ Returns (year, month, day, hour) for a datetime, a date tuple or
+    list, an integer date (YYYYMMDDHH, YYYYMMDD, YYYYMM or YYYY) or a date
+    string.
+    """
+    if isinstance(date, datetime):
+        return date.year, date.month, date.day, date.hour
+    if isinstance(date, (int,long,N.integer)):
+        date = int(date)
+        if date > 1000000000: # YYYYMMDDHH
+            return (date/1000000, (date/10000) % 100, (date/100) % 100,
+                    date % 100)
+        elif date > 10000000: # YYYYMMDD
+            return (date/10000, (date/100) % 100, date % 100, 0)
+        elif date > 100000: # YYYYMM
+            return (date/100, date % 100, 1, 0)
+        elif date < 10000: # YYYY
+            return (date, 1, 1, 0)
+    elif isinstance(date, N.void): date = date.tolist()
+    if isinstance(date, (tuple,list)) and len(date) > 1:
+        date = [int(part) for part in date[:4]]
+        if len(date) == 2: return date[0], date[1], 1, 0
+        if len(date) == 3: return date[0], date[1], date[2], 0
+        return tuple(date)
+    date = asDatetime(date)
+    return date.year, date.month, date.day, date.hour
+
+def timeToEpoch(frequency, date):
+    """ Returns the number of frequency units ('hour', 'day', 'month' or
+    'year') between 1970-01-01T00 and a single date.
+    """
+    year, month, day, hour = timeParts(date)
+    if frequency == 'hour': return (civilDay(year, month, day) * 24) + hour
+    elif frequency == 'day': return civilDay(year, month, day)
+    elif frequency == 'month': return ((year - 1970) * 12) + month - 1
+    elif frequency == 'year': return year - 1970
+    raise ValueError, 'No epoch for %s frequency' % frequency
+
+def timesToEpochs(frequency, dates):
+    """ Array version of timeToEpoch. dates may be an array of integer
+    dates, an array of date tuples (structured or 2D), a datetime64 array or
+    a sequence of any of the dates accepted by timeToEpoch.
+    """
+    if not isinstance(dates, N.ndarray):
+        return N.array([timeToEpoch(frequency, date) for date in dates],
+                       dtype='i8')
+
+    if dates.dtype.kind == 'M':
+        unit = { 'hour':'h', 'day':'D', 'month':'M', 'year':'Y' }[frequency]
+        return dates.astype('datetime64[%s]' % unit).astype('i8')
+
+    if dates.dtype.names:
+        fields = [dates[name] for name in dates.dtype.names[:4]]
+    elif dates.dtype.kind in 'iu' and dates.ndim == 2:
+        fields = [dates[:,indx] for indx in range(min(dates.shape[1],4))]
+    elif dates.dtype.kind in 'iu':
+        dates = dates.astype('i8')
+        hourly = dates > 1000000000
+        daily = dates > 10000000
+        scale = N.where(hourly, 100, 1)
+        ymd = N.where(daily, dates // scale, (dates * 100) + 1)
+        fields = [ymd // 10000, (ymd // 100) % 100, ymd % 100,
+                  N.where(hourly, dates % 100, 0)]
+    else:
+        return N.array([timeToEpoch(frequency, date) for date in dates],
+                       dtype='i8')
+
+    fields = [N.asarray(field, dtype='i8') for field in fields]
+    year, month = fields[:2]
+    if frequency == 'year': return year - 1970
+    if frequency == 'month': return ((year - 1970) * 12) + month - 1
+    if len(fields) > 2: day = fields[2]
+    else: day = N.ones_like(year)
+    days = daysFromCivil(year, month, day)
+    if frequency == 'day': return days
+    if frequency == 'hour':
+        if len(fields) > 3: return (days * 24) + fields[3]
+        return days * 24
+    raise ValueError, 'No epoch for %s frequency' % frequency
+
+def epochsToTimes(frequency, epochs, date_format=None, as_numpy=True):
+    """ Converts an array of epoch times to any of the date formats
+    supported by the date array generators.
+    """
+    formatter = DATE_FORMATTERS.get(frequency)
+    if formatter is None:
+        raise ValueError, 'No date formatter for %s frequency' % frequency
+    return formatter(N.asarray(epochs, dtype='i8'), date_format, as_numpy)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _asStrings(fields, widths, separator, date_format, datetimes):
+    """ Builds date strings from integer fields. Standard formats are built
+    directly from the integers, any other format needs datetime objects.
+    """
+    if len(fields[0]) == 0: return N.array([ ], dtype='|S1')
+    if date_format is None:
+        strings = N.char.mod('%%0%dd' % widths[0], fields[0])
+        for field, width in zip(fields[1:], widths[1:]):
+            strings = N.char.add(N.char.add(strings, separator),
+                                 N.char.mod('%%0%dd' % width, field))
+        return strings
+    return N.array([date.strftime(date_format) for date in datetimes()])
+
+def _asResult(dates, as_numpy):
+    if as_numpy: return dates
+    if isinstance(dates, N.ndarray):
+        if dates.dtype.names: return tuple([tuple(date) for date in dates])
+        return tuple(dates.tolist())
+    return tuple(dates)
+
+def _tupleArray(names, fields):
+    dtype = N.dtype( { 'names':names, 'formats':['i2'] * len(names) } )
+    dates = N.empty(len(fields[0]), dtype=dtype)
+    for name, field in zip(names, fields): dates[name] = field
+    return dates
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 def generateHoursArray(start_hour, end_hour, **kwargs):
-    first_hour = asDatetime(start_hour)
-    last_hour = asDatetime(end_hour)
-    interval = relativedelta(hours=int(kwargs.get('interval',1)))
+    interval = int(kwargs.get('interval',1))
     date_format = kwargs.get('date_format', None)
     as_numpy = kwargs.get('as_numpy', True)
 
-    hours = [ ]
-    hour = first_hour
-    if date_format in (datetime,object,'object'):
-        while hour <= last_hour:
-            hours.append(hour)
-            hour += interval
-        dtype = 'object'
-        as_numpy = False
+    first = timeToEpoch('hour', start_hour)
+    last = timeToEpoch('hour', end_hour)
+    # hours since 1970-01-01T00
+    hours = N.arange(first, last+1, interval, dtype='i8')
+    return formatHours(hours, date_format, as_numpy)
 
-    elif date_format in (int,'int'):
-        while hour <= last_hour:
-            hours.append( (hour.year * 1000000) + (hour.month * 10000) +
-                          (hour.day * 100) + hour.hour )
-            hour += interval
-        dtype = N.dtype(int)
+def formatHours(hours, date_format=None, as_numpy=True):
+    if date_format in ('datetime64', N.datetime64):
+        return _asResult(hours.astype('datetime64[h]'), as_numpy)
 
-    elif date_format == 'tuple':
-        while hour <= last_hour:
-            hours.append((hour.year,hour.month,hour.day,hour.hour))
-            hour += interval
-        dtype = N.dtype( { 'names':['year','month','day','hour'],
-                           'formats':['i2','i2','i2','i2'] } )
+    days, hour = divmod(hours, 24)
+    year, month, day = calendarLookup(days)
+    datetimes = lambda : [ datetime(*date) for date in
+                           zip(year.tolist(), month.tolist(), day.tolist(),
+                               hour.tolist()) ]
 
+    if date_format in (datetime,object,'object'):
+        return tuple(datetimes())
+    elif date_format in (int,'int'):
+        dates = (year.astype(int) * 1000000) + (month.astype(int) * 10000) \
+              + (day.astype(int) * 100) + hour
+        return _asResult(dates.astype(int), as_numpy)
+    elif date_format == 'tuple':
+        dates = _tupleArray(['year','month','day','hour'],
+                            (year, month, day, hour))
+        return _asResult(dates, as_numpy)
     else:
-        if date_format is None: date_format = '%Y-%m-%d-%H'
-        while hour <= last_hour:
-            hours.append(hour.strftime(date_format))
-            hour += interval
-        dtype='|S%d' % len(hours[0])
-
-    if as_numpy: return N.array(hours, dtype=dtype)
-    else: return tuple(hours)
+        if date_format == DATE_STRING_FORMATS['hour']: date_format = None
+        dates = _asStrings((year, month, day, hour), (4,2,2,2), '-',
+                           date_format, datetimes)
+        return _asResult(dates, as_numpy)
 
 DATE_ARRAY_GENERATORS['hour'] = generateHoursArray
+DATE_FORMATTERS['hour'] = formatHours
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 def generateDaysArray(start_date, end_date, **kwargs):
-    first_date = asDatetime(start_date)
-    last_date = asDatetime(end_date)
-    interval = relativedelta(days=int(kwargs.get('interval',1)))
+    interval = int(kwargs.get('interval',1))
     date_format = kwargs.get('date_format', None)
     as_numpy = kwargs.get('as_numpy', True)
 
-    days = [ ]
-    date = first_date
-    if date_format in (datetime,object,'object'):
-        while date <= last_date:
-            days.append(date)
-            date += interval
-        dtype = 'object'
-        as_numpy = False
+    first = timeToEpoch('day', start_date)
+    last = timeToEpoch('day', end_date)
+    # days since 1970-01-01
+    days = N.arange(first, last+1, interval, dtype='i8')
+    return formatDays(days, date_format, as_numpy)
 
-    elif date_format in (int,'int'):
-        while date <= date_hour:
-            days.append( (date.year * 10000) + (date.month * 100) + date.day )
-            date += interval
-        dtype = int
+def formatDays(days, date_format=None, as_numpy=True):
+    if date_format in ('datetime64', N.datetime64):
+        return _asResult(days.astype('datetime64[D]'), as_numpy)
 
-    elif date_format == 'tuple':
-        while date <= last_date:
-            days.append((date.year,date.month,date.day))
-            date += interval
-        dtype = N.dtype( { 'names':['year','month','day'],
-                           'formats':['i2','i2','i2'] } )
+    year, month, day = calendarLookup(days)
+    datetimes = lambda : [ datetime(*date) for date in
+                           zip(year.tolist(), month.tolist(), day.tolist()) ]
 
+    if date_format in (datetime,object,'object'):
+        return tuple(datetimes())
+    elif date_format in (int,'int'):
+        dates = (year.astype(int) * 10000) + (month.astype(int) * 100) + day
+        return _asResult(dates.astype(int), as_numpy)
+    elif date_format == 'tuple':
+        dates = _tupleArray(['year','month','day'], (year, month, day))
+        return _asResult(dates, as_numpy)
     else:
-        if date_format is None: date_format = '%Y-%m-%d'
-        while date <= last_date:
-            days.append(date.strftime(date_format))
-            date += interval
-        dtype='|S%d' % len(days[0])
-
-    if as_numpy: return N.array(days, dtype=dtype)
-    else: return tuple(days)
+        if date_format == DATE_STRING_FORMATS['day']: date_format = None
+        dates = _asStrings((year, month, day), (4,2,2), '-', date_format,
+                           datetimes)
+        return _asResult(dates, as_numpy)
 
 DATE_ARRAY_GENERATORS['day'] = generateDaysArray
+DATE_FORMATTERS['day'] = formatDays
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 def generateMonthsArray(start_date, end_date, **kwargs):
-    first_date = asDatetime(start_date)
-    last_date = asDatetime(end_date)
-    interval = relativedelta(days=int(kwargs.get('interval',1)))
+    interval = int(kwargs.get('interval',1))
     date_format = kwargs.get('date_format', None)
     as_numpy = kwargs.get('as_numpy', True)
 
-    months = [ ]
-    date = first_date
-    if date_format in (datetime,object,'object'):
-        while date <= last_date:
-            months.append(date)
-            date += interval
-        dtype = 'object'
-        as_numpy = False
+    first = timeToEpoch('month', start_date)
+    last = timeToEpoch('month', end_date)
+    # months since 1970-01
+    months = N.arange(first, last+1, interval, dtype='i8')
+    return formatMonths(months, date_format, as_numpy)
 
-    elif date_format in (int,'int'):
-        while date <= last_date:
-            months.append( (date.year * 100) + date.month )
-            date += interval
-        dtype = 'i2'
+def formatMonths(months, date_format=None, as_numpy=True):
+    if date_format in ('datetime64', N.datetime64):
+        return _asResult(months.astype('datetime64[M]'), as_numpy)
 
-    elif date_format == 'tuple':
-        while date <= last_date:
-            months.append((date.year,date.month))
-            date += interval
-        dtype = N.dtype( { 'names':['year','month'],'formats':['i2','i2'] } )
+    year, month = divmod(months + (1970*12), 12)
+    month += 1
+    datetimes = lambda : [ datetime(*date) for date in
+                           zip(year.tolist(), month.tolist(),
+                               [1] * len(months)) ]
 
+    if date_format in (datetime,object,'object'):
+        return tuple(datetimes())
+    elif date_format in (int,'int'):
+        return _asResult(((year * 100) + month).astype(int), as_numpy)
+    elif date_format == 'tuple':
+        dates = _tupleArray(['year','month'], (year, month))
+        return _asResult(dates, as_numpy)
     else:
-        if date_format is None: date_format ='%Y-%m'
-        while date <= last_date:
-            months.append(date.strftime(date_format))
-            date += interval
-        dtype='|S%d' % len(months[0])
-
-    if as_numpy: return N.array(months, dtype=dtype)
-    else: return tuple(months)
+        if date_format == DATE_STRING_FORMATS['month']: date_format = None
+        dates = _asStrings((year, month), (4,2), '-', date_format, datetimes)
+        return _asResult(dates, as_numpy)
 
 DATE_ARRAY_GENERATORS['month'] = generateMonthsArray
+DATE_FORMATTERS['month'] = formatMonths
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 def generateYearsArray(start_year, end_year, **kwargs):
-    first_year = asDatetime(start_year)
-    last_year = asDatetime(end_year)
-    interval = relativedelta(years=int(kwargs.get('interval',1)))
+    interval = int(kwargs.get('interval',1))
     date_format = kwargs.get('date_format', None)
     as_numpy = kwargs.get('as_numpy', True)
 
-    years = [ ]
-    date = first_year
-    if date_format in (datetime,object,'object'):
-        while date <= last_year:
-            years.append(date)
-            date += interval
-        dtype = 'object'
-        as_numpy = False
+    first = timeToEpoch('year', start_year)
+    last = timeToEpoch('year', end_year)
+    # years since 1970
+    years = N.arange(first, last+1, interval, dtype='i8')
+    return formatYears(years, date_format, as_numpy)
 
-    elif date_format in (int,'int'):
-        while date <= last_year:
-            years.append(date.year)
-            date += interval
-        dtype = 'i2'
+def formatYears(years, date_format=None, as_numpy=True):
+    if date_format in ('datetime64', N.datetime64):
+        return _asResult(years.astype('datetime64[Y]'), as_numpy)
 
-    else:
-        if date_format is None: date_format ='%Y'
-        while date <= last_year:
-            years.append(date.strftime(date_format))
-            date += interval
-        dtype='|S%d' % len(years[0])
+    years = years + 1970
 
-    if as_numpy: return N.array(years, dtype=dtype)
-    else: return tuple(years)
+    datetimes = lambda : [ datetime(year, 1, 1) for year in years.tolist() ]
+
+    if date_format in (datetime,object,'object'):
+        return tuple(datetimes())
+    elif date_format in (int,'int'):
+        return _asResult(years.astype('i2'), as_numpy)
+    else:
+        if date_format == DATE_STRING_FORMATS['year']: date_format = None
+        dates = _asStrings((years,), (4,), '', date_format, datetimes)
+        return _asResult(dates, as_numpy)
 
 DATE_ARRAY_GENERATORS['year'] = generateYearsArray
+DATE_FORMATTERS['year'] = formatYears
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -1,10 +1,12 @@
 """ Time Series indexers """
 
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+
+import numpy as N
 
 from rccpy.utils.timeutils import asDatetime
 
+from .generators import epochsToTimes, timeToEpoch, timesToEpochs
 from .iterators import monthsInterval
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -14,9 +16,17 @@ TIME_INDEXERS = { }
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 class TimeIndexer(object):
+    """ Converts times to indexes into a dataset. Times are converted to an
+    integer count of frequency units since 1970-01-01T00 (the epoch), so
+    indexes are simple integer arithmetic. Times that fall between entries
+    map to the next entry.
+    """
+
+    frequency = None
 
     def __init__(self, base_time, interval):
         self.base_time = asDatetime(base_time)
+        self.base_epoch = timeToEpoch(self.frequency, self.base_time)
         self.interval = interval
 
     def __call__(self, interval_start, interval_end=None):
@@ -31,30 +41,38 @@ class TimeIndexer(object):
         return start_index, end_index
 
     def index(self, date_time):
-        raise NotImplementedError
+        return self.indexForEpoch(timeToEpoch(self.frequency, date_time))
 
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    def indexes(self, date_times):
+        """ Returns an array of indexes for an array or sequence of times.
+        """
+        elapsed = timesToEpochs(self.frequency, date_times) - self.base_epoch
+        return -((-elapsed) // self.interval)
 
-class HourIndexer(TimeIndexer):
+    def indexForEpoch(self, epoch):
+        return -((self.base_epoch - epoch) // self.interval)
 
-    def index(self, date_time):
-        _date_time = asDatetime(date_time)
-        if _date_time == self.base_time: return 0
-        delta = _date_time - self.base_time
-        hours = (delta.days * 24) + (delta.seconds / 3600)
-        if (hours % self.interval) == 0: return hours / self.interval 
-        else: return (hours + self.interval) / self.interval
+    def epochs(self, indexes):
+        """ Returns the epoch time for each index in an array.
+        """
+        return self.base_epoch + (N.asarray(indexes, dtype='i8')
+                                  * self.interval)
+
+    def timesAtIndexes(self, indexes, date_format=None):
+        return epochsToTimes(self.frequency, self.epochs(indexes), date_format)
 
     def listDates(self, interval_start, interval_end, interval=None):
-        if interval is None: num_hours = relativedelta(hours=self.interval)
-        else: num_hours = relativedelta(hours=interval)
-        dates = [ ]
-        date = asDatetime(interval_start)
-        while date <= asDatetime(interval_end):
-            dates.append(date)
-            date += num_hours
-        return tuple(dates)
+        if interval is None: interval = self.interval
+        first = timeToEpoch(self.frequency, interval_start)
+        last = timeToEpoch(self.frequency, interval_end)
+        epochs = N.arange(first, last+1, interval, dtype='i8')
+        return epochsToTimes(self.frequency, epochs, datetime)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class HourIndexer(TimeIndexer):
 
+    frequency = 'hour'
 
 TIME_INDEXERS['hour'] = HourIndexer
 
@@ -62,22 +80,7 @@ TIME_INDEXERS['hour'] = HourIndexer
 
 class DayIndexer(TimeIndexer):
 
-    def index(self, date_time):
-        _date_time = asDatetime(date_time)
-        if _date_time == self.base_time: return 0
-        delta = _date_time - self.base_time
-        if (delta.days % self.interval) == 0: return delta.days / self.interval
-        else: return (delta.days + self.interval) / self.interval
-
-    def listDates(self, interval_start, interval_end, interval=None):
-        if interval is None: num_days = relativedelta(days=self.interval)
-        else: num_days = relativedelta(days=interval)
-        dates = [ ]
-        date = asDatetime(interval_start)
-        while date <= asDatetime(interval_end):
-            dates.append(date)
-            date += num_days
-        return tuple(dates)
+    frequency = 'day'
 
 TIME_INDEXERS['day'] = DayIndexer
 
@@ -85,23 +88,7 @@ TIME_INDEXERS['day'] = DayIndexer
 
 class MonthIndexer(TimeIndexer):
 
-    early_errmsg = "Date is earlier than dataset's base date"
-
-    def index(self, date_time):
-        _date_time = asDatetime(date_time)
-        _base_time = self.base_time
-        if _date_time.year == _base_time.year\
-        and _date_time.month == _base_time.month: return 0
-
-        _interval = self.interval
-        # index may be negative if date_time is earlier than base_time
-        years = _date_time.year - _base_time.year
-        if years == 0: # both in same year
-            months = _date_time.month - _base_time.month
-        else: # different years
-            months = (years * 12) + (_date_time.month - _base_time.month)
-        if (months % _interval) == 0: return months / _interval
-        else: return (months + _interval) / _interval
+    frequency = 'month'
 
     def listDates(self, interval_start, interval_end, interval=None):
         if interval is None: _interval = self.interval
@@ -117,6 +104,14 @@ TIME_INDEXERS['month'] = MonthIndexer
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+class YearIndexer(TimeIndexer):
+
+    frequency = 'year'
+
+TIME_INDEXERS['year'] = YearIndexer
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
 def timeIndexer(frequency, base_time, interval):
     IndexerClass = TIME_INDEXERS.get(frequency, None)
     if IndexerClass is None:
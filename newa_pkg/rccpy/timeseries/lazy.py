@@ -0,0 +1,174 @@
+""" Time series that read their data from an HDF5 dataset on demand.
+
+Only the entries that are actually requested are read from the file. Reads
+are rounded out to whole blocks (aligned with the dataset's chunks) and the
+most recently used blocks are kept in a small cache, so stepping through a
+time series one window at a time reads each chunk once while memory use
+stays at a few blocks per time series.
+"""
+
+from collections import OrderedDict
+
+import numpy as N
+
+from .data import TimeSeries
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# used when the dataset is not chunked
+DEFAULT_BLOCK_LENGTH = 8760
+DEFAULT_CACHE_BLOCKS = 4
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class LazyDataArray(object):
+    """ Read only, array-like view of an h5py dataset. Supports len(),
+    integer and slice indexing along the first axis and conversion to a
+    numpy array (which reads everything). transform, when given, is called
+    with every array read from the file and must return an array of the same
+    length, e.g. to serialize the values. attrs describes the values as they
+    are returned (missing, units, value_type ...), the default is the
+    dataset's attributes.
+    """
+
+    def __init__(self, dataset, transform=None,
+                       cache_blocks=DEFAULT_CACHE_BLOCKS, block_length=None,
+                       dtype=None, attrs=None):
+        self.dataset = dataset
+        self.transform = transform
+        if attrs is None: attrs = dict(dataset.attrs)
+        self.attrs = attrs
+        self.shape = dataset.shape
+        self.ndim = len(dataset.shape)
+        self.size = int(N.prod(dataset.shape))
+        if dtype is None: dtype = dataset.dtype
+        self.dtype = N.dtype(dtype)
+
+        if block_length is None:
+            if dataset.chunks is not None: block_length = dataset.chunks[0]
+            else: block_length = DEFAULT_BLOCK_LENGTH
+        self.block_length = max(int(block_length), 1)
+        self.cache_blocks = max(int(cache_blocks), 1)
+        self.cache = OrderedDict()
+        # most recently used block, for fast access to single entries
+        self.current_block = None
+        self.current_start = 0
+        self.current_end = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        data = self._read(0, len(self))
+        if dtype is not None: return data.astype(dtype)
+        return data
+
+    def __getitem__(self, key):
+        if isinstance(key, (int,long,N.integer)):
+            indx = int(key)
+            if indx < 0: indx += len(self)
+            if not (self.current_start <= indx < self.current_end):
+                if indx < 0 or indx >= len(self):
+                    raise IndexError, 'index %d is out of bounds' % key
+                self._setCurrentBlock(indx / self.block_length)
+            return self.current_block[indx - self.current_start]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1: return self._read(start, max(start, stop))
+            if step > 0: return self._read(start, max(start, stop))[::step]
+            return N.asarray(self)[key]
+
+        if isinstance(key, tuple) and key and isinstance(key[0], slice):
+            return self[key[0]][(slice(None),) + key[1:]]
+
+        # index arrays ... read the span that covers them
+        indexes = N.asarray(key)
+        if indexes.dtype == bool: indexes = N.flatnonzero(indexes)
+        indexes = N.where(indexes < 0, indexes + len(self), indexes)
+        if len(indexes) == 0:
+            return N.empty((0,) + self.shape[1:], dtype=self.dtype)
+        first = int(indexes.min())
+        return self._read(first, int(indexes.max()) + 1)[indexes - first]
+
+    def __setitem__(self, key, value):
+        raise TypeError, 'LazyDataArray is read only'
+
+    def clearCache(self):
+        self.cache.clear()
+        self.current_block = None
+        self.current_start = self.current_end = 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _fromFile(self, start, end):
+        data = self.dataset[start:end]
+        if self.transform is not None: data = self.transform(data)
+        return data
+
+    def _getBlock(self, block_num):
+        block = self.cache.get(block_num, None)
+        if block is not None:
+            del self.cache[block_num]
+        else:
+            start = block_num * self.block_length
+            block = self._fromFile(start, min(start + self.block_length,
+                                              len(self)))
+            if len(self.cache) >= self.cache_blocks:
+                self.cache.popitem(last=False)
+        self.cache[block_num] = block
+        return block
+
+    def _read(self, start, end):
+        length = self.block_length
+        first_block = start / length
+        last_block = (end - 1) / length
+        if end <= start:
+            return N.empty((0,) + self.shape[1:], dtype=self.dtype)
+        # reads larger than the cache go straight to the file
+        if (last_block - first_block) >= self.cache_blocks:
+            return self._fromFile(start, end)
+        if first_block == last_block:
+            block = self._getBlock(first_block)
+            offset = first_block * length
+            return block[start-offset:end-offset].copy()
+
+        data = N.empty((end-start,) + self.shape[1:], dtype=self.dtype)
+        for block_num in range(first_block, last_block+1):
+            block = self._getBlock(block_num)
+            offset = block_num * length
+            first = max(start, offset)
+            last = min(end, offset + len(block))
+            data[first-start:last-start] = block[first-offset:last-offset]
+        return data
+
+    def _setCurrentBlock(self, block_num):
+        self.current_block = self._getBlock(block_num)
+        self.current_start = block_num * self.block_length
+        self.current_end = self.current_start + len(self.current_block)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class LazyTimeSeries(TimeSeries):
+
+    def __init__(self, name, dataset, base_time=None, transform=None,
+                       cache_blocks=DEFAULT_CACHE_BLOCKS, **kwargs):
+        """ Time series backed by an h5py dataset (or a LazyDataArray).
+        The frequency, interval, missing value and first time are taken
+        from the data array's attributes unless they are passed as keywords.
+        """
+        if isinstance(dataset, LazyDataArray): data_array = dataset
+        else:
+            data_array = LazyDataArray(dataset, transform, cache_blocks,
+                                       dtype=kwargs.pop('dtype', None),
+                                       attrs=kwargs.pop('attrs', None))
+        # attributes of the values as they are read, not as they are stored
+        attrs = dict(data_array.attrs)
+        attrs.update(kwargs)
+        frequency = str(attrs.get('frequency', 'hour'))
+        attrs['frequency'] = frequency
+        if base_time is None: base_time = tuple(attrs['first_%s' % frequency])
+        TimeSeries.__init__(self, name, base_time, data_array, **attrs)
+
+    def clearCache(self):
+        self.data.clearCache()
@@ -7,9 +7,11 @@ import numpy as N
 
 from rccpy.utils.timeutils import asDatetime
 
+from rccpy.timeseries.data import paddedWindow, TimeSeries
 from rccpy.timeseries.generators import dateArrayGenerator
 from rccpy.timeseries.indexers import timeIndexer
 from rccpy.timeseries.iterators import timeIterator
+from rccpy.timeseries.windows import rollingStatistics, ROLLING_STATISTICS
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -88,8 +90,9 @@ class MultipleTimeSeries(object):
         self.upper_limits = { }
         self.missing_values = { }
 
-        common_start_time = datetime.now()
-        common_end_time = datetime(1000,1,1)
+        # times covered by all of the datasets
+        common_start_time = datetime(1000,1,1)
+        common_end_time = datetime(9999,12,31,23)
 
         for name, data, base_time, data_attrs in data_info:
             self.dataset_names.append(name)
@@ -197,6 +200,8 @@ class MultipleTimeSeries(object):
         self.timeAtIndex = _timeAtIndex
 
         self.generator = dateArrayGenerator(self.frequency)
+        # most recent alignment : ((start_time, end_time, masked), arrays)
+        self.alignment = None
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -218,7 +223,7 @@ class MultipleTimeSeries(object):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def getData(self, start_time, end_time):
+    def getData(self, start_time=None, end_time=None):
         if start_time is None: start_time = self.common_start_time
         if end_time is None: end_time = self.common_end_time
         data = { }
@@ -238,6 +243,40 @@ class MultipleTimeSeries(object):
                              self.missing_values[dataset_name],
                              start_index, end_index)
 
+    def getRollingStatistics(self, dataset_name, width, center=False,
+                                   min_count=1, statistics=ROLLING_STATISTICS):
+        """ Returns a dictionary of arrays with statistics for a window of
+        `width` entries around every entry in one of the datasets.
+        """
+        return rollingStatistics(self.datasets[dataset_name], width,
+                                 self.missing_values[dataset_name], center,
+                                 min_count, statistics)
+
+    def resample(self, reducers=None, frequency='day', day_start_hour=0,
+                       min_coverage=0.):
+        """ Returns a dictionary with a resampled TimeSeries for each
+        dataset. reducers is an optional dictionary of the reducer name (or
+        tuple of names) for each dataset, e.g. { 'pcpn' : 'sum', 'temp' :
+        ('mean','min','max') }. See TimeSeries.resample.
+        """
+        if reducers is None: reducers = { }
+        resampled = { }
+        for name in self.dataset_names:
+            attrs = { 'frequency' : self.frequency, 'interval' : self.interval }
+            if self.missing_values[name] is not None:
+                attrs['missing_value'] = self.missing_values[name]
+            if self.value_types[name] is not None:
+                attrs['value_type'] = (self.value_types[name],
+                                       self.lower_limits[name],
+                                       self.upper_limits[name])
+            time_series = TimeSeries(name, self.base_times[name],
+                                     self.datasets[name], **attrs)
+            resampled[name] = time_series.resample(frequency,
+                                                   reducers.get(name, None),
+                                                   day_start_hour,
+                                                   min_coverage)
+        return resampled
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def getIndexer(self, start_time=None, end_time=None,
@@ -262,70 +301,75 @@ class MultipleTimeSeries(object):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+    def align(self, start_time=None, end_time=None, masked=False):
+        """ Returns a dictionary with an array for each dataset covering the
+        same times, start_time through end_time inclusive (default is the
+        times common to all datasets). Missing values and times outside of a
+        dataset are NaN, or masked when masked is True. Float datasets that
+        use NaN as missing (and masked arrays) are views of the data when
+        the times are inside the dataset. The arrays for the most recent
+        alignment are reused until different times are requested, so treat
+        them as read only.
+        """
+        if start_time is None: start_time = self.common_start_time
+        if end_time is None: end_time = self.common_end_time
+        key = (asDatetime(start_time), asDatetime(end_time), masked)
+        if self.alignment is not None and self.alignment[0] == key:
+            return self.alignment[1]
+
+        aligned = { }
+        for name in self.dataset_names:
+            start_index, end_index = self.indexers[name](start_time, end_time)
+            missing = self.missing_values[name]
+            data, valid = paddedWindow(self.datasets[name], start_index,
+                                       end_index + 1, missing, mask=True)
+            if masked:
+                aligned[name] = N.ma.array(data, mask=~valid, copy=False)
+            elif data.dtype.kind == 'f' and \
+                 (missing is None or N.isnan(missing)) and valid.all():
+                aligned[name] = data
+            else: aligned[name] = N.where(valid, data, N.nan)
+        self.alignment = (key, aligned)
+        return aligned
+
+    def expression(self, dataset_name):
+        """ Returns a SeriesExpression for a dataset. Expressions are combined
+        with the arithmetic, comparison and logical (&, |) operators and
+        calculated by their evaluate method, e.g.
+        (mts.expression('temp') - mts.expression('dewpt') > 5.).evaluate()
+        """
+        if dataset_name not in self.datasets:
+            raise KeyError, 'Unknown dataset : %s' % dataset_name
+        return SeriesExpression(self, None, dataset_name)
+
     def add(self, dataset_name_1, dataset_name_2, start_time=None,
-                  end_time=None):
-        data_1 = self.getDataByName(dataset_name_1, start_index, end_index)
-        data_2 = self.getDataByName(dataset_name_2, start_index, end_index)
-        return data_1 + data_2
+                  end_time=None, out=None):
+        return (self.expression(dataset_name_1) +
+                self.expression(dataset_name_2)).evaluate(start_time,
+                                                          end_time, out)
 
     def difference(self, dataset_name_1, dataset_name_2, start_time=None,
-                         end_time=None):
-        data_1 = self.getDataByName(dataset_name_1, start_index, end_index)
-        data_2 = self.getDataByName(dataset_name_2, start_index, end_index)
-        return data_1 - data_2
+                         end_time=None, out=None):
+        return (self.expression(dataset_name_1) -
+                self.expression(dataset_name_2)).evaluate(start_time,
+                                                          end_time, out)
 
     def divide(self, dataset_name_1, dataset_name_2, start_time=None,
-                     end_time=None):
-        data_1 = self.getDataByName(dataset_name_1, start_index, end_index)
-        data_2 = self.getDataByName(dataset_name_2, start_index, end_index)
-        return data_1 / data_2
+                     end_time=None, out=None):
+        return (self.expression(dataset_name_1) /
+                self.expression(dataset_name_2)).evaluate(start_time,
+                                                          end_time, out)
 
     def multiply(self, dataset_name_1, dataset_name_2, start_time=None,
-                       end_time=None):
-        data_1 = self.getDataByName(dataset_name_1, start_index, end_index)
-        data_2 = self.getDataByName(dataset_name_2, start_index, end_index)
-        return data_1 * data_2
+                       end_time=None, out=None):
+        return (self.expression(dataset_name_1) *
+                self.expression(dataset_name_2)).evaluate(start_time,
+                                                          end_time, out)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def _getData(self, dataset, missing, start_index, end_index):
-        array_size = len(dataset)
-        dtype = dataset.dtype
-
-        if start_index < 0:
-            if end_index < 0:
-                too_early = end_index - start_index
-                return N.array([missing for m in range(too_early)],
-                                dtype=dtype)
-            else:
-                data = [missing for m in range(abs(start_index))]
-                if end_index < array_size:
-                    data.extend(list(dataset[0:end_index]))
-                else:
-                    data.extend(list(dataset[:]))
-                    if end_index > array_size:
-                        overflow = end_index - array_size 
-                        data.extend([missing for m in range(overflow)])
-                return N.array(data, dtype=dtype)
-
-        elif start_index < array_size:
-            if end_index < array_size:
-                return dataset[start_index:end_index]
-            elif end_index == array_size:
-                return dataset[start_index:]
-            else: # end_index > array_size
-                print 'end_index > array_size', end_index, array_size
-                data = list(dataset[start_index:])
-                overflow = end_index - array_size
-                data.extend([missing for m in range(overflow)])
-                return N.array(data, dtype=dtype)
-
-        else: # start_index is beyond end of available data
-            msg = 'start_index is beyond end of available data'
-            print msg, start_index, array_size
-            over_the_top = end_index - start_index
-            return N.array([missing for m in range(over_the_top)],
-                            dtype=dtype)
+        return paddedWindow(dataset, start_index, end_index, missing)
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -388,3 +432,106 @@ class MultiTimeSeriesDataIterator(object):
         self.latest_interval = self.iterator.next()
         return self.time_series.getData(*self.latest_interval)
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+EXPRESSION_UFUNCS = { '+' : N.add, '-' : N.subtract, '*' : N.multiply,
+                      '/' : N.true_divide, '>' : N.greater,
+                      '>=' : N.greater_equal, '<' : N.less,
+                      '<=' : N.less_equal, '==' : N.equal, '!=' : N.not_equal,
+                      '&' : N.logical_and, '|' : N.logical_or,
+                      'neg' : N.negative, 'abs' : N.absolute }
+# operators with boolean results
+EXPRESSION_LOGICAL = ('>','>=','<','<=','==','!=','&','|')
+
+class SeriesExpression(object):
+
+    def __init__(self, time_series, operator, *operands):
+        """ Deferred calculation over the aligned datasets in a
+        MultipleTimeSeries. Leaf expressions (operator None) have a dataset
+        name as their only operand, other operands are expressions or
+        scalars. Arithmetic results are float arrays that are NaN where any
+        input is missing. Comparisons of missing values are False.
+        """
+        self.time_series = time_series
+        self.operator = operator
+        self.operands = operands
+
+    def evaluate(self, start_time=None, end_time=None, out=None):
+        """ Calculates the expression for start_time through end_time
+        (default is the times common to all datasets). Arithmetic is done in
+        place in a single output array (out when it is passed) so a chain of
+        operations does not create a temporary array for each step.
+        """
+        aligned = self.time_series.align(start_time, end_time)
+        return self._evaluate(aligned, out)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def __add__(self, other): return self._binary('+', self, other)
+    def __radd__(self, other): return self._binary('+', other, self)
+    def __sub__(self, other): return self._binary('-', self, other)
+    def __rsub__(self, other): return self._binary('-', other, self)
+    def __mul__(self, other): return self._binary('*', self, other)
+    def __rmul__(self, other): return self._binary('*', other, self)
+    def __div__(self, other): return self._binary('/', self, other)
+    def __rdiv__(self, other): return self._binary('/', other, self)
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+    def __gt__(self, other): return self._binary('>', self, other)
+    def __ge__(self, other): return self._binary('>=', self, other)
+    def __lt__(self, other): return self._binary('<', self, other)
+    def __le__(self, other): return self._binary('<=', self, other)
+    def __eq__(self, other): return self._binary('==', self, other)
+    def __ne__(self, other): return self._binary('!=', self, other)
+    def __and__(self, other): return self._binary('&', self, other)
+    def __or__(self, other): return self._binary('|', self, other)
+    def __neg__(self): return SeriesExpression(self.time_series, 'neg', self)
+    def __abs__(self): return SeriesExpression(self.time_series, 'abs', self)
+
+    def __repr__(self):
+        if self.operator is None: return self.operands[0]
+        if len(self.operands) == 1:
+            return '%s(%s)' % (self.operator, repr(self.operands[0]))
+        return '(%s %s %s)' % (repr(self.operands[0]), self.operator,
+                               repr(self.operands[1]))
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _binary(self, operator, left, right):
+        return SeriesExpression(self.time_series, operator, left, right)
+
+    def _evaluate(self, aligned, out=None):
+        """ Returns the result of the expression, using out for the result
+        of arithmetic operations when it is not None. Leaf expressions
+        return the aligned array itself.
+        """
+        if self.operator is None: return aligned[self.operands[0]]
+        ufunc = EXPRESSION_UFUNCS[self.operator]
+        if out is None and self.operator not in EXPRESSION_LOGICAL:
+            out = N.empty(len(aligned.values()[0]), dtype=float)
+        operands = [ ]
+        for index, operand in enumerate(self.operands):
+            if isinstance(operand, SeriesExpression):
+                # only the first operand may use the output array
+                if index == 0 and self.operator not in EXPRESSION_LOGICAL:
+                    operand = operand._evaluate(aligned, out)
+                else: operand = operand._evaluate(aligned)
+            operands.append(operand)
+
+        if self.operator in EXPRESSION_LOGICAL:
+            if self.operator in ('&','|'):
+                return ufunc(*operands)
+            # NaN comparisons are False without a floating point warning
+            errors = N.seterr(invalid='ignore')
+            try: result = ufunc(*operands)
+            finally: N.seterr(**errors)
+            if self.operator == '!=':
+                # NaN != x is True, missing values must be False here too
+                for operand in operands:
+                    if isinstance(operand, N.ndarray) \
+                    and operand.dtype.kind == 'f':
+                        result &= ~N.isnan(operand)
+            return result
+
+        return ufunc(*(operands + [out]))
+
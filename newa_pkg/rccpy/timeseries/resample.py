@@ -0,0 +1,157 @@
+""" Resampling of hourly and daily time series to daily or monthly periods.
+
+Each source entry is labeled with the period it falls in and every period
+is reduced with a single reduceat pass over the whole array, so all days
+(or months) of one or many time series are calculated at once. Days may
+start at any hour, e.g. an observation day that starts at 8 AM includes the
+hours from 8 AM on the previous date through 7 AM, and is labeled with the
+date that it ends on.
+"""
+
+import numpy as N
+
+from .generators import calendarLookup, daysFromCivil, timeToEpoch
+from .windows import validMask
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+RESAMPLE_REDUCERS = { }
+RESAMPLE_FREQUENCIES = { 'hour' : ('day','month'), 'day' : ('month',) }
+# mean directions are rounded to this many decimal places
+VECTOR_MEAN_DECIMALS = 6
+
+def _sumReducer(values, valid, starts, axis):
+    return N.add.reduceat(N.where(valid, values, 0.), starts, axis=axis)
+RESAMPLE_REDUCERS['sum'] = _sumReducer
+
+def _meanReducer(values, valid, starts, axis):
+    counts = N.add.reduceat(valid.astype(int), starts, axis=axis)
+    return _sumReducer(values, valid, starts, axis) / N.maximum(counts, 1)
+RESAMPLE_REDUCERS['mean'] = _meanReducer
+
+def _minReducer(values, valid, starts, axis):
+    return N.minimum.reduceat(N.where(valid, values, N.inf), starts,
+                              axis=axis)
+RESAMPLE_REDUCERS['min'] = _minReducer
+
+def _maxReducer(values, valid, starts, axis):
+    return N.maximum.reduceat(N.where(valid, values, -N.inf), starts,
+                              axis=axis)
+RESAMPLE_REDUCERS['max'] = _maxReducer
+
+def _countReducer(values, valid, starts, axis):
+    return N.add.reduceat(valid.astype(int), starts, axis=axis).astype(float)
+RESAMPLE_REDUCERS['count'] = _countReducer
+
+def _vectorMeanReducer(values, valid, starts, axis):
+    """ mean direction (degrees) of unit vectors """
+    radians = N.radians(N.where(valid, values, 0.))
+    sines = N.add.reduceat(N.where(valid, N.sin(radians), 0.), starts,
+                           axis=axis)
+    cosines = N.add.reduceat(N.where(valid, N.cos(radians), 0.), starts,
+                             axis=axis)
+    directions = N.round(N.degrees(N.arctan2(sines, cosines)) % 360.,
+                         VECTOR_MEAN_DECIMALS)
+    # normalize after rounding, means just below north are 0. not 360.
+    return N.where(directions >= 360., directions - 360., directions)
+RESAMPLE_REDUCERS['vector_mean'] = _vectorMeanReducer
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def periodLabels(source_frequency, base_time, interval, num_entries,
+                 frequency='day', day_start_hour=0):
+    """ Returns (labels, expected) where labels is the day or month epoch
+    of the period that each source entry falls in and expected is a
+    function that returns the number of source entries in a full period
+    for an array of labels.
+    """
+    if frequency not in RESAMPLE_FREQUENCIES.get(source_frequency, ()):
+        errmsg = "Can not resample '%s' data to '%s'"
+        raise ValueError, errmsg % (source_frequency, frequency)
+    epochs = timeToEpoch(source_frequency, base_time) \
+           + (N.arange(num_entries, dtype='i8') * interval)
+
+    if source_frequency == 'hour':
+        shift = (24 - int(day_start_hour)) % 24
+        days = (epochs + shift) // 24
+        units_per_day = 24
+    else:
+        shift = 0
+        days = epochs
+        units_per_day = 1
+
+    if frequency == 'day':
+        def expected(labels):
+            return N.ones(len(labels)) * (float(units_per_day) / interval)
+        return days, expected
+
+    year, month, day = calendarLookup(days)
+    months = ((year.astype('i8') - 1970) * 12) + month - 1
+    def expected(labels):
+        year, month = divmod(labels + (1970*12), 12)
+        first = daysFromCivil(year, month + 1, 1)
+        year, month = divmod(labels + 1 + (1970*12), 12)
+        last = daysFromCivil(year, month + 1, 1)
+        return ((last - first) * units_per_day) / float(interval)
+    return months, expected
+
+def resampleArray(data, source_frequency, base_time, interval=1,
+                  missing=None, frequency='day', reducer='mean',
+                  day_start_hour=0, min_coverage=0., axis=0, fill=N.nan):
+    """ Reduces the entries of data in each day or month. Time is along
+    axis, so a stations x hours array can be resampled with axis=1.
+    reducer is the name of a function in RESAMPLE_REDUCERS ('sum', 'mean',
+    'min', 'max', 'count' or 'vector_mean'). Periods where the fraction of
+    valid entries is less than min_coverage, or that have no valid entries,
+    are set to fill. Returns (first_period, result, coverage) where
+    first_period is the day or month epoch of the first period and coverage
+    is the number of valid entries in each period.
+    """
+    reduce_ = RESAMPLE_REDUCERS.get(reducer, None)
+    if reduce_ is None:
+        raise KeyError, "Unknown resample reducer : '%s'" % reducer
+    data = N.asarray(data)
+    axis = axis % data.ndim
+    labels, expected = periodLabels(source_frequency, base_time, interval,
+                                    data.shape[axis], frequency,
+                                    day_start_hour)
+    if len(labels) == 0:
+        raise ValueError, 'Can not resample an empty array.'
+
+    starts = N.concatenate(([0], N.flatnonzero(N.diff(labels)) + 1))
+    periods = labels[starts]
+    first_period = int(periods[0])
+    num_periods = int(periods[-1]) - first_period + 1
+
+    valid = validMask(data, missing)
+    values = data.astype(float)
+    reduced = reduce_(values, valid, starts, axis)
+    counts = N.add.reduceat(valid.astype(int), starts, axis=axis)
+
+    # broadcast the per period coverage along the time axis
+    shape = [1] * data.ndim
+    shape[axis] = len(periods)
+    coverage = counts / expected(periods).reshape(shape)
+    usable = (counts > 0) & (coverage >= min_coverage)
+    reduced = N.where(usable, reduced, fill)
+
+    # periods that have no entries at all (intervals longer than a period)
+    out_shape = list(data.shape)
+    out_shape[axis] = num_periods
+    result = N.empty(out_shape, dtype=float)
+    result.fill(fill)
+    num_valid = N.zeros(out_shape, dtype=int)
+    index = [slice(None)] * data.ndim
+    index[axis] = periods - first_period
+    result[tuple(index)] = reduced
+    num_valid[tuple(index)] = counts
+    return first_period, result, num_valid
+
+def periodAsTime(frequency, period):
+    """ Returns the date tuple of a day or month epoch.
+    """
+    if frequency == 'day':
+        year, month, day = calendarLookup(N.array([period]))
+        return (int(year[0]), int(month[0]), int(day[0]))
+    year, month = divmod(int(period) + (1970*12), 12)
+    return (year, month + 1)
@@ -0,0 +1,137 @@
+""" Conversion of hourly times and data between UTC and local standard time.
+
+Local standard time (LST) never observes daylight savings time, so it is
+always UTC plus the station's gmt offset (e.g. -5 for Eastern Standard Time).
+Times are converted as integer hour epochs, so whole axes and the windows
+of many stations are converted with a single array operation. Data rows are
+moved to the other time base with a single gather.
+"""
+
+from datetime import datetime
+
+import numpy as N
+
+from .generators import epochsToTimes, timesToEpochs, timeToEpoch
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# gmt offset used for stations with unknown offsets in the station index
+MISSING_GMT = -32768
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def gmtOffsets(gmt):
+    """ Returns (offsets, valid) where offsets is an integer array of gmt
+    offsets (0 where unknown) and valid is True for the known offsets.
+    """
+    gmt = N.asarray(gmt, dtype=int)
+    valid = (gmt != MISSING_GMT) & (N.absolute(gmt) <= 14)
+    return N.where(valid, gmt, 0), valid
+
+def lstToUtc(hours, gmt):
+    """ Converts hour epochs in local standard time to UTC. hours and gmt
+    are broadcast, so an axis can be converted for many stations at once
+    with hours[N.newaxis,:] and gmt[:,N.newaxis].
+    """
+    return N.asarray(hours, dtype='i8') - N.asarray(gmt, dtype='i8')
+
+def utcToLst(hours, gmt):
+    """ Converts UTC hour epochs to local standard time.
+    """
+    return N.asarray(hours, dtype='i8') + N.asarray(gmt, dtype='i8')
+
+def lstTimesToUtc(times, gmt, date_format=None):
+    """ Same as lstToUtc for an array or sequence of hourly times, returns
+    times in any of the date formats supported by epochsToTimes.
+    """
+    return epochsToTimes('hour', lstToUtc(timesToEpochs('hour', times), gmt),
+                         date_format)
+
+def utcTimesToLst(times, gmt, date_format=None):
+    return epochsToTimes('hour', utcToLst(timesToEpochs('hour', times), gmt),
+                         date_format)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def lstWindowsToUtc(start_hour, end_hour, gmt, date_format=None):
+    """ Returns (start_hours, end_hours) in UTC for the same local standard
+    time window at each station in gmt. Times are hour epochs unless a
+    date_format is passed. Offsets must be known (see gmtOffsets).
+    """
+    start = lstToUtc(timeToEpoch('hour', start_hour), N.atleast_1d(gmt))
+    end = lstToUtc(timeToEpoch('hour', end_hour), N.atleast_1d(gmt))
+    if date_format is None: return start, end
+    return (epochsToTimes('hour', start, date_format),
+            epochsToTimes('hour', end, date_format))
+
+def utcWindowsToLst(start_hour, end_hour, gmt, date_format=None):
+    """ Returns (start_hours, end_hours) in local standard time for the same
+    UTC window at each station in gmt.
+    """
+    start = utcToLst(timeToEpoch('hour', start_hour), N.atleast_1d(gmt))
+    end = utcToLst(timeToEpoch('hour', end_hour), N.atleast_1d(gmt))
+    if date_format is None: return start, end
+    return (epochsToTimes('hour', start, date_format),
+            epochsToTimes('hour', end, date_format))
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def shiftRows(data, shifts, missing, length=None):
+    """ Returns an array where entry i of each row is entry i + shift of
+    the same row in data (a 1D array or a stations x hours array), for an
+    output of length hours (default is the same as data). Entries that come
+    from outside of data are set to missing.
+    """
+    data = N.asarray(data)
+    one_row = data.ndim == 1
+    if one_row: data = data[N.newaxis,:]
+    if length is None: length = data.shape[1]
+    shifts = N.asarray(shifts, dtype=int).reshape(-1, 1)
+    columns = N.arange(length)[N.newaxis,:] + shifts
+    inside = (columns >= 0) & (columns < data.shape[1])
+    rows = N.arange(data.shape[0])[:,N.newaxis]
+    shifted = data[rows, N.clip(columns, 0, max(data.shape[1]-1, 0))]
+    shifted[~inside] = missing
+    if one_row: return shifted[0]
+    return shifted
+
+def lstRowsToUtc(data, gmt, missing, length=None):
+    """ Moves rows of hourly data in local standard time onto a UTC axis
+    that has the same hour labels, i.e. entry i of the result is the UTC
+    hour with the same epoch as LST hour i in data. Rows for stations with
+    an unknown gmt offset are missing.
+    """
+    offsets, valid = gmtOffsets(gmt)
+    shifted = shiftRows(data, offsets, missing, length)
+    if shifted.ndim == 1:
+        if not valid.all(): shifted.fill(missing)
+    else: shifted[~valid.ravel()] = missing
+    return shifted
+
+def utcRowsToLst(data, gmt, missing, length=None):
+    """ Reverse of lstRowsToUtc.
+    """
+    offsets, valid = gmtOffsets(gmt)
+    shifted = shiftRows(data, -offsets, missing, length)
+    if shifted.ndim == 1:
+        if not valid.all(): shifted.fill(missing)
+    else: shifted[~valid.ravel()] = missing
+    return shifted
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def timeSeriesToUtc(time_series, gmt):
+    """ Returns an hourly TimeSeries in local standard time as a TimeSeries
+    in UTC. Only the base time changes, the data is shared.
+    """
+    return time_series.withBaseTime(_shiftedBaseTime(time_series, -int(gmt)))
+
+def timeSeriesToLst(time_series, gmt):
+    return time_series.withBaseTime(_shiftedBaseTime(time_series, int(gmt)))
+
+def _shiftedBaseTime(time_series, hours):
+    if time_series.frequency != 'hour':
+        errmsg = "Time zone conversion requires 'hour' frequency, not '%s'"
+        raise ValueError, errmsg % time_series.frequency
+    epoch = timeToEpoch('hour', time_series.base_time) + hours
+    return epochsToTimes('hour', [epoch], datetime)[0]
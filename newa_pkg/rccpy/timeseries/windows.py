@@ -0,0 +1,171 @@
+""" Rolling window statistics for time series arrays.
+
+Every statistic is calculated for all windows in a single pass over the
+data. Counts, sums and variances are differences of cumulative sums. Window
+minimums and maximums use the van Herk/Gil-Werman block algorithm, which
+needs three comparisons per entry regardless of the window width.
+
+Missing values (the missing value, NaN or infinity) are ignored, so each
+window only includes the valid entries that it covers.
+"""
+
+import numpy as N
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+ROLLING_STATISTICS = ('count','sum','mean','variance','stddev','min','max')
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def windowExtents(width, center=False):
+    """ Returns the number of entries (before, after) each entry that are
+    included in its window. Trailing windows end at the entry, centered
+    windows put any extra entry before it.
+    """
+    width = int(width)
+    if width < 1:
+        raise ValueError, 'Window width must be at least 1 : %d' % width
+    if center:
+        after = (width - 1) / 2
+        return width - 1 - after, after
+    return width - 1, 0
+
+def validMask(data, missing=None):
+    """ Returns a boolean array that is True for valid entries in data.
+    """
+    data = N.asarray(data)
+    if data.dtype.kind == 'f': valid = N.isfinite(data)
+    else: valid = N.ones(data.shape, dtype=bool)
+    if missing is not None and N.isfinite(missing):
+        valid &= data != missing
+    return valid
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _windowDiff(cumulative, before, after):
+    """ Differences of a cumulative sum (with a leading zero) over windows
+    that are clipped at the ends of the array.
+    """
+    size = len(cumulative) - 1
+    indexes = N.arange(size)
+    first = N.maximum(indexes - before, 0)
+    last = N.minimum(indexes + after + 1, size)
+    return cumulative[last] - cumulative[first]
+
+def _cumulative(values):
+    cumulative = N.zeros(len(values)+1, dtype=values.dtype)
+    N.cumsum(values, out=cumulative[1:])
+    return cumulative
+
+def _windowExtreme(values, before, after, ufunc, pad_value):
+    """ van Herk/Gil-Werman running extreme. ufunc is N.maximum or
+    N.minimum and pad_value is its identity (-inf or inf).
+    """
+    size = len(values)
+    width = before + after + 1
+    if width == 1: return values.copy()
+    # pad so that window i starts at padded index i and the padded array
+    # is a whole number of blocks
+    num_blocks = (size + width - 1) / width + 1
+    padded = N.empty(num_blocks * width, dtype=values.dtype)
+    padded.fill(pad_value)
+    padded[before:before+size] = values
+    blocks = padded.reshape(num_blocks, width)
+    # extreme from the start of each block and from the end of each block
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:,::-1], axis=1)[:,::-1].ravel()
+    starts = N.arange(size)
+    return ufunc(suffix[starts], prefix[starts + width - 1])
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def rollingSums(data, width, missing=None, center=False):
+    """ Returns (count, sum, squares, offset) for the valid values in each
+    window. squares is the sum of squared differences from offset, the mean
+    of all valid values in data, which keeps the variance accurate. Counts,
+    sums and squares are additive, so windows from the same data can be
+    combined before the final statistics are calculated.
+    """
+    before, after = windowExtents(width, center)
+    data = N.asarray(data)
+    valid = validMask(data, missing)
+    values = N.where(valid, data, 0.).astype(float)
+    count = _windowDiff(_cumulative(valid.astype(int)), before, after)
+    if valid.any(): offset = values[valid].mean()
+    else: offset = 0.
+    shifted = N.where(valid, values - offset, 0.)
+    total = _windowDiff(_cumulative(shifted), before, after)
+    squares = _windowDiff(_cumulative(shifted * shifted), before, after)
+    return count, total + (count * offset), squares, offset
+
+def rollingStatistics(data, width, missing=None, center=False, min_count=1,
+                      statistics=ROLLING_STATISTICS, fill=N.nan):
+    """ Returns a dictionary with an array for each of the requested
+    statistics ('count', 'sum', 'mean', 'variance', 'stddev', 'min', 'max')
+    of the valid values in a window around every entry in data. Windows
+    with fewer than min_count valid values are set to fill. Windows are
+    clipped at the ends of the array. Variance is the population variance,
+    the same as N.var.
+    """
+    for name in statistics:
+        if name not in ROLLING_STATISTICS:
+            raise KeyError, "Unknown rolling statistic : '%s'" % name
+    before, after = windowExtents(width, center)
+    data = N.asarray(data)
+    results = { }
+
+    count, total, squares, offset = rollingSums(data, width, missing, center)
+    enough = count >= max(min_count, 1)
+    safe_count = N.where(enough, count, 1)
+
+    if 'count' in statistics: results['count'] = count
+    if 'sum' in statistics:
+        results['sum'] = N.where(enough, total, fill)
+    if 'mean' in statistics:
+        results['mean'] = N.where(enough, total / safe_count, fill)
+    if 'variance' in statistics or 'stddev' in statistics:
+        shifted_mean = (total / safe_count) - offset
+        variance = (squares / safe_count) - (shifted_mean * shifted_mean)
+        variance = N.where(variance > 0., variance, 0.)
+        if 'variance' in statistics:
+            results['variance'] = N.where(enough, variance, fill)
+        if 'stddev' in statistics:
+            results['stddev'] = N.where(enough, N.sqrt(variance), fill)
+
+    if 'min' in statistics or 'max' in statistics:
+        valid = validMask(data, missing)
+        values = data.astype(float)
+        if 'min' in statistics:
+            minimum = _windowExtreme(N.where(valid, values, N.inf), before,
+                                     after, N.minimum, N.inf)
+            results['min'] = N.where(enough, minimum, fill)
+        if 'max' in statistics:
+            maximum = _windowExtreme(N.where(valid, values, -N.inf), before,
+                                     after, N.maximum, -N.inf)
+            results['max'] = N.where(enough, maximum, fill)
+
+    return results
+
+def rollingCount(data, width, missing=None, center=False):
+    return rollingStatistics(data, width, missing, center, 0,
+                             ('count',))['count']
+
+def rollingSum(data, width, missing=None, center=False, min_count=1):
+    return rollingStatistics(data, width, missing, center, min_count,
+                             ('sum',))['sum']
+
+def rollingMean(data, width, missing=None, center=False, min_count=1):
+    return rollingStatistics(data, width, missing, center, min_count,
+                             ('mean',))['mean']
+
+def rollingVariance(data, width, missing=None, center=False, min_count=1):
+    return rollingStatistics(data, width, missing, center, min_count,
+                             ('variance',))['variance']
+
+def rollingMin(data, width, missing=None, center=False, min_count=1):
+    return rollingStatistics(data, width, missing, center, min_count,
+                             ('min',))['min']
+
+def rollingMax(data, width, missing=None, center=False, min_count=1):
+    return rollingStatistics(data, width, missing, center, min_count,
+                             ('max',))['max']
@@ -79,6 +79,36 @@ def convertUnits(data, from_units, to_units):
         elif data.dtype.kind == 'i': data *= int(to_scale)
     return data
 
+IN_PLACE_CONVERSIONS = { }
+
+def getInPlaceConversion(from_units, to_units):
+    """ Returns a function that converts a float array from from_units to
+    to_units in place, using the same operations as convertUnits so the
+    results are identical. Returns None when either of the units is None
+    or the conversion would not change the data.
+    """
+    if from_units is None or to_units is None: return None
+    key = (from_units, to_units)
+    if key in IN_PLACE_CONVERSIONS: return IN_PLACE_CONVERSIONS[key]
+
+    convert = None
+    if from_units != to_units:
+        if '*' in from_units: from_units, from_scale = from_units.split('*')
+        else: from_scale = None
+        if '*' in to_units: to_units, to_scale = to_units.split('*')
+        else: to_scale = None
+        func = CONVERSION_FUNCS.get('%s_%s' % (from_units,to_units), None)
+
+        if from_scale is not None or func is not None or to_scale is not None:
+            def convert(data):
+                if from_scale is not None: data /= float(from_scale)
+                if func is not None: data[...] = func(data)
+                if to_scale is not None: data *= float(to_scale)
+                return data
+
+    IN_PLACE_CONVERSIONS[key] = convert
+    return convert
+
 def getConversionFunction(from_units, to_units):
     if from_units is not None and to_units is not None:
         def convert(data): return convertUnits(data, from_units, to_units)